@@ -0,0 +1,755 @@
+# carsim benchmarks
+# Run with: python bench.py
+#
+# Every number printed is also recorded under a name, so runs can be saved and
+# compared. Speedups must not change results: golden.json holds the summary
+# results of a set of cars, checked on every run along with the engine parity.
+#
+#   python bench.py --json bench.json                 # save this run
+#   python bench.py --baseline bench.json             # flag what got >20% worse
+#   python bench.py --update-golden                   # after a deliberate physics change
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+from scipy.interpolate import interp1d
+
+import carsim
+
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden.json")
+GOLDEN_KEYS = ("quarter_time", "quarter_speed", "0-60 mph", "0-100 km/h", "eighth_time", "eighth_speed")
+
+# name -> {"value", "unit", "better"} for everything measured in this run,
+# and name -> passed for the checks
+RESULTS = {}
+CHECKS = {}
+
+
+def record(name, value, unit, better="higher"):
+    RESULTS[name] = {"value": float(value), "unit": unit, "better": better}
+
+
+def check(name, passed):
+    CHECKS[name] = bool(passed)
+    return passed
+
+
+# calc_power as it was before TorqueCurve, kept as the reference to measure against
+def calc_power_interp1d(car, rpm):
+    torque_curve = car["torque_curve"]
+    torque_curve_rpm = [x[0] for x in torque_curve]
+    torque_curve_nm = [x[1] for x in torque_curve]
+
+    torque_interp = interp1d(torque_curve_rpm, torque_curve_nm, kind='cubic')
+    torque = torque_interp(rpm)
+    power = torque * rpm * 2 * np.pi / 60
+
+    return power
+
+
+# Best of `repeat` timings of fn(), in seconds per call
+def timeit(fn, number, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def bench_calc_power(car):
+    rpms = np.linspace(2500, car["redline"] - 300, 1000).tolist()
+    curve = carsim.get_torque_curve(car)
+
+    def old():
+        for rpm in rpms:
+            calc_power_interp1d(car, rpm)
+
+    def new():
+        for rpm in rpms:
+            curve.power(rpm)
+
+    old_step = timeit(old, 1, repeat=3) / len(rpms)
+    new_step = timeit(new, 1) / len(rpms)
+    array = timeit(lambda: curve.power(np.asarray(rpms)), 100) / len(rpms)
+
+    print(f"calc_power per step:\t{old_step * 1e6:8.2f} us interp1d,\t{new_step * 1e6:8.2f} us TorqueCurve\t({old_step / new_step:.0f}x)")
+    print(f"calc_power array:\t{array * 1e9:8.2f} ns per rpm")
+    record("calc_power", new_step * 1e6, "us/call", "lower")
+    record("calc_power array", array * 1e9, "ns/rpm", "lower")
+
+
+def bench_calc_rpm(car):
+    speeds = np.linspace(1, 60, 1000).tolist()
+    ratio = car["gear_ratios"][0]
+
+    def run():
+        for v in speeds:
+            carsim.calc_rpm(v, ratio, car["final_drive"], car["tire_diameter"])
+
+    call = timeit(run, 1) / len(speeds)
+    print(f"calc_rpm:\t\t{call * 1e6:8.2f} us/call")
+    record("calc_rpm", call * 1e6, "us/call", "lower")
+
+
+def bench_simulate(cars):
+    for car in cars:
+        run = timeit(lambda: carsim.simulate_quarter_mile(car), 1)
+        steps = len(carsim.simulate_quarter_mile(car)["time_data"])
+        print(f"{car['Name']:<24}{run * 1e3:8.2f} ms/run\t{run / steps * 1e6:6.2f} us/step")
+        record(f"simulate {car['Name']}", steps / run, "steps/s")
+
+
+# n random variants of the given cars, for fleet sized benchmarks
+def synthetic_fleet(cars, n, seed=0):
+    rng = np.random.default_rng(seed)
+    fleet = []
+    for i in range(n):
+        car = dict(cars[i % len(cars)].data)
+        car["W"] *= rng.uniform(0.9, 1.1)
+        car["final_drive"] *= rng.uniform(0.9, 1.1)
+        car["mu"] *= rng.uniform(0.9, 1.1)
+        fleet.append(car)
+    return fleet
+
+
+def check_batch_parity(cars, tolerance=1e-9):
+    batch = carsim.simulate_quarter_mile_batch(cars)
+    worst = 0
+    for i, car in enumerate(cars):
+        data = carsim.simulate_quarter_mile(car)
+        for key in ("quarter_time", "quarter_speed", "0-60 mph"):
+            worst = max(worst, abs(data[key] - batch[key][i]))
+
+    status = "ok" if worst <= tolerance else "FAILED"
+    print(f"batch vs scalar:\t{len(cars)} cars, max difference {worst:.2e} ({status})")
+    return check("batch parity", worst <= tolerance)
+
+
+def check_kernel_parity(cars, tolerance=1e-9):
+    import kernel
+
+    fleet = kernel.simulate_fleet_kernel(cars)
+    worst = 0
+    for i, car in enumerate(cars):
+        data = carsim.simulate_quarter_mile(car, record=False)
+        single = kernel.simulate_kernel(car)
+        for key in ("quarter_time", "quarter_speed", "0-60 mph"):
+            worst = max(worst, abs(data[key] - single[key]), abs(data[key] - fleet[key][i]))
+
+    status = "ok" if worst <= tolerance else "FAILED"
+    engine = "numba" if kernel.HAVE_NUMBA else "python fallback"
+    print(f"kernel vs scalar:\t{len(cars)} cars ({engine}), max difference {worst:.2e} ({status})")
+    return check("kernel parity", worst <= tolerance)
+
+
+# The streaming generator against simulate_quarter_mile, every step and summary
+def check_stream_parity(cars, tolerance=1e-9):
+    worst = 0
+    columns = {"t": "time_data", "v": "velocity_data", "d": "distance_data",
+               "a": "acceleration_data", "rpm": "rpm_data", "power": "power_data"}
+
+    for car in cars:
+        data = carsim.simulate_quarter_mile(car)
+        run = carsim.QuarterMileRun(car)
+        samples = np.array(list(run))[:, [carsim.SAMPLE_FIELDS.index(field) for field in columns]]
+        if samples.shape[0] != len(data["time_data"]) or run.result["shift_times"] != data["shift_times"]:
+            worst = np.inf
+            continue
+
+        for column, key in enumerate(columns.values()):
+            worst = max(worst, np.max(np.abs(samples[:, column] - data[key])))
+        for key in ("quarter_time", "quarter_speed", "0-60 mph", "eighth_time"):
+            worst = max(worst, abs(run.result[key] - data[key]))
+
+    status = "ok" if worst <= tolerance else "FAILED"
+    print(f"stream vs scalar:\t{len(cars)} cars, max difference {worst:.2e} ({status})")
+    return check("stream parity", worst <= tolerance)
+
+
+# The instrumented loop in profiling.py against simulate_quarter_mile
+def check_profiled_parity(cars, tolerance=1e-9):
+    import profiling
+
+    plain = [carsim.simulate_quarter_mile(car) for car in cars]
+    with profiling.Profiler():
+        profiled = [carsim.simulate_quarter_mile(car) for car in cars]
+
+    worst = 0
+    for data, other in zip(plain, profiled):
+        if len(data["time_data"]) != len(other["time_data"]) or data["shift_times"] != other["shift_times"]:
+            worst = np.inf
+            continue
+        for key in ("time_data", "velocity_data", "distance_data", "power_data", "rpm_data"):
+            worst = max(worst, np.max(np.abs(data[key] - other[key])))
+        for key in ("quarter_time", "quarter_speed", "0-60 mph"):
+            worst = max(worst, abs(data[key] - other[key]))
+
+    status = "ok" if worst <= tolerance else "FAILED"
+    print(f"profiled vs scalar:\t{len(cars)} cars, max difference {worst:.2e} ({status})")
+    return check("profiled parity", worst <= tolerance)
+
+
+def bench_kernel(cars, n=10000):
+    import kernel
+
+    single = timeit(lambda: kernel.simulate_kernel(cars[0]), 10)
+    print(f"kernel:\t\t\t{1 / single:10.0f} runs/s")
+    record("kernel", 1 / single, "runs/s")
+
+    fleet = synthetic_fleet(cars, n)
+    run = timeit(lambda: kernel.simulate_fleet_kernel(fleet), 1, repeat=3)
+    print(f"kernel fleet of {n}:\t{n / run:10.0f} runs/s")
+    record(f"kernel fleet of {n}", n / run, "runs/s")
+
+
+def bench_batch(cars, sizes=(1, 100, 1000, 10000)):
+    scalar = timeit(lambda: carsim.simulate_quarter_mile(cars[0]), 1)
+    print(f"scalar:\t\t\t{1 / scalar:10.0f} runs/s")
+    record("scalar", 1 / scalar, "runs/s")
+
+    for n in sizes:
+        fleet = synthetic_fleet(cars, n)
+        run = timeit(lambda: carsim.simulate_quarter_mile_batch(fleet), 1, repeat=1 if n > 1000 else 3)
+        print(f"batch of {n}:\t\t{n / run:10.0f} runs/s")
+        record(f"batch of {n}", n / run, "runs/s")
+
+
+# Steps, wall time and quarter time error of each integrator, against a tight rk45 run
+def bench_integrators(cars):
+    import integrators
+
+    runs = {
+        "euler": lambda car: carsim.simulate_quarter_mile(car, record=False),
+        "rk4": lambda car: integrators.simulate_rk4(car, record=False),
+        "rk4 dt=0.1": lambda car: integrators.simulate_rk4(car, dt=0.1, record=False),
+        "rk45": lambda car: integrators.simulate_rk45(car, record=False),
+        "table": lambda car: integrators.forcetable.simulate_table(car, record=False),
+        "quadrature": lambda car: integrators.quadrature.simulate_quadrature(car),
+    }
+    reference = [integrators.simulate_rk45(car, rtol=1e-11, atol=1e-11, record=False) for car in cars]
+
+    for name, run in runs.items():
+        wall = sum(timeit(lambda: run(car), 1, repeat=3) for car in cars) / len(cars)
+        results = [run(car) for car in cars]
+        # The quadrature solver doesn't step, it has no count to show
+        steps = [data.get("steps") for data in results]
+        steps = f"{np.mean(steps):8.0f}" if None not in steps else f"{'-':>8}"
+        error = max(abs(data[key] - ref[key]) for data, ref in zip(results, reference)
+                    for key in ("quarter_time", "0-60 mph"))
+        print(f"{name:<12}{steps} steps/run\t{wall * 1e3:6.2f} ms/run\tmax time error {error:.1e} s")
+        record(f"integrator {name}", 1 / wall, "runs/s")
+
+
+# The force table engine against the Euler loop it stands in for: times must
+# match to the step, speeds to within the table's interpolation error
+def bench_force_table(cars, tolerance=1e-4):
+    import forcetable
+
+    worst = 0
+    for car in cars:
+        data = carsim.simulate_quarter_mile(car, record=False)
+        table = forcetable.simulate_table(car, record=False)
+        if data["shift_times"] != table["shift_times"]:
+            worst = np.inf
+        for key in ("quarter_time", "quarter_speed", "0-60 mph"):
+            worst = max(worst, abs(data[key] - table[key]))
+
+    car = carsim.as_car(cars[0])
+    build = timeit(lambda: forcetable.ForceTable(car), 1)
+    table = forcetable.force_table(car)
+    euler = timeit(lambda: carsim.simulate_quarter_mile(car, record=False), 1)
+    run = timeit(lambda: forcetable.simulate_table(car, record=False, table=table), 1)
+
+    passed = worst <= tolerance
+    print(f"force table:\t\t{1 / run:10.0f} runs/s ({euler / run:.1f}x euler), {build * 1e3:.1f} ms to build, "
+          f"{len(cars)} cars max difference {worst:.1e} ({'ok' if passed else 'FAILED'})")
+    record("force table", 1 / run, "runs/s")
+    return check("force table parity", passed)
+
+
+# A checkpoint Session through a series of one field edits, each run against
+# a full simulate_quarter_mile of the same car, and the time an edit to the
+# top gear takes either way
+def check_checkpoint_parity(cars, tolerance=1e-9):
+    import checkpoint
+    import sweep
+
+    worst = 0
+    for car in cars:
+        base = dict(car.data, shift_rpm=list(car.shift_rpm))
+        top = car.n_gears - 1
+        edits = [{}, {f"gear_ratios[{top}]": car["gear_ratios"][top] * 0.95}, {"shift_rpm[2]": car.shift_rpm[2] - 300},
+                 {"gear_ratios[1]": car["gear_ratios"][1] * 1.03}, {"final_drive": car["final_drive"] * 1.02},
+                 {f"gear_ratios[{top}]": car["gear_ratios"][top] * 0.9}]
+        session = checkpoint.Session()
+        for edit in edits:
+            variant = sweep.make_variant(base, edit)
+            data = carsim.simulate_quarter_mile(variant)
+            resumed = session.simulate(variant)
+            if len(data["time_data"]) != len(resumed["time_data"]) or data["shift_times"] != resumed["shift_times"]:
+                worst = np.inf
+                continue
+            for key in ("time_data", "velocity_data", "distance_data", "power_data", "rpm_data"):
+                worst = max(worst, np.max(np.abs(data[key] - resumed[key])))
+            for key in ("quarter_time", "quarter_speed", "0-60 mph"):
+                worst = max(worst, abs(data[key] - resumed[key]))
+
+    car = carsim.as_car(cars[0])
+    top = car.n_gears - 1
+    variants = [carsim.Car(sweep.make_variant(car.data, {f"gear_ratios[{top}]": car["gear_ratios"][top] * x}))
+                for x in np.linspace(0.9, 1.1, 10)]
+    full = timeit(lambda: [carsim.simulate_quarter_mile(variant, record=False) for variant in variants], 1) / 10
+    session = checkpoint.Session(record=False)
+    session.simulate(variants[-1])
+    resumed = timeit(lambda: [session.simulate(variant) for variant in variants], 1) / 10
+
+    status = "ok" if worst <= tolerance else "FAILED"
+    print(f"checkpoints vs scalar:\t{len(cars)} cars, max difference {worst:.2e} ({status}), "
+          f"top gear edit {resumed * 1e3:.2f} ms against {full * 1e3:.2f} ms from the start")
+    record("checkpoint top gear edit", 1 / resumed, "runs/s")
+    return check("checkpoint parity", worst <= tolerance)
+
+
+# Quarter mile, trap speed and 0-60 of the quadrature solver and the Euler
+# loop against a tight rk45 run, per car. The README's accuracy table is this.
+def bench_quadrature(cars, tolerance=1e-8):
+    import integrators
+    import quadrature
+
+    # Plus a car whose middle gear is entered above its own shift speed
+    skipping = carsim.as_car(cars[0])
+    shift_rpm = list(skipping.shift_rpm)
+    shift_rpm[len(shift_rpm) // 2] /= 2
+    skipping = dict(skipping.data, Name="Gear skipping", shift_rpm=shift_rpm)
+
+    print(f"{'':<34}{'rk45 1e-12':>12}{'euler':>10}{'error':>10}{'quadrature':>14}{'error':>10}")
+    worst = 0
+    for car in list(cars) + [skipping]:
+        reference = integrators.simulate_rk45(car, rtol=1e-12, atol=1e-12, record=False)
+        euler = carsim.simulate_quarter_mile(car, record=False)
+        solved = quadrature.simulate_quadrature(car)
+        for key in ("quarter_time", "quarter_speed", "0-60 mph"):
+            error = abs(solved[key] - reference[key])
+            worst = max(worst, error)
+            print(f"{car['Name'] if key == 'quarter_time' else '':<20}{key:<14}{reference[key]:12.6f}{euler[key]:10.2f}"
+                  f"{euler[key] - reference[key]:+10.4f}{solved[key]:14.9f}{solved[key] - reference[key]:+10.0e}")
+
+    car = carsim.as_car(cars[0])
+    single = timeit(lambda: quadrature.simulate_quadrature(car), 10)
+    fleet = synthetic_fleet(cars, 1000)
+    together = timeit(lambda: quadrature.simulate_fleet_quadrature(fleet), 1, repeat=3)
+
+    passed = worst <= tolerance
+    print(f"quadrature:\t\t{single * 1e6:10.1f} us/car, {together / len(fleet) * 1e6:.1f} us/car in a fleet, "
+          f"max difference to rk45 {worst:.1e} ({'ok' if passed else 'FAILED'})")
+    record("quadrature", 1 / single, "runs/s")
+    return check("quadrature accuracy", passed)
+
+
+# Fits a surrogate surface and checks its answers against the solver at
+# random points in the box: no answer it gives may be off by more than the
+# tolerances, and how often it answers at all
+def bench_surrogate(car, n=500):
+    import surrogate
+
+    fitting = timeit(lambda: surrogate.fit(car), 1, repeat=1)
+    surface = surrogate.fit(car)
+    rng = np.random.default_rng(0)
+    points = surface.lows + (surface.highs - surface.lows) * rng.random((n, len(surrogate.PARAMETERS)))
+
+    values, bounds = surface.predict(points)
+    truth = surrogate.solve(car, points)
+    tolerances = np.array([surrogate.TOLERANCES[metric] for metric in surrogate.METRICS])
+    answered = np.all(bounds <= tolerances, axis=1)
+    wrong = int(np.sum(np.abs(values - truth)[answered] > tolerances))
+
+    query = timeit(lambda: surface.query(W=car["W"] * 1.05, power=0.95), 100)
+    batch = timeit(lambda: surface.predict(points), 10) / n
+    passed = wrong == 0
+    print(f"surrogate:\t\t{query * 1e6:10.1f} us/query, {batch * 1e6:.1f} us/point in a batch, fit in {fitting:.1f} s, "
+          f"{answered.mean():.0%} answered, {wrong} over tolerance ({'ok' if passed else 'FAILED'})")
+    record("surrogate query", 1 / query, "queries/s")
+    return check("surrogate bounds", passed)
+
+
+# server.py on a temporary Unix socket with `clients` threads each sending
+# their share of n car specs one request at a time, so throughput depends on
+# the requests getting batched together. Results must be the kernel's, and
+# asking again must come from the cache and be faster.
+def bench_server(cars, n=2000, clients=32):
+    import asyncio
+    import shutil
+    import tempfile
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    import kernel
+    import server
+    from client import Client
+
+    fleet = synthetic_fleet(cars, n)
+    expected = kernel.simulate_fleet_kernel(fleet)
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "carsim.sock")
+
+    # With a sqlite tier, which the event loop's thread uses but this one opens
+    service = server.Server(os.path.join(os.path.dirname(os.path.abspath(__file__)), "cars.json"),
+                            cache_path=os.path.join(directory, "results.sqlite"))
+    service.warm()
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever)
+    thread.start()
+    listener = asyncio.run_coroutine_threadsafe(service.start(unix=path), loop).result()
+
+    def send(share):
+        client = Client(unix=path)
+        try:
+            return [client.simulate(fleet[k]) for k in share]
+        finally:
+            client.close()
+
+    def run():
+        shares = [range(k, n, clients) for k in range(clients)]
+        with ThreadPoolExecutor(clients) as pool:
+            results = [None] * n
+            for share, answers in zip(shares, pool.map(send, shares)):
+                for k, answer in zip(share, answers):
+                    results[k] = answer
+        return results
+
+    try:
+        start = time.perf_counter()
+        results = run()
+        cold = time.perf_counter() - start
+        start = time.perf_counter()
+        again = run()
+        warm = time.perf_counter() - start
+        metrics = service.metrics.snapshot()
+        one = Client(unix=path)
+        single = timeit(lambda: one.simulate(cars[0]["Name"]), 200)
+        one.close()
+    finally:
+        listener.close()
+        asyncio.run_coroutine_threadsafe(service.stop(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+        service.close()
+        shutil.rmtree(directory)
+
+    worst = max(abs(result[key] - expected[key][k])
+                for k, result in enumerate(results) for key in ("quarter_time", "quarter_speed", "0-60 mph"))
+    passed = worst == 0 and again == results and metrics["cache hits"] >= n and warm < cold
+    print(f"server {n} cars, {clients} clients:\t{n / cold:8.0f} cars/s,\t{n / warm:8.0f} cars/s cached,\t"
+          f"{single * 1e6:.0f} us/cached request, mean batch {metrics['mean batch']:.1f}\t"
+          f"(max difference {worst:.1e}, {'ok' if passed else 'FAILED'})")
+    record("server throughput", n / cold, "cars/s")
+    record("server cached throughput", n / warm, "cars/s")
+    record("server cached request", single * 1e6, "us/request", "lower")
+    return check("server parity", passed)
+
+
+# Dyno tables for a fleet in one call against one car at a time
+def bench_dyno(cars, n=1000, points=200):
+    import dyno
+
+    fleet = [carsim.Car(car) for car in synthetic_fleet(cars, n)]
+    speeds = np.linspace(0, 90, points)
+    together = timeit(lambda: dyno.fleet_tractive_force(fleet, speeds), 1, repeat=3)
+    single = timeit(lambda: [dyno.tractive_force(car, speeds) for car in fleet], 1, repeat=3)
+
+    table = dyno.fleet_tractive_force(fleet, speeds)["net"]
+    worst = max(np.nanmax(np.abs(table[k, :car.n_gears] - dyno.tractive_force(car, speeds)["net"]))
+                for k, car in enumerate(fleet[:50]))
+    curves = timeit(lambda: dyno.fleet_engine_curves(fleet, points), 1, repeat=3)
+    curves_single = timeit(lambda: [dyno.engine_curves(car, points=points) for car in fleet], 1, repeat=3)
+
+    passed = worst <= 1e-6
+    print(f"dyno {n} cars x {points}:\t{together * 1e3:8.1f} ms fleet,\t{single * 1e3:8.1f} ms one by one\t"
+          f"(max difference {worst:.1e}, {'ok' if passed else 'FAILED'})")
+    print(f"engine curves {n} cars:\t{curves * 1e3:8.1f} ms fleet,\t{curves_single * 1e3:8.1f} ms one by one")
+    record(f"dyno fleet of {n}", n / together, "cars/s")
+    record(f"engine curves fleet of {n}", n / curves, "cars/s")
+    return check("dyno parity", passed)
+
+
+# Summary rows per second through a StoreWriter, and the time append()
+# blocks the caller for, which is what a runner feeding it would wait
+def bench_store(n=1000000, batch=4096):
+    import shutil
+    import tempfile
+    import resultstore
+
+    path = tempfile.mkdtemp()
+    try:
+        store = resultstore.ResultStore(path, fields=("W",))
+        rows = {name: np.random.default_rng(0).random(batch) for name in store.dtype.names if name != "run"}
+
+        # Blocking is the time append waits for room in the queue, building
+        # the records is the caller's own work
+        start = time.perf_counter()
+        with store.writer() as writer:
+            for first in range(0, n, batch):
+                writer.append(rows, first)
+        total = time.perf_counter() - start
+        blocked = writer.waited
+
+        summary = store.summary()
+        zero_copy = isinstance(summary, np.memmap) and len(summary) == (n + batch - 1) // batch * batch
+        print(f"store {n} rows:\t{n / total:10.0f} rows/s\t{blocked / total:.0%} of it blocking the caller")
+        record("store rows", n / total, "rows/s")
+        check("store read back", zero_copy)
+    finally:
+        shutil.rmtree(path)
+
+
+# Two sweeps into one store have to number their runs on from each other, as
+# fleet.py --store does
+def check_store_sweep(car):
+    import shutil
+    import tempfile
+    import resultstore
+    import sweep
+
+    path = tempfile.mkdtemp()
+    try:
+        store = resultstore.ResultStore(path, fields=("W",))
+        sweep.store_sweep(sweep.grid(car, {"W": [1400, 1500, 1600]}), ["W"], store, workers=1)
+        sweep.store_sweep(sweep.grid(car, {"W": [1700, 1800, 1900]}), ["W"], store, workers=1)
+        summary = store.summary()
+        passed = summary["run"].tolist() == list(range(6)) and summary["W"].tolist() == list(range(1400, 2000, 100))
+    finally:
+        shutil.rmtree(path)
+
+    print(f"store two sweeps:\trun ids {summary['run'].tolist()} ({'ok' if passed else 'FAILED'})")
+    return check("store sweep run ids", passed)
+
+
+# Peak traced memory of fn(), in bytes (numpy reports its buffers to tracemalloc)
+def peak_memory(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_memory(cars, n=10000):
+    fleet = synthetic_fleet(cars, n)
+    runs = {
+        "simulate": lambda: carsim.simulate_quarter_mile(cars[0]),
+        "simulate summary": lambda: carsim.simulate_quarter_mile(cars[0], record=False),
+        f"batch of {n}": lambda: carsim.simulate_quarter_mile_batch(fleet),
+    }
+
+    for name, run in runs.items():
+        peak = peak_memory(run)
+        print(f"peak memory {name + ':':<20}{peak / 1024:10.1f} KiB")
+        record(f"peak memory {name}", peak / 1024, "KiB", "lower")
+
+
+# Cumulative import time of a module in a fresh interpreter, best of `repeat`, from -X importtime
+def import_time(module, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                             capture_output=True, text=True, cwd=os.path.dirname(GOLDEN_PATH)).stderr
+        for line in out.splitlines():
+            parts = [part.strip() for part in line.split("|")]
+            if len(parts) == 3 and parts[2] == module:
+                best = min(best, int(parts[1]) / 1e6)
+    return best
+
+
+# Import time budgets in ms, and the heavy packages each module must not pull
+# in when imported (they're imported where they're first needed instead)
+IMPORT_BUDGETS = {"carsim": 300, "fleet": 350, "sweep": 350}
+HEAVY_MODULES = ("matplotlib", "scipy", "numba", "pyarrow")
+
+
+def loaded_heavy_modules(module):
+    code = (f"import sys, {module}; "
+            f"print(' '.join(sorted({{m.split('.')[0] for m in sys.modules}} & set({HEAVY_MODULES!r}))))")
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                         cwd=os.path.dirname(GOLDEN_PATH)).stdout
+    return out.split()
+
+
+def bench_import(budgets=IMPORT_BUDGETS):
+    passed = True
+    for module, budget in budgets.items():
+        seconds = import_time(module)
+        heavy = loaded_heavy_modules(module)
+        ok = seconds * 1e3 <= budget and not heavy
+        status = "ok" if ok else "FAILED" + (f", imports {', '.join(heavy)}" if heavy else "")
+        print(f"import {module}:\t\t{seconds * 1e3:8.1f} ms (budget {budget} ms, {status})")
+        record(f"import {module}", seconds * 1e3, "ms", "lower")
+        passed = passed and ok
+    return check("import budget", passed)
+
+
+# The cars the golden results are kept for: cars.json and a fixed synthetic fleet
+def golden_cars(cars):
+    return cars + [carsim.Car(car) for car in synthetic_fleet(cars, 20, seed=1)]
+
+
+def golden_results(cars):
+    results = {}
+    for i, car in enumerate(golden_cars(cars)):
+        data = carsim.simulate_quarter_mile(car, record=False)
+        results[f"{i} {car['Name']}"] = {key: data[key] for key in GOLDEN_KEYS + ("shift_times",)}
+    return results
+
+
+def write_golden(cars, path=GOLDEN_PATH):
+    with open(path, "w") as file:
+        json.dump({"sim": sim_constants(), "results": golden_results(cars)}, file, indent=1)
+    print(f"golden results written to {path}")
+
+
+def sim_constants():
+    return {"dt": carsim.DELTA_T, "quarter_mile": carsim.QUARTER_MILE, "rho": carsim.RHO, "g": carsim.G,
+            "launch_rpm": carsim.LAUNCH_RPM, "shift_margin": carsim.SHIFT_MARGIN,
+            "drivetrain_power_loss": carsim.DRIVETRAIN_POWER_LOSS}
+
+
+# Today's results against golden.json, to 1e-9. Any physics change shows up here.
+def check_golden(cars, path=GOLDEN_PATH, tolerance=1e-9):
+    if not os.path.exists(path):
+        print(f"golden results:\t\tno {path}, run with --update-golden")
+        return check("golden results", False)
+
+    with open(path) as file:
+        golden = json.load(file)
+
+    worst = 0
+    wrong = []
+    results = golden_results(cars)
+    for name, expected in golden["results"].items():
+        got = results.get(name)
+        if got is None or len(got["shift_times"]) != len(expected["shift_times"]):
+            wrong.append(name)
+            continue
+        # This car's largest difference, infinite if a value is missing on one side
+        difference = max([abs(a - b) for a, b in zip(got["shift_times"], expected["shift_times"])], default=0)
+        for key in GOLDEN_KEYS:
+            if (got[key] is None) != (expected[key] is None):
+                difference = np.inf
+            elif got[key] is not None:
+                difference = max(difference, abs(got[key] - expected[key]))
+        if difference > tolerance:
+            wrong.append(name)
+        if difference < np.inf:
+            worst = max(worst, difference)
+
+    passed = not wrong and golden["sim"] == sim_constants() and len(results) == len(golden["results"])
+    status = "ok" if passed else "FAILED " + ", ".join(wrong[:5])
+    print(f"golden results:\t\t{len(results)} cars, max difference {worst:.2e} ({status})")
+    return check("golden results", passed)
+
+
+def meta():
+    try:
+        import numba
+        numba_version = numba.__version__
+    except ImportError:
+        numba_version = None
+
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "numba": numba_version,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def write_results(path):
+    with open(path, "w") as file:
+        json.dump({"meta": meta(), "results": RESULTS, "checks": CHECKS}, file, indent=1)
+    print(f"results written to {path}")
+
+
+# Names of the measurements more than `threshold` worse than in the baseline file
+def compare(path, threshold=0.2):
+    with open(path) as file:
+        baseline = json.load(file)["results"]
+
+    regressions = []
+    print(f"\nagainst {path}:")
+    for name, result in RESULTS.items():
+        old = baseline.get(name)
+        if old is None or old["value"] == 0:
+            continue
+        ratio = result["value"] / old["value"]
+        worse = ratio < 1 - threshold if result["better"] == "higher" else ratio > 1 + threshold
+        flag = "REGRESSION" if worse else ""
+        print(f"{name:<32}{old['value']:12.2f} -> {result['value']:12.2f} {result['unit']:<8}{ratio:6.2f}x  {flag}")
+        if worse:
+            regressions.append(name)
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the engines and check their results")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="compare against the results in this file")
+    parser.add_argument("--threshold", type=float, default=0.2, help="fraction worse that counts as a regression")
+    parser.add_argument("--quick", action="store_true", help="skip the 10k car fleets and integrators")
+    parser.add_argument("--update-golden", action="store_true", help="rewrite golden.json from this tree")
+    args = parser.parse_args()
+
+    cars = carsim.load_cars()
+    if args.update_golden:
+        write_golden(cars)
+        return
+
+    big = 1000 if args.quick else 10000
+
+    check_golden(cars)
+    bench_import()
+    bench_calc_power(cars[0])
+    bench_calc_rpm(cars[0])
+    bench_simulate(cars)
+    check_stream_parity(cars + synthetic_fleet(cars, 20))
+    check_profiled_parity(cars + synthetic_fleet(cars, 20))
+    check_checkpoint_parity(cars + [carsim.Car(car) for car in synthetic_fleet(cars, 8)])
+    check_batch_parity(cars + synthetic_fleet(cars, 50))
+    bench_batch(cars, (1, 100, big))
+    check_kernel_parity(cars + synthetic_fleet(cars, 50))
+    bench_kernel(cars, big)
+    bench_memory(cars, big)
+    bench_force_table(cars + synthetic_fleet(cars, 50))
+    bench_quadrature(cars)
+    bench_server(cars, 500 if args.quick else 2000)
+    bench_dyno(cars)
+    bench_store(100000 if args.quick else 1000000)
+    check_store_sweep(cars[0])
+    if not args.quick:
+        bench_integrators(cars)
+        bench_surrogate(cars[2])
+
+    if args.json:
+        write_results(args.json)
+
+    regressions = compare(args.baseline, args.threshold) if args.baseline else []
+    failed = [name for name, passed in CHECKS.items() if not passed]
+    if failed or regressions:
+        print(f"\nFAILED: {', '.join(failed + regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
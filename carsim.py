@@ -1,71 +1,171 @@
 # carsim 0.2
 # Eric Straub
 
-import matplotlib.pyplot as plt
+# Only the engine is imported up front. scipy is imported when the first torque
+# curve is fitted and matplotlib only for plotting (report.py), so scripts and
+# fleet workers that never plot don't pay for it.
 import numpy as np
-import threading
 import json
-import concurrent.futures
-from time import sleep
-from scipy.interpolate import interp1d
+import numbers
+import time
+from bisect import bisect_right
+from functools import lru_cache
 
+from telemetry import Telemetry
 
 
-def simulate_quarter_mile(car):
-    # Constants
-    rho = 1.225             # air density in kg/m³
-    g = 9.81                # gravity in m/s²
-    quarter_mile = 402.336  # distance in meters
-    delta_t = 0.01          # time increment in seconds
-    drivetrain_power_loss = 0
-    # drivetrain_power_loss = 0.15
-    
-    # Extract car parameters
-    W = car["W"]
-    P = car["P"]
-    Cd = car["Cd"]
-    A = car["A"]
-    Crr = car["Crr"]
-    Ft = calc_Ft(car)
-    P_wheel = P * (1 - drivetrain_power_loss) # power at the wheels in watts
-    gear_ratios = car["gear_ratios"]
+# Constants
+RHO = 1.225             # air density in kg/m³
+G = 9.81                # gravity in m/s²
+QUARTER_MILE = 402.336  # distance in meters
+DELTA_T = 0.01          # time increment in seconds
+DRIVETRAIN_POWER_LOSS = 0
+# DRIVETRAIN_POWER_LOSS = 0.15
+LAUNCH_RPM = 2500       # launch control rpm in 1st gear
+SHIFT_MARGIN = 300      # shift up this many rpm below redline
+
+# Set by profiling.Profiler while it's active, runs then time the phases of their steps for it
+PROFILER = None
+
+
+# record=False skips the per step telemetry, the result then only has the summary
+# values and the run takes constant memory however long it is. Summary values that
+# weren't reached before the line (60-130 mph in most cars) are None.
+# integrator="rk4" or "rk45" swaps this fixed step Euler loop for one of the
+# event locating integrators in integrators.py, "table" for the same loop with
+# the forces read off a precomputed forcetable.ForceTable, "quadrature" for
+# summary results integrated over speed instead of time (record=False only).
+def simulate_quarter_mile(car, record=True, integrator="euler"):
+    if PROFILER is not None:
+        return PROFILER.simulate(car, record, integrator)
+
+    if integrator != "euler":
+        import integrators
+        return integrators.INTEGRATORS[integrator](car, record=record)
+
+    car = as_car(car)
+
+    # Per step data for plotting, sized for the expected run
+    telemetry = None
+    if record:
+        telemetry = Telemetry(1.25 * estimate_quarter_time(car) / DELTA_T)
 
-    # Initial conditions
-    v = 0   # initial velocity in m/s
-    d = 0   # initial distance in meters
-    t = 0   # initial time in seconds
-    zerosixty_recorded = False
-    current_gear = 1
-
-    # Lists to store data for plotting
-    time_data = []
-    acceleration_data = []
-    velocity_data = []
-    distance_data = []
-    power_data = []
-    rpm_data = []
+    data = run_steps(quarter_mile_steps(car, 0, telemetry))
+
+    if record:
+        data.update(telemetry.data())
+
+    return data
+
+
+# What each sample from quarter_mile_steps holds, in order
+SAMPLE_FIELDS = ("t", "v", "d", "a", "gear", "rpm", "power")
+
+
+# State of a run between steps, to start or carry on one from: the gear (1
+# based), time, speed and distance, the summary values so far (None if not
+# reached yet), the shift times, and the number of steps taken and recorded
+def run_state(gear=1, t=0, v=0, d=0, zerosixty=None, zerohundred=None, sixty_one_thirty=None,
+              eighth_time=None, eighth_speed=None, shift_times=(), steps=0, samples=0):
+    return {
+        "gear": gear, "t": t, "v": v, "d": d,
+        "0-60 mph": zerosixty, "0-100 km/h": zerohundred, "60-130 mph": sixty_one_thirty,
+        "eighth_time": eighth_time, "eighth_speed": eighth_speed,
+        "shift_times": tuple(shift_times), "steps": steps, "samples": samples,
+    }
+
+
+# A car standing at the line
+START = run_state()
+
+
+# The simulation loop, shared by every Euler run. A generator so live
+# consumers (see stream.py) can take samples while it goes: it yields a
+# (t, v, d, a, gear, rpm, power) tuple every `every` steps and after the last
+# one, power being the power at the wheels, and only advances when the next
+# sample is asked for. every=0 never yields, simulate_quarter_mile runs it that
+# way with run_steps. Steps are appended to `telemetry` if given. Given a dict
+# as `phases`, each step is timed and the ns spent in each phase (shift,
+# torque, forces, record) are put in it, for profiling.Profiler. A run can
+# start from a run_state other than the standstill (checkpoint.py carries on
+# edited cars from one), and given a `checkpoints` list the loop appends its
+# state to it each time it gets into a gear. Returns the summary values and the
+# number of steps taken, counting those before `start`.
+def quarter_mile_steps(car, every=1, telemetry=None, phases=None, start=None, checkpoints=None):
+    car = as_car(car)
+
+    # Constants
+    quarter_mile = QUARTER_MILE
+    delta_t = DELTA_T
+    drivetrain_power_loss = DRIVETRAIN_POWER_LOSS
+
+    # Extract car parameters, all worked out when the Car was built
+    W = car.W
+    Ft = car.Ft
+    drag = car.drag
+    Fr = car.Fr
+    shift_rpm = car.shift_rpm
+    rpm_per_ms = car.rpm_per_ms
+    torque_curve = car.torque_curve
+
+    # Initial conditions, the standstill unless given
+    if start is None:
+        start = START
+    v = start["v"]              # initial velocity in m/s
+    d = start["d"]              # initial distance in meters
+    t = start["t"]              # initial time in seconds
+    current_gear = start["gear"]
+    step = start["steps"]
+
+    # Summary values recorded on the way
+    sixty = mph_to_ms(60)
+    hundred_kmh = kmh_to_ms(100)
+    one_thirty = mph_to_ms(130)
+    eighth_mile = quarter_mile / 2
+    zerosixty = start["0-60 mph"]
+    zerohundred = start["0-100 km/h"]
+    sixty_one_thirty = start["60-130 mph"]
+    eighth_time = start["eighth_time"]
+    eighth_speed = start["eighth_speed"]
+    shift_times = list(start["shift_times"])
+    record = telemetry is not None
+
+    # Step timers, only read while profiling
+    profiling = phases is not None
+    clock = time.perf_counter_ns
+    shift_ns = torque_ns = forces_ns = record_ns = 0
 
     # Simulation
     while d < quarter_mile:
-        rpms = calc_rpm(v, gear_ratios[current_gear - 1], car["final_drive"], car["tire_diameter"])
-        rpm = rpms[0]
-        wheel_rpm = rpms[1]
+        if profiling:
+            t0 = clock()
+        rpm = v * rpm_per_ms[current_gear - 1]
 
-        if rpm < 2500 and current_gear == 1: # Launch control
-            rpm = 2500
+        if rpm < LAUNCH_RPM and current_gear == 1: # Launch control
+            rpm = LAUNCH_RPM
 
-        if rpm > car["redline"] - 300: # Shift up
+        if rpm > shift_rpm[current_gear - 1]: # Shift up
             current_gear += 1
+            shift_times.append(t)
+            if checkpoints is not None:
+                checkpoints.append(run_state(current_gear, t, v, d, zerosixty, zerohundred, sixty_one_thirty,
+                                             eighth_time, eighth_speed, shift_times, step,
+                                             len(telemetry) if record else 0))
+            if profiling:
+                shift_ns += clock() - t0
             continue
 
-        power = calc_power(car, rpm)
+        if profiling:
+            t1 = clock()
+        power = torque_curve.power(rpm)
+        if profiling:
+            t2 = clock()
 
         P_wheel = power * (1 - drivetrain_power_loss)
 
 
         Fe = P_wheel / v if v > 0.01 else P_wheel / 0.01      # engine force in N
-        Fd = 0.5 * Cd * A * rho * v**2                  # drag force in N
-        Fr = Crr * W * g                                # rolling resistance force in N
+        Fd = drag * v**2                                # drag force in N
         Fn = Fe - Fd - Fr                               # net force in N
 
         if Fn > Ft:
@@ -75,42 +175,185 @@ def simulate_quarter_mile(car):
         v += a * delta_t    # velocity in m/s
         d += v * delta_t    # distance in meters
         t += delta_t        # time in seconds
+        step += 1
+        if profiling:
+            t3 = clock()
 
         # Record data
-        time_data.append(t)
-        acceleration_data.append(a)
-        velocity_data.append(v)
-        distance_data.append(d)
-        power_data.append(P_wheel)
-        rpm_data.append(rpm)
-
-        if not zerosixty_recorded and v > mph_to_ms(60):
+        if record:
+            telemetry.append(t, a, v, d, P_wheel, rpm)
+
+        if zerosixty is None and v > sixty:
             zerosixty = t
-            zerosixty_recorded = True
 
-        # # Print realtime data
-        # if t % 0.1 < delta_t:
-        #     print(f"{t:.2f} s, {v:.2f} m/s, {d:.2f} m", end="\r")
-        #     sleep(0.1)
+        if zerohundred is None and v > hundred_kmh:
+            zerohundred = t
+
+        if sixty_one_thirty is None and v > one_thirty:
+            sixty_one_thirty = t - zerosixty
+
+        if eighth_time is None and d >= eighth_mile:
+            eighth_time = t
+            eighth_speed = v
+
+        if profiling:
+            t4 = clock()
+            shift_ns += t1 - t0
+            torque_ns += t2 - t1
+            forces_ns += t3 - t2
+            record_ns += t4 - t3
 
-        # # Print realtime data with newline
-        # if t % 0.1 < delta_t:
-        #     print(f"{P_wheel:.2f} W, gear: {current_gear}, {rpm:.2f} rpm, {wheel_rpm:.2f} wheel rpm")
-        #     sleep(0.1)
+        if every and (step % every == 0 or d >= quarter_mile):
+            yield t, v, d, a, current_gear, rpm, P_wheel
+
+    if zerosixty is None:
+        zerosixty = t
+
+    if profiling:
+        phases.update({"shift": shift_ns, "torque": torque_ns, "forces": forces_ns, "record": record_ns})
 
-    if not zerosixty_recorded:
-        zerosixty = t    
-    
     data = {
         "quarter_time": t,
         "quarter_speed": v,
         "0-60 mph": zerosixty,
-        "time_data": time_data,
-        "acceleration_data": acceleration_data,
-        "velocity_data": velocity_data,
-        "distance_data": distance_data,
-        "power_data": power_data,
-        "rpm_data": rpm_data
+        "0-100 km/h": zerohundred,
+        "60-130 mph": sixty_one_thirty,
+        "eighth_time": eighth_time,
+        "eighth_speed": eighth_speed,
+        "shift_times": shift_times,
+        "steps": step,
+    }
+
+    return data
+
+
+# Runs a quarter_mile_steps generator to the end, returns its summary
+def run_steps(steps):
+    while True:
+        try:
+            next(steps)
+        except StopIteration as stop:
+            return stop.value
+
+
+# Iterable over a run's samples that keeps the summary once they run out
+#   run = QuarterMileRun(car, every=10)
+#   for t, v, d, a, gear, rpm, power in run: ...
+#   run.result["quarter_time"]
+class QuarterMileRun:
+    def __init__(self, car, every=1):
+        self.car = as_car(car)
+        self.every = every
+        self.result = None
+
+    def __iter__(self):
+        self.result = yield from quarter_mile_steps(self.car, self.every)
+
+
+# Runs many cars through the same model as simulate_quarter_mile in lockstep,
+# one numpy step for the whole fleet per delta_t. Only the summary values are
+# kept, returned as arrays in the order of `cars`. Matches the scalar path to
+# within 1e-9 (same step count, same float operations in the same order).
+# A car that runs out of gears or off its torque curve gets NaN results
+# instead of raising like the scalar path, so one bad variant can't sink a sweep.
+def simulate_quarter_mile_batch(cars):
+    cars = [as_car(car) for car in cars]
+    n = len(cars)
+    if n == 0:
+        return {"quarter_time": np.empty(0), "quarter_speed": np.empty(0), "0-60 mph": np.empty(0)}
+    sixty = mph_to_ms(60)
+    torque_curves = TorqueCurveSet([car.torque_curve for car in cars])
+
+    n_gears = np.array([car.n_gears for car in cars])
+    rpm_per_ms = np.full((n, n_gears.max() + 1), np.nan)  # extra column for "out of gears"
+    shift_rpm = np.full((n, n_gears.max() + 1), np.inf)
+    for row, car in enumerate(cars):
+        rpm_per_ms[row, :n_gears[row]] = car.rpm_per_ms
+        shift_rpm[row, :n_gears[row]] = car.shift_rpm
+
+    # Per car state and constants. Every array in here is filtered together
+    # whenever cars finish, so each step only touches cars still running.
+    s = {
+        "row": np.arange(n),
+        "v": np.zeros(n),
+        "d": np.zeros(n),
+        "t": np.zeros(n),
+        "gear": np.zeros(n, dtype=int),             # 0 based, unlike current_gear
+        "zerosixty": np.full(n, np.nan),
+        "W": np.array([car.W for car in cars]),
+        "Ft": np.array([car.Ft for car in cars]),
+        "drag": np.array([car.drag for car in cars]),
+        "Fr": np.array([car.Fr for car in cars]),
+        "shift_rpm": shift_rpm[:, 0].copy(),
+        "rpm_per_ms": rpm_per_ms[:, 0].copy(),
+        "rpm_min": torque_curves.rpm_min,
+        "rpm_max": torque_curves.rpm_max,
+        "starts": torque_curves.starts,
+        "inner": torque_curves.inner,
+        "coeffs": torque_curves.coeffs,
+    }
+
+    quarter_time = np.full(n, np.nan)
+    quarter_speed = np.full(n, np.nan)
+    zerosixty = np.full(n, np.nan)
+
+    while len(s["row"]):
+        v = s["v"]
+
+        # Shift mask: keep shifting the cars over the shift point until none are
+        while True:
+            rpm = v * s["rpm_per_ms"]
+            rpm = np.where((rpm < LAUNCH_RPM) & (s["gear"] == 0), LAUNCH_RPM, rpm)
+            shift = rpm > s["shift_rpm"]
+            if not shift.any():
+                break
+            s["gear"][shift] += 1
+            s["rpm_per_ms"][shift] = rpm_per_ms[s["row"][shift], s["gear"][shift]]
+            s["shift_rpm"][shift] = shift_rpm[s["row"][shift], s["gear"][shift]]
+
+        # Out of gears (NaN rpm_per_ms) or off the torque curve, drop them with NaN results
+        bad = np.isnan(rpm) | (rpm < s["rpm_min"]) | (rpm > s["rpm_max"])
+        if bad.any():
+            s = {key: value[~bad] for key, value in s.items()}
+            v, rpm = s["v"], rpm[~bad]
+
+        i = (s["inner"] <= rpm[:, None]).sum(axis=1)
+        c = s["coeffs"][np.arange(len(i)), i]
+        dx = rpm - s["starts"][np.arange(len(i)), i]
+        torque = ((c[:, 0] * dx + c[:, 1]) * dx + c[:, 2]) * dx + c[:, 3]
+
+        power = torque * rpm * 2 * np.pi / 60
+        P_wheel = power * (1 - DRIVETRAIN_POWER_LOSS)
+
+        Fe = P_wheel / np.where(v > 0.01, v, 0.01)      # engine force in N
+        Fd = s["drag"] * v**2                           # drag force in N
+        Fn = Fe - Fd - s["Fr"]                          # net force in N
+        Fn = np.minimum(Fn, s["Ft"])
+
+        a = Fn / s["W"]
+        v += a * DELTA_T
+        s["d"] += v * DELTA_T
+        s["t"] += DELTA_T
+
+        hit = (v > sixty) & np.isnan(s["zerosixty"])
+        if hit.any():
+            s["zerosixty"][hit] = s["t"][hit]
+
+        # Finish mask
+        done = s["d"] >= QUARTER_MILE
+        if done.any():
+            rows = s["row"][done]
+            quarter_time[rows] = s["t"][done]
+            quarter_speed[rows] = v[done]
+            zerosixty[rows] = s["zerosixty"][done]
+            s = {key: value[~done] for key, value in s.items()}
+
+    zerosixty = np.where(np.isnan(zerosixty), quarter_time, zerosixty)
+
+    data = {
+        "quarter_time": quarter_time,
+        "quarter_speed": quarter_speed,
+        "0-60 mph": zerosixty
     }
 
     return data
@@ -118,6 +361,12 @@ def simulate_quarter_mile(car):
 
 # Helper functions
 
+# Rough quarter mile time from the power to weight ratio (Hale's formula),
+# good enough to size buffers before a run
+def estimate_quarter_time(car):
+    car = as_car(car)
+    return 5.825 * (kg_to_lb(car.W) / watt_to_hp(car.P)) ** (1 / 3)
+
 def calc_Ft(car):
     return (car["mu"] * car["W"] * 9.81) * (car["Driven Wheels"] / car["Wheels"])
 
@@ -143,71 +392,124 @@ def calc_top_speed(car):
     return speeds
 
 def calc_power(car, rpm):
-    torque_curve = car["torque_curve"]
-    torque_curve_rpm = [x[0] for x in torque_curve]
-    torque_curve_nm = [x[1] for x in torque_curve]
-
-    torque_interp = interp1d(torque_curve_rpm, torque_curve_nm, kind='cubic')
-    torque = torque_interp(rpm)
-    power = torque * rpm * 2 * np.pi / 60
-
-    return power
+    return get_torque_curve(car).power(rpm)
+
+# Compiled torque curve, cached on the car under "_torque_model". Cars with the
+# same curve (tuned variants of one car) share a single compiled model.
+def get_torque_curve(car):
+    if isinstance(car, Car):
+        return car.torque_curve
+
+    model = car.get("_torque_model")
+    points = tuple(tuple(x) for x in car["torque_curve"])
+
+    if model is None or model.points != points:
+        model = compile_torque_curve(points)
+        car["_torque_model"] = model
+
+    return model
+
+@lru_cache(maxsize=1024)
+def compile_torque_curve(points):
+    return TorqueCurve(points)
+
+
+class TorqueCurve:
+    # Same cubic spline interp1d(kind='cubic') builds, fitted once and stored as
+    # per-interval polynomial coefficients so evaluating it is a bisect and a
+    # Horner step instead of a new spline every call.
+    def __init__(self, torque_curve):
+        from scipy.interpolate import make_interp_spline, PPoly
+
+        self.points = tuple(tuple(x) for x in torque_curve)
+        torque_curve_rpm = [x[0] for x in self.points]
+        torque_curve_nm = [x[1] for x in self.points]
+
+        spline = PPoly.from_spline(make_interp_spline(torque_curve_rpm, torque_curve_nm, k=3))
+
+        # from_spline repeats the end knots, drop the zero width intervals
+        keep = np.diff(spline.x) > 0
+        self.breaks = np.append(spline.x[:-1][keep], spline.x[-1])   # rpm, ascending
+        self.coeffs = np.ascontiguousarray(spline.c[:, keep].T)      # (interval, [c3, c2, c1, c0])
+        self.rpm_min = float(self.breaks[0])
+        self.rpm_max = float(self.breaks[-1])
+
+        # Plain python copies for the scalar path, numpy scalars are slow here
+        self._breaks = self.breaks[1:-1].tolist()
+        self._starts = self.breaks[:-1].tolist()
+        self._coeffs = self.coeffs.tolist()
+
+    def torque(self, rpm):
+        if isinstance(rpm, (float, int)) or np.ndim(rpm) == 0:
+            rpm = float(rpm)
+            if rpm < self.rpm_min or rpm > self.rpm_max:
+                raise ValueError(f"{rpm:.0f} rpm is outside the torque curve ({self.rpm_min:.0f}-{self.rpm_max:.0f} rpm)")
+
+            i = bisect_right(self._breaks, rpm)
+            c3, c2, c1, c0 = self._coeffs[i]
+            dx = rpm - self._starts[i]
+            return ((c3 * dx + c2) * dx + c1) * dx + c0
+
+        rpm = np.asarray(rpm, dtype=float)
+        if np.any(rpm < self.rpm_min) or np.any(rpm > self.rpm_max):
+            raise ValueError(f"rpm is outside the torque curve ({self.rpm_min:.0f}-{self.rpm_max:.0f} rpm)")
+
+        i = np.searchsorted(self.breaks[1:-1], rpm, side="right")
+        c = self.coeffs[i]
+        dx = rpm - self.breaks[i]
+        return ((c[..., 0] * dx + c[..., 1]) * dx + c[..., 2]) * dx + c[..., 3]
+
+    def power(self, rpm):
+        return self.torque(rpm) * rpm * 2 * np.pi / 60
+
+
+# Several TorqueCurves padded into one table so a batch can be evaluated
+# together, one rpm per curve
+class TorqueCurveSet:
+    def __init__(self, curves):
+        n = len(curves)
+        intervals = max(len(curve.coeffs) for curve in curves)
+
+        self.rpm_min = np.array([curve.rpm_min for curve in curves])
+        self.rpm_max = np.array([curve.rpm_max for curve in curves])
+        self.starts = np.full((n, intervals), np.inf)
+        self.inner = np.full((n, intervals - 1), np.inf)  # interior breaks, bisect_right against these
+        self.coeffs = np.zeros((n, intervals, 4))
+
+        for row, curve in enumerate(curves):
+            m = len(curve.coeffs)
+            self.starts[row, :m] = curve.breaks[:-1]
+            self.inner[row, :m - 1] = curve.breaks[1:-1]
+            self.coeffs[row, :m] = curve.coeffs
+
+    # torque for rpm[k] on curve k
+    def torque(self, rpm):
+        rows = np.arange(len(self.starts))
+        i = (self.inner <= rpm[:, None]).sum(axis=1)
+        c = self.coeffs[rows, i]
+        dx = rpm - self.starts[rows, i]
+        return ((c[:, 0] * dx + c[:, 1]) * dx + c[:, 2]) * dx + c[:, 3]
+
+    # torque for every rpm[k, j] on curve k, rpm is (curves, points)
+    def torque_table(self, rpm):
+        i = np.zeros(rpm.shape, dtype=np.intp)
+        for inner in self.inner.T:
+            i += inner[:, None] <= rpm
+        i += np.arange(len(self.starts))[:, None] * self.starts.shape[1]    # flat index into the tables
+
+        c3, c2, c1, c0 = (self.coeffs[..., k].ravel() for k in range(4))
+        dx = rpm - self.starts.ravel().take(i)
+        return ((c3.take(i) * dx + c2.take(i)) * dx + c1.take(i)) * dx + c0.take(i)
 
 # Print and graph data
-def graph_and_print(car, sim_data):
+# Plots the run, in a window or into image files when path is given (path
+# without extension, one file per format). The plotting itself is report.py's.
+def graph_and_print(car, sim_data, path=None, formats=("png",)):
     print_car_info(car)
     print_simulation_info(sim_data)
 
-    # Grab and convert units of lists
-    acceleration_data_g = [ms2_to_g(a) for a in sim_data['acceleration_data']]
-    velocity_data_mph = [ms_to_mph(v) for v in sim_data['velocity_data']]
-    distance_data_ft = [d * 3.28084 for d in sim_data['distance_data']]
-    power_data_hp = [watt_to_hp(p) for p in sim_data['power_data']]
-    rpm_data = sim_data['rpm_data']
-    time_data = sim_data['time_data']
-
-
-    # Plotting the data
-    # plt.figure(figsize=(12, 8))
-    plt.figure(figsize=(12, 8))
-
-    # Plot acceleration
-    plt.subplot(3, 1, 1)
-    plt.plot(time_data, acceleration_data_g, label='Acceleration (g)')
-    plt.xlabel('Time (s)')
-    plt.ylabel('Acceleration (g)')
-    plt.legend()
-
-    # # Plot velocity
-    # plt.subplot(5, 1, 2)
-    # plt.plot(time_data, velocity_data_mph, label='Velocity (mph)', color='orange')
-    # plt.xlabel('Time (s)')
-    # plt.ylabel('Velocity (mph)')
-    # plt.legend()
-
-    # # Plot distance
-    # plt.subplot(5, 1, 3)
-    # plt.plot(time_data, distance_data_ft, label='Distance (ft)', color='green')
-    # plt.xlabel('Time (s)')
-    # plt.ylabel('Distance (ft)')
-    # plt.legend()
-
-    # Plot power
-    plt.subplot(3, 1, 2)
-    plt.plot(time_data, power_data_hp, label='Power (HP)', color='green')
-    plt.xlabel('Time (s)')
-    plt.ylabel('Power (HP)')
-    plt.legend()
-
-    # Plot rpm
-    plt.subplot(3, 1, 3)
-    plt.plot(time_data, rpm_data, label='RPM', color='red')
-    plt.xlabel('Time (s)')
-    plt.ylabel('RPM')
-    plt.legend()
-
-    plt.tight_layout()
-    plt.show()
+    import report
+    report.show_run(car, sim_data, path, formats)
 
 
 def print_car_info(car):
@@ -223,6 +525,12 @@ def print_simulation_info(data):
     print(f"Time:\t\t\t{data['quarter_time']:.2f} seconds")
     print(f"Speed:\t\t\t{ms_to_mph(data['quarter_speed']):.2f} mph,\t{data['quarter_speed']:.2f} m/s")
     print(f"0-60 mph:\t\t{data['0-60 mph']:.2f} seconds")
+    if data.get("0-100 km/h") is not None:
+        print(f"0-100 km/h:\t\t{data['0-100 km/h']:.2f} seconds")
+    if data.get("60-130 mph") is not None:
+        print(f"60-130 mph:\t\t{data['60-130 mph']:.2f} seconds")
+    if data.get("eighth_time") is not None:
+        print(f"1/8 mile:\t\t{data['eighth_time']:.2f} seconds,\t{ms_to_mph(data['eighth_speed']):.2f} mph")
 
 def hp_to_watt(hp):
     return hp * 745.7
@@ -236,6 +544,15 @@ def mph_to_ms(mph):
 def ms_to_mph(ms):
     return ms / 0.44704
 
+def kmh_to_ms(kmh):
+    return kmh / 3.6
+
+def ms_to_kmh(ms):
+    return ms * 3.6
+
+def m_to_ft(m):
+    return m * 3.28084
+
 def kg_to_lb(kg):
     return kg * 2.20462
 
@@ -260,38 +577,196 @@ def lbft_to_nm(lbft):
 def nm_to_lbft(nm):
     return nm / 1.35582
 
-# Main function
-def main():
-    # Uncomment the car you want to simulate
-    with open("cars.json", "r") as file:
+# Car data
+
+# Fields the 0.2 engine needs, the older entries in cars.json don't have them all
+REQUIRED_FIELDS = ("W", "Cd", "A", "Crr", "mu", "Wheels", "Driven Wheels",
+                   "redline", "tire_diameter", "final_drive", "gear_ratios", "torque_curve")
+
+# Plausible range for each number, mostly to catch values in the wrong units
+FIELD_RANGES = {
+    "W": (20, 20000, "kg"),
+    "Cd": (0.05, 2, ""),
+    "A": (0.2, 10, "m²"),
+    "Crr": (0, 0.2, ""),
+    "mu": (0.05, 3, ""),
+    "redline": (1000, 25000, "rpm"),
+    "tire_diameter": (0.1, 2, "m"),
+}
+
+# Optional "rho" field, air density in kg/m³ (RHO when not given), sea level to high altitude and cold
+RHO_RANGE = (0.5, 1.6)
+
+
+# A car from cars.json, checked once and with every per car constant the
+# simulation needs worked out up front, so the hot loops only do arithmetic.
+# car["Name"] style access still reads the original fields. They're copied
+# with lists as tuples, so the constants can't go stale under a later edit of
+# either the input dict or the Car: edit a dict and build a new Car instead.
+class Car:
+    __slots__ = ("data", "name", "W", "P", "Cd", "A", "Crr", "mu", "redline",
+                 "tire_diameter", "final_drive", "gear_ratios", "n_gears", "torque_curve",
+                 "Ft", "drag", "Fr", "shift_rpm", "rpm_per_ms", "rho")
+
+    def __init__(self, data):
+        validate_car(data)
+
+        self.data = {key: frozen(value) for key, value in data.items() if not key.startswith("_")}
+        self.name = data.get("Name", "")
+        self.W = float(data["W"])
+        self.Cd = float(data["Cd"])
+        self.A = float(data["A"])
+        self.Crr = float(data["Crr"])
+        self.mu = float(data["mu"])
+        self.redline = float(data["redline"])
+        self.tire_diameter = float(data["tire_diameter"])
+        self.final_drive = float(data["final_drive"])
+        self.gear_ratios = tuple(float(ratio) for ratio in data["gear_ratios"])
+        self.n_gears = len(self.gear_ratios)
+        self.torque_curve = compile_torque_curve(tuple(tuple(x) for x in data["torque_curve"]))
+        self.rho = float(data.get("rho", RHO))          # optional, air density on the day
+
+        # Derived constants
+        self.Ft = calc_Ft(data)                         # traction limit in N
+        self.drag = 0.5 * self.Cd * self.A * self.rho   # Fd = drag * v²
+        self.Fr = self.Crr * self.W * G                 # rolling resistance force in N
+        self.shift_rpm = shift_points(data)
+        self.rpm_per_ms = [ratio * self.final_drive / (self.tire_diameter * np.pi) for ratio in self.gear_ratios]
+
+        # P is only informational in the 0.2 engine, fall back to the curve's peak
+        self.P = float(data["P"]) if data.get("P") else None
+        if not self.P:
+            curve = self.torque_curve
+            self.P = float(curve.power(np.linspace(curve.rpm_min, curve.rpm_max, 200)).max())
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def __repr__(self):
+        return f"Car({self.name!r})"
+
+    # Pickles as its fields, the constants are rebuilt on the other side
+    def __reduce__(self):
+        return (Car, (self.data,))
+
+
+# bool is an int, but True isn't a weight
+def is_number(value):
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+
+# Read-only copy of a field, lists (and lists of lists) as tuples
+def frozen(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(frozen(item) for item in value)
+    return value
+
+
+def is_number_list(values):
+    return isinstance(values, (list, tuple)) and all(is_number(value) for value in values)
+
+
+def validate_car(data):
+    name = data.get("Name", "unnamed car")
+
+    missing = [field for field in REQUIRED_FIELDS if field not in data]
+    if missing:
+        raise ValueError(f"{name}: missing {', '.join(missing)}")
+
+    # Types first, so a value like "1500" or null is a ValueError naming the
+    # field rather than a TypeError from the comparisons below
+    for field in tuple(FIELD_RANGES) + ("final_drive", "Wheels", "Driven Wheels"):
+        if not is_number(data[field]):
+            raise ValueError(f"{name}: {field} = {data[field]!r} is not a number")
+    for field in ("gear_ratios", "shift_rpm"):
+        values = data.get(field)
+        if (values is not None or field == "gear_ratios") and not is_number_list(values):
+            raise ValueError(f"{name}: {field} has to be a list of numbers")
+    torque_curve = data["torque_curve"]
+    if not isinstance(torque_curve, (list, tuple)) or not all(
+            is_number_list(point) and len(point) == 2 for point in torque_curve):
+        raise ValueError(f"{name}: torque_curve has to be a list of (rpm, Nm) number pairs")
+    for field in ("rho", "P"):
+        if data.get(field) is not None and not is_number(data[field]):
+            raise ValueError(f"{name}: {field} = {data[field]!r} is not a number")
+
+    for field, (low, high, unit) in FIELD_RANGES.items():
+        if not low <= data[field] <= high:
+            raise ValueError(f"{name}: {field} = {data[field]} is outside {low}-{high} {unit}".rstrip())
+
+    if data["final_drive"] <= 0 or not data["gear_ratios"] or min(data["gear_ratios"]) <= 0:
+        raise ValueError(f"{name}: gear_ratios and final_drive must be positive")
+
+    if not 0 < data["Driven Wheels"] <= data["Wheels"]:
+        raise ValueError(f"{name}: Driven Wheels must be between 1 and Wheels")
+
+    rpm = [x[0] for x in torque_curve]
+    if len(torque_curve) < 4 or any(b <= a for a, b in zip(rpm, rpm[1:])):
+        raise ValueError(f"{name}: torque_curve needs at least 4 (rpm, Nm) points in increasing rpm")
+
+    if any(x[1] < 0 for x in torque_curve):
+        raise ValueError(f"{name}: torque_curve has negative torque")
+
+    rho = data.get("rho")
+    if rho is not None and not RHO_RANGE[0] <= rho <= RHO_RANGE[1]:
+        raise ValueError(f"{name}: rho = {rho} is outside {RHO_RANGE[0]}-{RHO_RANGE[1]} kg/m³")
+
+    shift_rpm = data.get("shift_rpm")
+    if shift_rpm is not None:
+        if len(shift_rpm) not in (len(data["gear_ratios"]) - 1, len(data["gear_ratios"])):
+            raise ValueError(f"{name}: shift_rpm needs one rpm per gear (the last one optional)")
+        if min(shift_rpm) <= LAUNCH_RPM or max(shift_rpm) > data["redline"]:
+            raise ValueError(f"{name}: shift_rpm has to be between {LAUNCH_RPM} and the redline")
+
+    top = max(shift_points(data))
+    if rpm[0] > LAUNCH_RPM or rpm[-1] < top:
+        raise ValueError(f"{name}: torque_curve has to cover {LAUNCH_RPM}-{top:.0f} rpm")
+
+
+# Upshift rpm for each gear. Optional "shift_rpm" field, one per gear, and
+# redline - SHIFT_MARGIN for any gear it doesn't cover.
+def shift_points(data):
+    default = float(data["redline"] - SHIFT_MARGIN)
+    shift_rpm = [float(x) for x in data.get("shift_rpm") or []]
+    return shift_rpm + [default] * (len(data["gear_ratios"]) - len(shift_rpm))
+
+
+def as_car(car):
+    return car if isinstance(car, Car) else Car(car)
+
+
+# strict=True raises on the first entry that isn't a valid 0.2 car, otherwise
+# those (the older 0.1 entries) are skipped
+def load_cars(path="cars.json", strict=False):
+    with open(path, "r") as file:
         cars = json.load(file)
 
-    for i in cars:
-        if i["Name"] == "Honda Accord": # Change this to the car you want to simulate
-            car = i
-            break
-            
-
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        # Submit the function to be executed in a separate thread
-        future = executor.submit(simulate_quarter_mile, car)
-            
-        # Get the result from the future
-        result = future.result()
-        graph_and_print(car, result)
-
-    # simulate_quarter_mile(car)
-    # print(calc_top_speed(car))
+    loaded = []
+    for car in cars:
+        try:
+            loaded.append(Car(car))
+        except ValueError:
+            if strict:
+                raise
 
+    return loaded
 
-    # Create a thread to run the simulation
-    # simulation_thread = threading.Thread(target=simulate_quarter_mile, args=(car,))
+# Main function
+def main():
+    # Change this to the car you want to simulate, from cars.json or a catalog
+    # directory (catalog.py), which finds it without reading every car. Just the
+    # fields are taken, run as a script this module isn't the carsim catalog uses.
+    import catalog
+    car = Car(catalog.load_car("cars.json", "Honda Accord").data)
+
+    # For many cars at once use fleet.py, which spreads them over processes
+    result = simulate_quarter_mile(car)
+    graph_and_print(car, result)
 
-    # Start the thread
-    # simulation_thread.start()
-    
-    # Optionally, wait for the thread to finish
-    # simulation_thread.join()
+    # print(calc_top_speed(car))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,275 @@
+# carsim car catalog
+# cars.json is parsed whole and searched car by car, fine for a handful of cars
+# but not for the tens of thousands of variants sweeps produce. A catalog is a
+# directory with one .npy file per field, opened memory mapped, so a lookup
+# only reads the columns it filters on and the rows it returns. List fields
+# (gear_ratios, torque_curve, shift_rpm) are stored flat with a row offsets
+# column. Name, Year and peak power have sorted indexes for binary search.
+#
+#   python catalog.py import cars.json cars.catalog
+#   python catalog.py find cars.catalog --year 2023 --layout FR --hp 300:500
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+import carsim
+
+
+CATALOG_VERSION = 1
+
+# Scalar fields and their column dtypes, strings are sized to the longest
+NUMBER_FIELDS = {
+    "Year": "i4", "Wheels": "i2", "Driven Wheels": "i2",
+    "W": "f8", "P": "f8", "Cd": "f8", "A": "f8", "Crr": "f8", "mu": "f8",
+    "redline": "f8", "tire_diameter": "f8", "final_drive": "f8",
+}
+STRING_FIELDS = ("Name", "Drive Layout", "Engine")
+LIST_FIELDS = ("gear_ratios", "torque_curve", "shift_rpm")
+
+# Columns with a sorted index next to them
+INDEXED = ("Name", "Year", "peak_power")
+
+MISSING = -1    # stored in integer columns for a field that wasn't given
+
+
+def file_name(field):
+    return field.lower().replace(" ", "_")
+
+
+# Fields carsim.validate_car doesn't need as integers but the integer columns
+# do: Year (optional) and the wheel counts
+def validate_row(car):
+    for field, dtype in NUMBER_FIELDS.items():
+        value = car.data.get(field)
+        if dtype.startswith("i") and value is not None and not (
+                carsim.is_number(value) and float(value).is_integer() and 0 <= value < 2 ** 15):
+            raise ValueError(f"{car.name or 'unnamed car'}: {field} = {value!r} is not a whole number")
+
+
+# Writes cars (Car objects or car dicts, validated on the way) as a catalog
+# in `path`. Fields outside the schema are kept in extras.json. Returns the count.
+def write_catalog(cars, path):
+    cars = [carsim.as_car(car) for car in cars]
+    for car in cars:
+        validate_row(car)
+    os.makedirs(path, exist_ok=True)
+
+    def save(name, values):
+        np.save(os.path.join(path, name + ".npy"), values)
+
+    for field, dtype in NUMBER_FIELDS.items():
+        save(file_name(field), np.array([car.data.get(field, np.nan if dtype == "f8" else MISSING) for car in cars], dtype))
+
+    for field in STRING_FIELDS:
+        save(file_name(field), np.array([str(car.data.get(field, "")) for car in cars], dtype=str))
+
+    for field in LIST_FIELDS:
+        lists = [car.data.get(field, []) for car in cars]
+        offsets = np.zeros(len(cars) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(values) for values in lists])
+        flat = [value for values in lists for value in values]
+        values = np.array(flat, dtype=float).reshape((-1, 2) if field == "torque_curve" else -1)
+        save(file_name(field), values)
+        save(file_name(field) + ".offsets", offsets)
+
+    # Peak power for every car, P or not, so power range queries cover all of them
+    save("peak_power", np.array([car.P for car in cars], dtype=float))
+
+    for field in INDEXED:
+        values = np.load(os.path.join(path, file_name(field) + ".npy"))
+        order = np.argsort(values, kind="stable")
+        save(file_name(field) + ".order", order)
+        save(file_name(field) + ".sorted", values[order])
+
+    known = set(NUMBER_FIELDS) | set(STRING_FIELDS) | set(LIST_FIELDS)
+    extras = {row: {key: value for key, value in car.data.items() if key not in known}
+              for row, car in enumerate(cars)}
+    extras = {row: fields for row, fields in extras.items() if fields}
+
+    with open(os.path.join(path, "extras.json"), "w") as file:
+        json.dump(extras, file)
+    with open(os.path.join(path, "meta.json"), "w") as file:
+        json.dump({"version": CATALOG_VERSION, "count": len(cars)}, file)
+
+    return len(cars)
+
+
+# cars.json to a catalog, invalid cars are skipped with a message on stderr
+# (strict=True raises instead)
+def import_json(json_path, path, strict=False):
+    with open(json_path) as file:
+        records = json.load(file)
+
+    cars = []
+    for record in records:
+        try:
+            car = carsim.Car(record)
+            validate_row(car)
+        except ValueError as error:
+            if strict:
+                raise
+            print(f"Skipping {error}", file=sys.stderr)
+            continue
+        cars.append(car)
+
+    return write_catalog(cars, path)
+
+
+class Catalog:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as file:
+            meta = json.load(file)
+        if meta["version"] != CATALOG_VERSION:
+            raise ValueError(f"{path} is a version {meta['version']} catalog, expected {CATALOG_VERSION}")
+
+        self.count = meta["count"]
+        self.columns = {}
+        self.extras = None
+
+    def __len__(self):
+        return self.count
+
+    # A column, memory mapped on first use
+    def column(self, name):
+        values = self.columns.get(name)
+        if values is None:
+            values = np.load(os.path.join(self.path, name + ".npy"), mmap_mode="r")
+            self.columns[name] = values
+        return values
+
+    # Rows whose indexed `field` is value, or within (low, high) inclusive, ascending
+    def lookup(self, field, value):
+        low, high = value if isinstance(value, tuple) else (value, value)
+        values = self.column(file_name(field) + ".sorted")
+        start = np.searchsorted(values, low, side="left")
+        stop = np.searchsorted(values, high, side="right")
+        return np.sort(self.column(file_name(field) + ".order")[start:stop])
+
+    # Row numbers matching every given criterion. year and power (peak power
+    # in watts) can be a value or an inclusive (low, high) range.
+    def rows(self, name=None, year=None, layout=None, power=None):
+        rows = None
+
+        def narrow(found):
+            return found if rows is None else np.intersect1d(rows, found, assume_unique=True)
+
+        if name is not None:
+            rows = narrow(self.lookup("Name", name))
+        if year is not None:
+            rows = narrow(self.lookup("Year", year))
+        if power is not None:
+            rows = narrow(self.lookup("peak_power", power))
+        if layout is not None:
+            column = self.column(file_name("Drive Layout"))
+            rows = np.flatnonzero(column == layout) if rows is None else rows[column[rows] == layout]
+
+        return np.arange(self.count) if rows is None else rows
+
+    # The cars.json style fields of one row
+    def record(self, row):
+        row = int(row)
+        if not 0 <= row < self.count:
+            raise ValueError(f"Row {row} is out of range for a catalog of {self.count} cars")
+
+        data = {}
+        for field in STRING_FIELDS:
+            data[field] = str(self.column(file_name(field))[row])
+        for field, dtype in NUMBER_FIELDS.items():
+            value = self.column(file_name(field))[row].item()
+            if value != value or (dtype != "f8" and value == MISSING):
+                continue    # NaN or MISSING, field wasn't given
+            data[field] = value
+
+        for field in LIST_FIELDS:
+            offsets = self.column(file_name(field) + ".offsets")
+            values = self.column(file_name(field))[offsets[row]:offsets[row + 1]].tolist()
+            if values or field != "shift_rpm":
+                data[field] = values
+
+        if self.extras is None:
+            with open(os.path.join(self.path, "extras.json")) as file:
+                self.extras = {int(row): fields for row, fields in json.load(file).items()}
+        data.update(self.extras.get(row, {}))
+
+        return data
+
+    def car(self, row):
+        return carsim.Car(self.record(row))
+
+    def load(self, rows):
+        return [self.car(row) for row in rows]
+
+    def find(self, **criteria):
+        return self.load(self.rows(**criteria))
+
+    # First car with this name, or None
+    def get(self, name):
+        rows = self.rows(name=name)
+        return self.car(rows[0]) if len(rows) else None
+
+
+# A car by name from either a cars.json file or a catalog directory, None if missing
+def load_car(path, name):
+    if os.path.isdir(path):
+        return Catalog(path).get(name)
+    return next((car for car in carsim.load_cars(path) if car["Name"] == name), None)
+
+
+# All the cars in either a cars.json file or a catalog directory
+def load_all(path):
+    if os.path.isdir(path):
+        catalog = Catalog(path)
+        return catalog.load(range(len(catalog)))
+    return carsim.load_cars(path)
+
+
+# "300:500" -> (300.0, 500.0), "2023" -> 2023.0
+def parse_range(text):
+    if ":" in text:
+        low, high = text.split(":")
+        return float(low), float(high)
+    return float(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query car catalogs")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("import", help="build a catalog from a cars.json file")
+    build.add_argument("json")
+    build.add_argument("catalog")
+    build.add_argument("--strict", action="store_true", help="fail on invalid cars instead of skipping them")
+
+    find = commands.add_parser("find", help="list the cars matching all the filters")
+    find.add_argument("catalog")
+    find.add_argument("--name")
+    find.add_argument("--year", help="year or first:last")
+    find.add_argument("--layout", help="drive layout, FF, FR, MR...")
+    find.add_argument("--hp", help="peak power range in hp, low:high")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        count = import_json(args.json, args.catalog, args.strict)
+        print(f"{count} cars written to {args.catalog}")
+        return
+
+    catalog = Catalog(args.catalog)
+    year = parse_range(args.year) if args.year else None
+    power = None
+    if args.hp:
+        power = parse_range(args.hp)
+        power = tuple(map(carsim.hp_to_watt, power)) if isinstance(power, tuple) else carsim.hp_to_watt(power)
+
+    for row in catalog.rows(args.name, year, args.layout, power):
+        data = catalog.record(row)
+        print(f"{row:>8}  {data.get('Year', '----')} {data['Name']:<24}{data.get('Drive Layout', ''):<6}"
+              f"{carsim.watt_to_hp(catalog.column('peak_power')[row]):7.0f} hp")
+
+
+if __name__ == "__main__":
+    main()
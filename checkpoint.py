@@ -0,0 +1,92 @@
+# carsim checkpoints
+# Tuning usually changes one thing at a time: a top gear ratio, the shift point
+# for 4th, the final drive. A run only depends on a gear's ratio and shift point
+# from the moment it gets into that gear, so everything before is the same as
+# last time. simulate_checkpointed saves the full state of the run (time, speed,
+# distance, gear, the summary values so far, the recorded steps) each time it
+# gets into a gear and can carry on from any of those states. A Session keeps
+# the last run's checkpoints, works out from the difference between the last
+# car and the new one which checkpoints still hold and resumes from the latest
+# of them. Runs carry on through simulate_quarter_mile's own loop, so results
+# are the same as a full run's (checked in bench.py).
+#
+#   session = checkpoint.Session()
+#   session.simulate(car)                 # car: a dict of cars.json fields
+#   car["gear_ratios"][4] = 0.72
+#   session.simulate(car)       # picks up where the car got into 5th
+
+import carsim
+from telemetry import Telemetry
+
+
+START = carsim.START
+
+
+# Number of gears (from the start) whose runs are the same for both cars, so
+# checkpoints up to getting into gear `resume_gear(old, new) + 1` still hold.
+# 0 if anything that acts in every gear changed (weight, traction, drag,
+# rolling resistance, torque curve, final drive, tires).
+def resume_gear(old, new):
+    old = carsim.as_car(old)
+    new = carsim.as_car(new)
+
+    if (old.W, old.Ft, old.drag, old.Fr, old.torque_curve.points) != \
+            (new.W, new.Ft, new.drag, new.Fr, new.torque_curve.points):
+        return 0
+
+    # Getting into gear g depends on the ratios and shift points of the gears
+    # below it only, so the first gear that differs can still be entered as before
+    for gear in range(min(old.n_gears, new.n_gears)):
+        if old.rpm_per_ms[gear] != new.rpm_per_ms[gear] or old.shift_rpm[gear] != new.shift_rpm[gear]:
+            return gear
+    return min(old.n_gears, new.n_gears) - 1
+
+
+# simulate_quarter_mile that checkpoints each gear. Returns (data, checkpoints,
+# telemetry), checkpoints[g] being the carsim.run_state on getting into gear
+# g + 1 and data having the steps taken on top of the usual keys. `resume`
+# carries on from an earlier run: its checkpoints up to the one to start from,
+# and its Telemetry when recording.
+def simulate_checkpointed(car, record=True, resume=(START,), recorded=None):
+    car = carsim.as_car(car)
+    checkpoints = list(resume)
+    start = checkpoints[-1]
+
+    telemetry = None
+    if record:
+        capacity = 1.25 * carsim.estimate_quarter_time(car) / carsim.DELTA_T
+        telemetry = recorded.head(start["samples"], capacity) if recorded is not None else Telemetry(capacity)
+
+    steps = carsim.quarter_mile_steps(car, 0, telemetry, start=start, checkpoints=checkpoints)
+    data = carsim.run_steps(steps)
+
+    if record:
+        data.update(telemetry.data())
+
+    return data, checkpoints, telemetry
+
+
+# Runs cars one after another, each from the last checkpoint the previous
+# car's run still shares with it
+class Session:
+    def __init__(self, record=True):
+        self.record = record
+        self.car = None
+        self.checkpoints = None
+        self.telemetry = None
+        self.steps = 0          # steps simulated, over all runs
+        self.skipped = 0        # steps taken from checkpoints instead
+
+    def simulate(self, car):
+        car = carsim.as_car(car)
+
+        resume = (START,)
+        if self.car is not None:
+            resume = self.checkpoints[:resume_gear(self.car, car) + 1]
+
+        data, checkpoints, telemetry = simulate_checkpointed(car, self.record, resume, self.telemetry)
+
+        self.skipped += resume[-1]["steps"]
+        self.steps += data["steps"] - resume[-1]["steps"]
+        self.car, self.checkpoints, self.telemetry = car, checkpoints, telemetry
+        return data
@@ -0,0 +1,130 @@
+# carsim client
+# Talks to server.py over HTTP or its Unix socket, keeping one connection open.
+#
+#   python client.py "Honda Accord"
+#   python client.py "Honda Accord" "Ford Mustang" --set W=1500 --set "gear_ratios[5]=0.7"
+#   python client.py --spec mycar.json --engine quadrature --unix /tmp/carsim.sock
+#   python client.py --metrics
+#
+#   client = Client(unix="/tmp/carsim.sock")
+#   client.simulate("Honda Accord", {"final_drive": 3.9})
+
+import argparse
+import http.client
+import json
+import socket
+import sys
+
+
+class UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=60):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class Client:
+    def __init__(self, host="127.0.0.1", port=8765, unix=None, timeout=60):
+        if unix is not None:
+            self.connection = UnixConnection(unix, timeout)
+        else:
+            self.connection = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def request(self, method, path, data=None):
+        body = None if data is None else json.dumps(data)
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        try:
+            self.connection.request(method, path, body, headers)
+            response = self.connection.getresponse()
+        except (ConnectionError, http.client.HTTPException):
+            # The server closed a kept-alive connection, try once on a new one
+            self.connection.close()
+            self.connection.request(method, path, body, headers)
+            response = self.connection.getresponse()
+
+        data = json.loads(response.read())
+        if response.status != 200:
+            raise ValueError(f"Server answered {response.status}: {data.get('error')}")
+        return data
+
+    # car: a name the server knows or a dict of cars.json fields. changes:
+    # {field path: value} on top, as in sweep.py.
+    def simulate(self, car, changes=None, engine="euler"):
+        return self.request("POST", "/simulate", self.car_request(car, changes, engine))
+
+    def simulate_many(self, cars, changes=None, engine="euler"):
+        requests = [self.car_request(car, changes, engine) for car in cars]
+        return self.request("POST", "/simulate", {"cars": requests})["results"]
+
+    def car_request(self, car, changes, engine):
+        request = {"car": car, "engine": engine}
+        if changes:
+            request["set"] = changes
+        return request
+
+    def metrics(self):
+        return self.request("GET", "/metrics")
+
+    def cars(self):
+        return self.request("GET", "/cars")["cars"]
+
+    def close(self):
+        self.connection.close()
+
+
+# "W=1500" -> ("W", 1500.0)
+def parse_change(text):
+    path, _, value = text.partition("=")
+    if not path or not value:
+        raise ValueError(f"Can't parse {text!r}, expected field=value")
+    return path.strip(), float(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query a running carsim server")
+    parser.add_argument("names", nargs="*", help="cars the server knows by name")
+    parser.add_argument("--spec", action="append", default=[], help="JSON file with a car (or a list of cars)")
+    parser.add_argument("--set", action="append", default=[], help="field=value change applied to every car")
+    parser.add_argument("--engine", default="euler", choices=("euler", "quadrature"))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="server's Unix socket")
+    parser.add_argument("--metrics", action="store_true", help="print the server's metrics")
+    parser.add_argument("--list", action="store_true", help="list the cars the server knows")
+    args = parser.parse_args()
+
+    cars = list(args.names)
+    for path in args.spec:
+        with open(path) as file:
+            spec = json.load(file)
+        cars.extend(spec if isinstance(spec, list) else [spec])
+
+    try:
+        changes = dict(parse_change(text) for text in args.set)
+    except ValueError as error:
+        sys.exit(str(error))
+
+    client = Client(args.host, args.port, args.unix)
+    try:
+        if args.list:
+            print("\n".join(client.cars()))
+        if cars:
+            for result in client.simulate_many(cars, changes, args.engine):
+                values = ", ".join(f"{key} {value:.3f}" if value is not None else f"{key} -"
+                                   for key, value in result.items() if key != "name")
+                print(f"{result['name']}: {values}")
+        if args.metrics:
+            for key, value in client.metrics().items():
+                print(f"{key}: {value}")
+    except ValueError as error:
+        sys.exit(str(error))
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
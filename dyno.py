@@ -0,0 +1,162 @@
+# carsim virtual dyno
+# Engine and wheel curves as whole arrays instead of calc_power/calc_rpm calls
+# in loops: torque and power against rpm, and tractive force against road speed
+# in every gear, for one car or a fleet in one go. The engine force is the one
+# simulate_quarter_mile uses (power at the wheels over speed, held below
+# 0.01 m/s), but the chart caps it at the traction limit Ft before taking off
+# drag and rolling resistance, as a dyno shows it. The simulator caps the net
+# force instead, so "net" here is lower than the simulator's whenever the
+# engine out-pulls the tires; forcetable.py builds its table from "engine".
+#
+#   python dyno.py "Ford Mustang"              # table in the terminal
+#   python dyno.py "Ford Mustang" -o mustang   # mustang.png, via report.py
+
+import argparse
+
+import numpy as np
+
+import carsim
+import catalog
+
+
+# Usable rpm range of a car: the curve up to the redline
+def rpm_range(car):
+    car = carsim.as_car(car)
+    return car.torque_curve.rpm_min, min(car.redline, car.torque_curve.rpm_max)
+
+
+# Torque (Nm), power and power at the wheels (W) over `rpm`, by default
+# `points` rpms across the car's usable range
+def engine_curves(car, rpm=None, points=200):
+    car = carsim.as_car(car)
+    if rpm is None:
+        rpm = np.linspace(*rpm_range(car), points)
+    rpm = np.asarray(rpm, dtype=float)
+
+    torque = car.torque_curve.torque(rpm)
+    power = torque * rpm * 2 * np.pi / 60
+
+    return {
+        "rpm": rpm,
+        "torque": torque,
+        "power": power,
+        "wheel_power": power * (1 - carsim.DRIVETRAIN_POWER_LOSS),
+    }
+
+
+# Road speeds from standstill to the top speed at redline in the top gear
+def speed_grid(car, points=200):
+    return np.linspace(0, max(carsim.calc_top_speed(carsim.as_car(car))), points)
+
+
+# Forces in N against road speed, one row per gear: "engine" what the engine
+# pushes through each gear (NaN outside the gear's rpm range), "tractive" that
+# capped by traction, "net" after drag and rolling resistance, plus the rpm.
+# First gear is held at LAUNCH_RPM below it, as in the simulator.
+def tractive_force(car, speeds=None, points=200):
+    car = carsim.as_car(car)
+    if speeds is None:
+        speeds = speed_grid(car, points)
+    speeds = np.asarray(speeds, dtype=float)
+
+    low, high = rpm_range(car)
+    rpm = np.asarray(car.rpm_per_ms)[:, None] * speeds
+    rpm[0] = np.maximum(rpm[0], carsim.LAUNCH_RPM)     # launch control, like the simulator
+    usable = (rpm >= low) & (rpm <= high)
+
+    wheel_power = np.full(rpm.shape, np.nan)
+    wheel_power[usable] = car.torque_curve.power(rpm[usable]) * (1 - carsim.DRIVETRAIN_POWER_LOSS)
+
+    engine = wheel_power / np.maximum(speeds, 0.01)
+    tractive = np.minimum(engine, car.Ft)
+    net = tractive - car.drag * speeds**2 - car.Fr
+
+    return {"speed": speeds, "rpm": rpm, "engine": engine, "tractive": tractive, "net": net}
+
+
+# Best of the gears at each speed: the net force and the gear giving it
+# (0 based, -1 where no gear can run)
+def envelope(forces):
+    net = np.where(np.isnan(forces["net"]), -np.inf, forces["net"])
+    runnable = np.isfinite(net).any(axis=-2)
+    gear = np.where(runnable, net.argmax(axis=-2), -1)
+    best = np.where(runnable, net.max(axis=-2), np.nan)
+    return best, gear
+
+
+# engine_curves for many cars at once, each over its own usable range.
+# Arrays are (car, point).
+def fleet_engine_curves(cars, points=200):
+    cars = [carsim.as_car(car) for car in cars]
+    curves = carsim.TorqueCurveSet([car.torque_curve for car in cars])
+    ranges = np.array([rpm_range(car) for car in cars])
+
+    rpm = ranges[:, :1] + (ranges[:, 1:] - ranges[:, :1]) * np.linspace(0, 1, points)
+    torque = curves.torque_table(rpm)
+    power = torque * rpm * 2 * np.pi / 60
+
+    return {"rpm": rpm, "torque": torque, "power": power,
+            "wheel_power": power * (1 - carsim.DRIVETRAIN_POWER_LOSS)}
+
+
+# tractive_force for many cars over one shared speed grid. Arrays are
+# (car, gear, speed), gears a car doesn't have are NaN. With numba every car,
+# gear and speed is worked out in one compiled pass over the kernel.py parameter
+# table. numpy arrays that size don't fit in cache, so a vectorized version
+# was no faster than going car by car, which is what runs without numba.
+def fleet_tractive_force(cars, speeds=None, points=200):
+    import kernel     # numba takes a while to import, only pay for it once there's work
+
+    cars = [carsim.as_car(car) for car in cars]
+    if speeds is None:
+        speeds = np.linspace(0, max((max(carsim.calc_top_speed(car)) for car in cars), default=0), points)
+    speeds = np.asarray(speeds, dtype=float)
+    n_gears = max((car.n_gears for car in cars), default=0)
+
+    if kernel.HAVE_NUMBA:
+        high = np.array([rpm_range(car)[1] for car in cars])
+        rpm, engine, tractive, net = kernel.dyno_kernel(kernel.pack_fleet(cars), high, speeds,
+                                                        carsim.DRIVETRAIN_POWER_LOSS, carsim.LAUNCH_RPM, n_gears)
+        return {"speed": speeds, "rpm": rpm, "engine": engine, "tractive": tractive, "net": net}
+
+    forces = {key: np.full((len(cars), n_gears, len(speeds)), np.nan) for key in ("rpm", "engine", "tractive", "net")}
+    for row, car in enumerate(cars):
+        single = tractive_force(car, speeds)
+        for key, values in forces.items():
+            values[row, :car.n_gears] = single[key]
+    return dict(forces, speed=speeds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dyno charts: engine curves and tractive force per gear")
+    parser.add_argument("car", help="name of the car")
+    parser.add_argument("--cars", default="cars.json", help="cars.json file or catalog directory")
+    parser.add_argument("--points", type=int, default=200)
+    parser.add_argument("-o", "--output", help="write a chart to this path (no extension) instead of a table")
+    parser.add_argument("--format", nargs="+", default=["png"])
+    args = parser.parse_args()
+
+    car = catalog.load_car(args.cars, args.car)
+    if car is None:
+        parser.error(f"no car named {args.car!r} in {args.cars}")
+
+    if args.output:
+        import report
+        report.render_dyno(car, args.output, args.format, args.points)
+        return
+
+    engine = engine_curves(car, points=11)
+    print(f"{'rpm':>8}{'torque Nm':>12}{'power hp':>10}")
+    for rpm, torque, power in zip(engine["rpm"], engine["torque"], engine["power"]):
+        print(f"{rpm:8.0f}{torque:12.1f}{carsim.watt_to_hp(power):10.1f}")
+
+    forces = tractive_force(car, np.arange(0, max(carsim.calc_top_speed(car)), carsim.mph_to_ms(10)))
+    best, gear = envelope(forces)
+    print(f"\n{'mph':>8}" + "".join(f"{'gear ' + str(g + 1):>10}" for g in range(car.n_gears)) + f"{'best':>10}")
+    for k, speed in enumerate(forces["speed"]):
+        cells = "".join(f"{force:10.0f}" if force == force else f"{'':>10}" for force in forces["tractive"][:, k])
+        print(f"{carsim.ms_to_mph(speed):8.0f}{cells}{'gear ' + str(gear[k] + 1) if gear[k] >= 0 else '':>10}")
+
+
+if __name__ == "__main__":
+    main()
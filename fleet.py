@@ -0,0 +1,184 @@
+# carsim fleet runner
+# Spreads a list of cars (or any generator of them) over worker processes in
+# chunks and streams the results back as each chunk finishes.
+#
+#   python fleet.py cars.json --workers 4 --chunk-size 256
+
+import argparse
+import concurrent.futures
+import os
+from itertools import islice
+
+import numpy as np
+
+import carsim
+import catalog
+
+
+# One row per car, sent back from the workers as a single array per chunk
+RESULT_DTYPE = np.dtype([
+    ("quarter_time", "f8"),
+    ("quarter_speed", "f8"),
+    ("0-60 mph", "f8"),
+])
+
+
+def chunked(cars, size):
+    cars = iter(cars)
+    while True:
+        chunk = list(islice(cars, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# Runs in the worker. Returns the index of the chunk's first car with its
+# results, using the compiled kernel when numba is there and the numpy batch
+# engine otherwise. Cars that don't validate (easy to produce in a sweep) get NaN rows.
+def run_chunk(start, cars):
+    results = np.empty(len(cars), dtype=RESULT_DTYPE)
+    for field in RESULT_DTYPE.names:
+        results[field] = np.nan
+
+    valid = []
+    rows = []
+    for row, car in enumerate(cars):
+        try:
+            valid.append(carsim.as_car(car))
+            rows.append(row)
+        except ValueError:
+            pass
+
+    if valid:
+        import kernel     # numba takes a while to import, only pay for it once there's work
+        data = kernel.simulate_fleet_kernel(valid)
+        for field in RESULT_DTYPE.names:
+            results[field][rows] = data[field]
+
+    return start, results
+
+
+# Each worker process is one core's worth of work, keep numba from also threading
+def init_worker():
+    import kernel
+    if kernel.HAVE_NUMBA:
+        import numba
+        numba.set_num_threads(1)
+
+
+# Just the fields go to the workers, they rebuild the Car and its constants
+def strip_car(car):
+    if isinstance(car, carsim.Car):
+        return car.data
+    return {key: value for key, value in car.items() if not key.startswith("_")}
+
+
+def make_executor(workers=None):
+    return concurrent.futures.ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=init_worker)
+
+
+# Yields (start, results) as chunks finish, in completion order. results[k]
+# belongs to the car at position start + k of `cars`. Only a few chunks per
+# worker are in flight at once, so `cars` can be a lazy generator of any length.
+# Callers running many small fleets can pass their own make_executor() pool
+# so worker processes aren't started for every fleet.
+def run_fleet(cars, workers=None, chunk_size=256, executor=None):
+    workers = workers or os.cpu_count()
+    chunks = chunked(cars, chunk_size)
+
+    # Under a profiling.Profiler the chunks are timed where they run
+    profiler = carsim.PROFILER
+    if profiler is not None:
+        import profiling
+        task = profiling.run_chunk_timed
+    else:
+        task = run_chunk
+
+    def finished(result):
+        if profiler is None:
+            return result
+        profiling.record_chunk(profiler, result[2])
+        return result[:2]
+
+    if workers == 1 and executor is None:
+        start = 0
+        for chunk in chunks:
+            yield finished(task(start, chunk))
+            start += len(chunk)
+        return
+
+    owned = executor is None
+    if owned:
+        executor = make_executor(workers)
+
+    try:
+        pending = set()
+        start = 0
+
+        for chunk in chunks:
+            pending.add(executor.submit(task, start, [strip_car(car) for car in chunk]))
+            start += len(chunk)
+
+            if len(pending) >= 2 * workers:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield finished(future.result())
+
+        for future in concurrent.futures.as_completed(pending):
+            yield finished(future.result())
+    finally:
+        if owned:
+            executor.shutdown()
+
+
+# Runs the whole fleet and returns one results array in input order
+def simulate_fleet(cars, workers=None, chunk_size=256, executor=None):
+    cars = list(cars)
+    results = np.empty(len(cars), dtype=RESULT_DTYPE)
+
+    for start, chunk in run_fleet(cars, workers, chunk_size, executor):
+        results[start:start + len(chunk)] = chunk
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate every car in a cars.json file across processes")
+    parser.add_argument("path", nargs="?", default="cars.json", help="cars.json file or catalog directory")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--chunk-size", type=int, default=256, help="cars per task sent to a worker")
+    parser.add_argument("--store", help="also write the results to this resultstore directory")
+    parser.add_argument("--traces", action="store_true", help="with --store, keep every car's traces too")
+    parser.add_argument("--quiet", action="store_true", help="don't print a line per car")
+    args = parser.parse_args()
+
+    cars = catalog.load_all(args.path)
+
+    writer = None
+    if args.store:
+        import resultstore
+        store = resultstore.ResultStore(args.store)
+        first = len(store)
+        writer = store.writer()
+
+    for start, results in run_fleet(cars, args.workers, args.chunk_size):
+        if writer is not None:
+            writer.append(results, first + start)
+        if args.quiet:
+            continue
+        for car, row in zip(cars[start:], results):
+            print(f"{car['Year']} {car['Name']:<24}"
+                  f"{row['quarter_time']:6.2f} s\t"
+                  f"{carsim.ms_to_mph(row['quarter_speed']):6.2f} mph\t"
+                  f"0-60 {row['0-60 mph']:5.2f} s")
+
+    if writer is not None:
+        if args.traces:
+            for i, car in enumerate(cars):
+                writer.append_trace(first + i, carsim.simulate_quarter_mile(car))
+        writer.close()
+        print(f"{len(cars)} results written to {args.store} ({len(store)} in total)")
+
+
+if __name__ == "__main__":
+    main()
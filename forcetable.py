@@ -0,0 +1,202 @@
+# carsim force tables
+# Everything simulate_quarter_mile works out at each step (rpm, launch control,
+# torque, power, engine force, drag, rolling resistance, the traction cap) only
+# depends on the gear and the speed, so for a given car it can be worked out
+# once. A ForceTable holds it per gear over a dense speed grid, from standstill
+# to the gear's top speed at redline, along with the best gear at each speed.
+# simulate_table then steps the car like the Euler loop but reads the
+# acceleration off the table, one lookup and a linear interpolation per step.
+#
+# Tables are plain numpy arrays (and list copies for the scalar loop), so any
+# engine can use them, and force_table() keeps the last ones built so runs of
+# the same car share them.
+#
+#   carsim.simulate_quarter_mile(car, integrator="table")
+#   table = forcetable.force_table(car)
+#   table.acceleration(gear, v), table.best_gear(v)
+
+from collections import OrderedDict
+
+import numpy as np
+
+import carsim
+import dyno
+import simcache
+from telemetry import Telemetry
+
+
+DV = 0.01               # default grid spacing in m/s
+CACHE_SIZE = 256        # tables force_table keeps
+
+_tables = OrderedDict()
+
+
+class ForceTable:
+    # Arrays are (gear, speed) over the shared grid speeds = k * dv, NaN above
+    # a gear's top speed and where its rpm is off the torque curve
+    def __init__(self, car, dv=DV):
+        car = carsim.as_car(car)
+        self.car = car
+        self.dv = dv
+
+        top = carsim.calc_top_speed(car)
+        self.speeds = np.arange(int(max(top) / dv) + 2) * dv
+        forces = dyno.tractive_force(car, self.speeds)
+
+        # Net force capped at Ft as in the simulator, which caps Fe - Fd - Fr
+        # rather than Fe alone like the dyno chart does
+        speeds = self.speeds
+        self.rpm = forces["rpm"]
+        self.power = forces["engine"] * np.maximum(speeds, 0.01)     # at the wheels
+        self.net = np.minimum(forces["engine"] - car.drag * speeds**2 - car.Fr, car.Ft)
+
+        # Each gear stops one grid point past its top speed
+        self.sizes = [min(int(gear_top / dv) + 2, len(speeds)) for gear_top in top]
+        for gear, size in enumerate(self.sizes):
+            self.net[gear, size:] = np.nan
+            self.power[gear, size:] = np.nan
+        self.accel = self.net / car.W
+
+        self.best, self.gear = dyno.envelope({"net": self.net})
+
+        # Plain python rows for the scalar loop, numpy scalars are slow there
+        self.accel_rows = [row[:size].tolist() for row, size in zip(self.accel, self.sizes)]
+        self.power_rows = [row[:size].tolist() for row, size in zip(self.power, self.sizes)]
+
+    # Linear interpolation of an array along the speed grid, NaN off the table
+    def lookup(self, values, gear, v):
+        x = np.asarray(v, dtype=float) / self.dv
+        k = np.clip(x.astype(int), 0, len(self.speeds) - 2)
+        f = x - k
+        row = values[gear]
+        result = row[k] + (row[k + 1] - row[k]) * f
+        return np.where((x >= 0) & (x <= len(self.speeds) - 1), result, np.nan)
+
+    # Acceleration in m/s² in a gear (0 based) at speeds v
+    def acceleration(self, gear, v):
+        return self.lookup(self.accel, gear, v)
+
+    def net_force(self, gear, v):
+        return self.lookup(self.net, gear, v)
+
+    # Gear (0 based) giving the most net force at speeds v, -1 where none can run
+    def best_gear(self, v):
+        k = np.clip(np.rint(np.asarray(v, dtype=float) / self.dv).astype(int), 0, len(self.speeds) - 1)
+        return self.gear[k]
+
+
+# The car's table, built once and reused while it's among the last CACHE_SIZE used
+def force_table(car, dv=DV):
+    car = carsim.as_car(car)
+    key = (simcache.result_key(car, "table"), dv)
+
+    table = _tables.get(key)
+    if table is not None:
+        _tables.move_to_end(key)
+        return table
+
+    table = ForceTable(car, dv)
+    _tables[key] = table
+    if len(_tables) > CACHE_SIZE:
+        _tables.popitem(last=False)
+    return table
+
+
+# simulate_quarter_mile with the force model read off the car's ForceTable.
+# Shifts and milestones are worked out as in the Euler loop, so results match
+# it to within the interpolation error of the table.
+def simulate_table(car, record=True, table=None):
+    car = carsim.as_car(car)
+    if table is None:
+        table = force_table(car)
+
+    quarter_mile = carsim.QUARTER_MILE
+    delta_t = carsim.DELTA_T
+    launch_rpm = carsim.LAUNCH_RPM
+    shift_rpm = car.shift_rpm
+    rpm_per_ms = car.rpm_per_ms
+    accel_rows = table.accel_rows
+    power_rows = table.power_rows
+    inv_dv = 1 / table.dv
+    last_gear = car.n_gears - 1
+
+    v = 0.0
+    d = 0.0
+    t = 0.0
+    gear = 0
+    steps = 0
+    row = accel_rows[0]
+
+    sixty = carsim.mph_to_ms(60)
+    hundred_kmh = carsim.kmh_to_ms(100)
+    one_thirty = carsim.mph_to_ms(130)
+    eighth_mile = quarter_mile / 2
+    zerosixty = None
+    zerohundred = None
+    sixty_one_thirty = None
+    eighth_time = None
+    eighth_speed = None
+    shift_times = []
+
+    if record:
+        telemetry = Telemetry(1.25 * carsim.estimate_quarter_time(car) / delta_t)
+
+    while d < quarter_mile:
+        if v * rpm_per_ms[gear] > shift_rpm[gear]:
+            if gear == last_gear:
+                raise ValueError(f"{car.name} ran out of gears at {carsim.ms_to_mph(v):.0f} mph")
+            gear += 1
+            row = accel_rows[gear]
+            shift_times.append(t)
+            continue
+
+        x = v * inv_dv
+        k = int(x)
+        a = row[k]
+        a += (row[k + 1] - a) * (x - k)
+        if a != a:
+            raise ValueError(f"{car.name} is off its torque curve in gear {gear + 1} at {carsim.ms_to_mph(v):.0f} mph")
+
+        if record:      # rpm and power at the start of the step, as the Euler loop records them
+            rpm = v * rpm_per_ms[gear]
+            if gear == 0 and rpm < launch_rpm:
+                rpm = launch_rpm
+            power = power_rows[gear]
+            P_wheel = power[k] + (power[k + 1] - power[k]) * (x - k)
+
+        v += a * delta_t
+        d += v * delta_t
+        t += delta_t
+        steps += 1
+
+        if record:
+            telemetry.append(t, a, v, d, P_wheel, rpm)
+
+        if zerosixty is None and v > sixty:
+            zerosixty = t
+
+        if zerohundred is None and v > hundred_kmh:
+            zerohundred = t
+
+        if sixty_one_thirty is None and v > one_thirty:
+            sixty_one_thirty = t - zerosixty
+
+        if eighth_time is None and d >= eighth_mile:
+            eighth_time = t
+            eighth_speed = v
+
+    data = {
+        "quarter_time": t,
+        "quarter_speed": v,
+        "0-60 mph": zerosixty if zerosixty is not None else t,
+        "0-100 km/h": zerohundred,
+        "60-130 mph": sixty_one_thirty,
+        "eighth_time": eighth_time,
+        "eighth_speed": eighth_speed,
+        "shift_times": shift_times,
+        "steps": steps,
+    }
+
+    if record:
+        data.update(telemetry.data())
+    return data
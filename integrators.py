@@ -0,0 +1,290 @@
+# carsim integrators
+# Higher order alternatives to the fixed step Euler loop in simulate_quarter_mile.
+# Shifts, the speed milestones and the finish line are located as events inside
+# a step instead of being read off at step granularity, so the results don't
+# carry Euler's ±delta_t quantization and need far fewer steps.
+#
+# Use through carsim.simulate_quarter_mile(car, integrator="rk4") or "rk45".
+
+from scipy.integrate import solve_ivp
+
+import carsim
+import forcetable
+import quadrature
+from telemetry import Telemetry
+
+
+RK4_DT = 0.05       # fixed step for rk4 in seconds
+RK45_RTOL = 1e-8    # tolerances for the adaptive rk45
+RK45_ATOL = 1e-8
+MAX_TIME = 600      # give up on a car that hasn't finished after this many seconds
+
+
+# Same force model as the simulate_quarter_mile loop, as a function of speed and
+# gear (0 based). Returns (acceleration, rpm, wheel power).
+def make_accel(car):
+    W = car.W
+    drag = car.drag
+    Fr = car.Fr
+    Ft = car.Ft
+    rpm_per_ms = car.rpm_per_ms
+    torque_curve = car.torque_curve
+    loss = 1 - carsim.DRIVETRAIN_POWER_LOSS
+
+    def accel(v, gear):
+        rpm = v * rpm_per_ms[gear]
+        if rpm < carsim.LAUNCH_RPM and gear == 0:
+            rpm = carsim.LAUNCH_RPM
+
+        # Trial stages of a step that ends up past a shift can overshoot the
+        # curve, they get cut back to the event, so just hold the last value.
+        # Accepted states go through check_rpm instead.
+        power = torque_curve.power(min(rpm, torque_curve.rpm_max)) * loss
+
+        Fe = power / v if v > 0.01 else power / 0.01
+        Fn = min(Fe - drag * v * v - Fr, Ft)
+        return Fn / W, rpm, power
+
+    return accel
+
+
+# Speed each gear is left at, where rpm passes the shift point
+def shift_speeds(car):
+    return [shift_rpm / factor for shift_rpm, factor in zip(car.shift_rpm, car.rpm_per_ms)]
+
+
+# Accepted states have to stay on the torque curve, as they do in the Euler loop
+def check_rpm(car, v, gear):
+    rpm = v * car.rpm_per_ms[gear]
+    if rpm > car.torque_curve.rpm_max:
+        raise ValueError(f"{car.name}: {rpm:.0f} rpm in gear {gear + 1} is past the torque curve "
+                         f"({car.torque_curve.rpm_max:.0f} rpm)")
+
+
+# Gear a shift at speed v ends up in. A gear entered above its own shift speed is
+# left again straight away, as in the Euler loop, and passing the shift point
+# of the last gear means the car ran out of gears before the finish.
+def next_gear(car, gear, v, v_shift):
+    while True:
+        if gear == len(v_shift) - 1:
+            raise ValueError(f"{car.name} ran out of gears at {carsim.ms_to_mph(v):.0f} mph")
+        gear += 1
+        if v < v_shift[gear]:
+            return gear
+
+
+# Events every run looks for: (name, state index, level). State index 0 is
+# distance and 1 is speed; an event fires when that value first passes its level.
+def milestones():
+    return [
+        ("0-60 mph", 1, carsim.mph_to_ms(60)),
+        ("0-100 km/h", 1, carsim.kmh_to_ms(100)),
+        ("130 mph", 1, carsim.mph_to_ms(130)),
+        ("eighth", 0, carsim.QUARTER_MILE / 2),
+    ]
+
+
+# Fills in the summary keys simulate_quarter_mile returns from the event times
+def summarize(t, v, times, eighth_speed, shift_times, steps, evaluations):
+    zerosixty = times.get("0-60 mph", t)
+    one_thirty = times.get("130 mph")
+
+    return {
+        "quarter_time": t,
+        "quarter_speed": v,
+        "0-60 mph": zerosixty,
+        "0-100 km/h": times.get("0-100 km/h"),
+        "60-130 mph": one_thirty - zerosixty if one_thirty is not None else None,
+        "eighth_time": times.get("eighth"),
+        "eighth_speed": eighth_speed,
+        "shift_times": shift_times,
+        "steps": steps,
+        "evaluations": evaluations,
+    }
+
+
+# Classic 4th order Runge-Kutta on (d, v). a0 is the acceleration at the start
+# of the step, reused from the end of the previous one.
+def rk4_step(accel, gear, d, v, a0, h):
+    k2 = accel(v + h / 2 * a0, gear)[0]
+    k3 = accel(v + h / 2 * k2, gear)[0]
+    k4 = accel(v + h * k3, gear)[0]
+
+    d_next = d + h / 6 * (v + 2 * (v + h / 2 * a0) + 2 * (v + h / 2 * k2) + (v + h * k3))
+    v_next = v + h / 6 * (a0 + 2 * k2 + 2 * k3 + k4)
+    return d_next, v_next
+
+
+# Cubic Hermite interpolant through (y0, dy0) -> (y1, dy1) over a step of
+# length h, at fraction s of the step
+def hermite(y0, dy0, y1, dy1, h, s):
+    h00 = 2 * s**3 - 3 * s**2 + 1
+    h10 = s**3 - 2 * s**2 + s
+    h01 = -2 * s**3 + 3 * s**2
+    h11 = s**3 - s**2
+    return h00 * y0 + h10 * h * dy0 + h01 * y1 + h11 * h * dy1
+
+# Fraction of the step where the interpolant passes level, by bisection
+def hermite_root(y0, dy0, y1, dy1, h, level):
+    lo, hi = 0.0, 1.0
+    for _ in range(50):
+        s = (lo + hi) / 2
+        if hermite(y0, dy0, y1, dy1, h, s) < level:
+            lo = s
+        else:
+            hi = s
+    return (lo + hi) / 2
+
+
+def simulate_rk4(car, dt=RK4_DT, record=True):
+    car = carsim.as_car(car)
+    accel = make_accel(car)
+    v_shift = shift_speeds(car)
+    pending = milestones()
+
+    t = d = v = 0.0
+    gear = 0
+    a, rpm, power = accel(v, gear)
+    evaluations = 1
+    steps = 0
+    times = {}
+    eighth_speed = None
+    shift_times = []
+
+    if record:
+        telemetry = Telemetry(1.25 * carsim.estimate_quarter_time(car) / dt)
+
+    while t < MAX_TIME:
+        d1, v1 = rk4_step(accel, gear, d, v, a, dt)
+        a1 = accel(v1, gear)[0]
+        evaluations += 4
+        steps += 1
+
+        # Events inside this step, as fractions of it. The earliest terminal
+        # one (shift or finish) cuts the step short.
+        cut = None
+        if v1 > v_shift[gear]:
+            cut = ("shift", hermite_root(v, a, v1, a1, dt, v_shift[gear]))
+        if d1 >= carsim.QUARTER_MILE:
+            s = hermite_root(d, v, d1, v1, dt, carsim.QUARTER_MILE)
+            if cut is None or s <= cut[1]:
+                cut = ("finish", s)
+
+        h = dt
+        if cut is not None:
+            h = cut[1] * dt
+            d1, v1 = rk4_step(accel, gear, d, v, a, h)
+            a1 = accel(v1, gear)[0]
+            evaluations += 4
+
+        for event in list(pending):
+            name, index, level = event
+            y0, dy0, y1, dy1 = (d, v, d1, v1) if index == 0 else (v, a, v1, a1)
+            if y1 >= level:
+                s = hermite_root(y0, dy0, y1, dy1, h, level)
+                times[name] = t + s * h
+                if name == "eighth":
+                    eighth_speed = hermite(v, a, v1, a1, h, s)
+                pending.remove(event)
+
+        t, d, v = t + h, d1, v1
+        check_rpm(car, v, gear)
+
+        if cut is not None and cut[0] == "finish":
+            break
+        if cut is not None:
+            shifted = next_gear(car, gear, v, v_shift)
+            shift_times.extend([t] * (shifted - gear))
+            gear = shifted
+
+        a, rpm, power = accel(v, gear)
+        evaluations += 1
+
+        if record:
+            telemetry.append(t, a, v, d, power, rpm)
+    else:
+        raise ValueError(f"{car.name} did not reach the quarter mile in {MAX_TIME} s")
+
+    data = summarize(t, v, times, eighth_speed, shift_times, steps, evaluations)
+    if record:
+        data.update(telemetry.data())
+    return data
+
+
+def simulate_rk45(car, rtol=RK45_RTOL, atol=RK45_ATOL, record=True):
+    car = carsim.as_car(car)
+    accel = make_accel(car)
+    v_shift = shift_speeds(car)
+    events = milestones()
+
+    t = 0.0
+    y = [0.0, 0.0]
+    gear = 0
+    steps = evaluations = 0
+    times = {}
+    eighth_speed = None
+    shift_times = []
+    trace = []
+
+    def finish(t, y, gear):
+        return y[0] - carsim.QUARTER_MILE
+    finish.terminal = True
+    finish.direction = 1
+
+    def shift(t, y, gear):
+        return y[1] - v_shift[gear]
+    shift.terminal = True
+    shift.direction = 1
+
+    def milestone(index, level):
+        def event(t, y, gear):
+            return y[index] - level
+        event.direction = 1
+        return event
+
+    while True:
+        sol = solve_ivp(lambda t, y, gear: [y[1], accel(y[1], gear)[0]],
+                        (t, MAX_TIME), y, method="RK45", rtol=rtol, atol=atol, args=(gear,),
+                        events=[finish, shift] + [milestone(index, level) for _, index, level in events])
+        steps += len(sol.t) - 1
+        evaluations += sol.nfev
+        trace.append((sol.t[1:], sol.y[:, 1:], gear))
+        check_rpm(car, sol.y[1].max(), gear)
+
+        for (name, _, _), hits, states in zip(events, sol.t_events[2:], sol.y_events[2:]):
+            if len(hits) and name not in times:
+                times[name] = float(hits[0])
+                if name == "eighth":
+                    eighth_speed = float(states[0][1])
+
+        if sol.status != 1:
+            raise ValueError(f"{car.name} did not reach the quarter mile in {MAX_TIME} s")
+
+        if len(sol.t_events[0]):
+            t, y = float(sol.t_events[0][0]), sol.y_events[0][0].tolist()
+            break
+
+        t, y = float(sol.t_events[1][0]), sol.y_events[1][0].tolist()
+        shifted = next_gear(car, gear, y[1], v_shift)
+        shift_times.extend([t] * (shifted - gear))
+        gear = shifted
+
+    data = summarize(t, y[1], times, eighth_speed, shift_times, steps, evaluations)
+
+    if record:
+        telemetry = Telemetry(steps + 1)
+        for ts, ys, gear in trace:
+            for ti, (di, vi) in zip(ts, ys.T):
+                a, rpm, power = accel(vi, gear)
+                telemetry.append(ti, a, vi, di, power, rpm)
+        data.update(telemetry.data())
+
+    return data
+
+
+INTEGRATORS = {
+    "rk4": simulate_rk4,
+    "rk45": simulate_rk45,
+    "table": forcetable.simulate_table,
+    "quadrature": quadrature.simulate_quadrature,
+}
@@ -0,0 +1,207 @@
+# carsim kernel
+# The simulate_quarter_mile loop compiled with numba. The car is flattened into
+# one float64 parameter record so the loop runs in nopython mode without any
+# dict lookups or Python objects. Without numba the same kernel runs as plain
+# Python, and fleets go through carsim.simulate_quarter_mile_batch instead.
+
+import numpy as np
+
+import carsim
+
+try:
+    from numba import njit, prange
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda fn: fn
+
+
+# Header of the parameter record, the Car's derived constants, followed by the
+# n_gears rpm per m/s factors, the n_gears shift points, the n_intervals + 1
+# torque curve breakpoints and 4 spline coefficients (c3, c2, c1, c0) per interval
+W, FT, DRAG, FR, N_GEARS, N_INTERVALS = range(6)
+HEADER = 6
+
+
+def pack_car(car):
+    car = carsim.as_car(car)
+    curve = car.torque_curve
+    header = [car.W, car.Ft, car.drag, car.Fr, car.n_gears, len(curve.coeffs)]
+    return np.concatenate([header, car.rpm_per_ms, car.shift_rpm, curve.breaks, curve.coeffs.ravel()])
+
+
+# One record per row, zero padded to the longest
+def pack_fleet(cars):
+    records = [pack_car(car) for car in cars]
+    table = np.zeros((len(records), max((len(record) for record in records), default=HEADER)))
+    for row, record in enumerate(records):
+        table[row, :len(record)] = record
+    return table
+
+
+# Same operations in the same order as simulate_quarter_mile, so results are
+# identical to it. Returns (quarter_time, quarter_speed, 0-60 mph), all NaN if
+# the car runs out of gears or off its torque curve.
+@njit(cache=True)
+def quarter_mile_kernel(params, quarter_mile, delta_t, loss, launch_rpm):
+    W = params[0]
+    Ft = params[1]
+    drag = params[2]
+    Fr = params[3]
+    n_gears = int(params[4])
+    n_intervals = int(params[5])
+    factors = 6
+    shift_rpm = factors + n_gears
+    breaks = shift_rpm + n_gears
+    coeffs = breaks + n_intervals + 1
+    sixty = 60 * 0.44704
+
+    v = 0.0
+    d = 0.0
+    t = 0.0
+    zerosixty = -1.0
+    gear = 0
+
+    while d < quarter_mile:
+        rpm = v * params[factors + gear]
+
+        if rpm < launch_rpm and gear == 0:
+            rpm = launch_rpm
+
+        if rpm > params[shift_rpm + gear]:
+            gear += 1
+            if gear >= n_gears:
+                return np.nan, np.nan, np.nan
+            continue
+
+        if rpm < params[breaks] or rpm > params[breaks + n_intervals]:
+            return np.nan, np.nan, np.nan
+
+        i = 0
+        while i < n_intervals - 1 and params[breaks + i + 1] <= rpm:
+            i += 1
+        c = coeffs + 4 * i
+        dx = rpm - params[breaks + i]
+        torque = ((params[c] * dx + params[c + 1]) * dx + params[c + 2]) * dx + params[c + 3]
+
+        power = torque * rpm * 2 * np.pi / 60
+        P_wheel = power * (1 - loss)
+
+        Fe = P_wheel / v if v > 0.01 else P_wheel / 0.01
+        Fd = drag * v**2
+        Fn = Fe - Fd - Fr
+
+        if Fn > Ft:
+            Fn = Ft
+
+        a = Fn / W
+        v += a * delta_t
+        d += v * delta_t
+        t += delta_t
+
+        if zerosixty < 0 and v > sixty:
+            zerosixty = t
+
+    if zerosixty < 0:
+        zerosixty = t
+
+    return t, v, zerosixty
+
+
+@njit(cache=True, parallel=True)
+def fleet_kernel(table, quarter_mile, delta_t, loss, launch_rpm):
+    out = np.empty((table.shape[0], 3))
+    for row in prange(table.shape[0]):
+        t, v, zerosixty = quarter_mile_kernel(table[row], quarter_mile, delta_t, loss, launch_rpm)
+        out[row, 0] = t
+        out[row, 1] = v
+        out[row, 2] = zerosixty
+    return out
+
+
+# dyno.tractive_force for a packed fleet over one speed grid, in one pass:
+# (car, gear, speed) arrays of rpm, engine, tractive and net force. Gears a car
+# doesn't have are NaN throughout, rpms outside [rpm min, high[car]] NaN forces.
+@njit(cache=True, parallel=True)
+def dyno_kernel(table, high, speeds, loss, launch_rpm, n_gears):
+    shape = (table.shape[0], n_gears, len(speeds))
+    rpm = np.full(shape, np.nan)
+    engine = np.full(shape, np.nan)
+    tractive = np.full(shape, np.nan)
+    net = np.full(shape, np.nan)
+
+    for row in prange(table.shape[0]):
+        params = table[row]
+        gears = int(params[N_GEARS])
+        n_intervals = int(params[N_INTERVALS])
+        breaks = HEADER + 2 * gears
+        coeffs = breaks + n_intervals + 1
+        low = params[breaks]
+
+        for gear in range(gears):
+            factor = params[HEADER + gear]
+            for k in range(len(speeds)):
+                v = speeds[k]
+                r = factor * v
+                if gear == 0 and r < launch_rpm:
+                    r = launch_rpm
+                rpm[row, gear, k] = r
+                if r < low or r > high[row]:
+                    continue
+
+                i = 0
+                while i < n_intervals - 1 and params[breaks + i + 1] <= r:
+                    i += 1
+                c = coeffs + 4 * i
+                dx = r - params[breaks + i]
+                torque = ((params[c] * dx + params[c + 1]) * dx + params[c + 2]) * dx + params[c + 3]
+
+                Fe = torque * r * 2 * np.pi / 60 * (1 - loss) / (v if v > 0.01 else 0.01)
+                engine[row, gear, k] = Fe
+                Fn = Fe if Fe < params[FT] else params[FT]
+                tractive[row, gear, k] = Fn
+                net[row, gear, k] = Fn - params[DRAG] * v**2 - params[FR]
+
+    return rpm, engine, tractive, net
+
+
+def constants():
+    return carsim.QUARTER_MILE, carsim.DELTA_T, carsim.DRIVETRAIN_POWER_LOSS, carsim.LAUNCH_RPM
+
+
+# Summary only counterpart of simulate_quarter_mile(car, record=False)
+def simulate_kernel(car):
+    params = pack_car(car)
+    if not HAVE_NUMBA:
+        params = params.tolist()    # list indexing is much faster than numpy's in plain Python
+
+    t, v, zerosixty = quarter_mile_kernel(params, *constants())
+
+    data = {
+        "quarter_time": t,
+        "quarter_speed": v,
+        "0-60 mph": zerosixty
+    }
+
+    return data
+
+
+# Same return as simulate_quarter_mile_batch, one compiled run per car spread over cores
+def simulate_fleet_kernel(cars):
+    if not HAVE_NUMBA:
+        return carsim.simulate_quarter_mile_batch(cars)
+
+    out = fleet_kernel(pack_fleet(cars), *constants())
+
+    data = {
+        "quarter_time": out[:, 0],
+        "quarter_speed": out[:, 1],
+        "0-60 mph": out[:, 2]
+    }
+
+    return data
@@ -0,0 +1,250 @@
+# carsim Monte Carlo
+# Quarter mile times as distributions. Uncertain inputs (grip, rolling
+# resistance, drag, air density or any other numeric field) are drawn from
+# given distributions and each sample runs through the fleet engine. Samples
+# are drawn and run a chunk at a time in the workers, each chunk from its own
+# SeedSequence stream, so a seed gives the same numbers whatever the number of
+# workers. Workers send back summaries, not rows: exact count, mean, spread,
+# min and max, and a log binned histogram for the percentiles (within 0.01% of
+# the value). Summaries merge in chunk order, so a million samples take the
+# memory of a few histograms.
+#
+#   python montecarlo.py "Honda Accord" -n 1000000 --seed 1 --workers 4
+#   python montecarlo.py "Ford Mustang" --dist "mu=normal:0.9:0.05" --dist "rho=uniform:1.0:1.25"
+
+import argparse
+import concurrent.futures
+import math
+import os
+import re
+
+import numpy as np
+
+import carsim
+import catalog
+import fleet
+import sweep
+
+
+METRICS = ("quarter_time", "quarter_speed", "0-60 mph")
+PERCENTILES = (1, 5, 25, 50, 75, 95, 99)
+
+# Used when no distributions are given, relative to the car's own values except air density
+DEFAULT_DISTRIBUTIONS = ("mu*=normal:1:0.05", "Crr*=normal:1:0.1", "Cd*=normal:1:0.02", "rho=normal:1.225:0.04")
+
+# Number of parameters each distribution takes
+DISTRIBUTIONS = {"normal": 2, "uniform": 2, "triangular": 3, "lognormal": 2}
+
+
+# "mu=normal:0.9:0.05" -> ("mu", "", "normal", (0.9, 0.05)), "*=" samples a factor on the base value
+def parse_distribution(spec):
+    match = re.match(r"^(?P<path>[^=*]+)(?P<op>\*?)=(?P<kind>\w+):(?P<params>.+)$", spec)
+    if match is None:
+        raise ValueError(f"Can't parse {spec!r}, expected field=kind:a:b or field*=kind:a:b")
+
+    kind = match.group("kind")
+    params = tuple(float(x) for x in match.group("params").split(":"))
+    if DISTRIBUTIONS.get(kind) != len(params):
+        known = ", ".join(f"{name} ({n} numbers)" for name, n in DISTRIBUTIONS.items())
+        raise ValueError(f"Can't use {kind} with {len(params)} numbers in {spec!r}, known: {known}")
+
+    sweep.parse_field(match.group("path"))
+    return match.group("path"), match.group("op"), kind, params
+
+
+def draw(rng, kind, params, size):
+    if kind == "normal":
+        return rng.normal(params[0], params[1], size)
+    if kind == "uniform":
+        return rng.uniform(params[0], params[1], size)
+    if kind == "triangular":
+        return rng.triangular(params[0], params[1], params[2], size)
+    return rng.lognormal(params[0], params[1], size)
+
+
+# {path: values} for `size` samples
+def sample(rng, base, distributions, size):
+    values = {}
+    for path, op, kind, params in distributions:
+        drawn = draw(rng, kind, params, size)
+        if op == "*":
+            default = carsim.RHO if path == "rho" else None
+            drawn = drawn * (base.get(path, default) if default is not None else sweep.get_field(base, path))
+        values[path] = drawn
+    return values
+
+
+# Histogram with bins a fixed fraction wide, so any percentile is known to
+# within that fraction of its value whatever the spread. Merges by adding counts.
+class LogHistogram:
+    def __init__(self, low=1e-3, high=1e4, relative=1e-4):
+        self.low = low
+        self.relative = relative
+        self.scale = 1 / math.log1p(relative)
+        self.counts = np.zeros(int(math.log(high / low) * self.scale) + 1, dtype=np.int64)
+
+    def bins(self, values):
+        bins = np.floor(np.log(np.maximum(values, self.low) / self.low) * self.scale)
+        return np.minimum(bins, len(self.counts) - 1).astype(np.int64)
+
+    def add(self, values):
+        bins, counts = np.unique(self.bins(values), return_counts=True)
+        self.counts[bins] += counts
+
+    # Sparse (bins, counts), what workers send back
+    def add_sparse(self, bins, counts):
+        self.counts[bins] += counts
+
+    # Middle of the bin holding the p-th percentile
+    def percentile(self, p):
+        total = self.counts.sum()
+        if total == 0:
+            return np.nan
+        target = p / 100 * total
+        i = min(int(np.searchsorted(np.cumsum(self.counts), target, side="left")), len(self.counts) - 1)
+        return self.low * (1 + self.relative) ** (i + 0.5)
+
+
+# Running count, mean, variance (Chan et al. pairwise merge), min, max and histogram of one metric
+class Summary:
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.invalid = 0
+        self.histogram = LogHistogram()
+
+    def add(self, values):
+        values = np.asarray(values, dtype=float)
+        valid = values[np.isfinite(values)]
+        self.invalid += len(values) - len(valid)
+        if len(valid):
+            part = {"n": len(valid), "mean": valid.mean(), "m2": ((valid - valid.mean()) ** 2).sum(),
+                    "min": valid.min(), "max": valid.max(), "invalid": 0}
+            part["bins"], part["counts"] = np.unique(self.histogram.bins(valid), return_counts=True)
+            self.merge(part)
+
+    # Everything needed to merge this summary into another, small enough to send between processes
+    def part(self):
+        bins = np.flatnonzero(self.histogram.counts)
+        return {"n": self.n, "mean": self.mean, "m2": self.m2, "min": self.min, "max": self.max,
+                "invalid": self.invalid, "bins": bins, "counts": self.histogram.counts[bins]}
+
+    def merge(self, part):
+        self.invalid += part["invalid"]
+        if part["n"] == 0:
+            return
+        n = self.n + part["n"]
+        delta = part["mean"] - self.mean
+        self.mean += delta * part["n"] / n
+        self.m2 += part["m2"] + delta**2 * self.n * part["n"] / n
+        self.n = n
+        self.min = min(self.min, part["min"])
+        self.max = max(self.max, part["max"])
+        self.histogram.add_sparse(part["bins"], part["counts"])
+
+    def std(self):
+        return math.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else np.nan
+
+    def percentile(self, p):
+        return float(np.clip(self.histogram.percentile(p), self.min, self.max)) if self.n else np.nan
+
+
+# Runs in the workers: draws `size` samples from the chunk's stream, runs
+# them and returns {metric: summary part}
+def run_samples(task, base, distributions, size, seed):
+    rng = np.random.default_rng(seed)
+    values = sample(rng, base, distributions, size)
+    cars = (sweep.make_variant(base, {path: float(drawn[k]) for path, drawn in values.items()}) for k in range(size))
+    _, results = fleet.run_chunk(0, list(cars))
+
+    parts = {}
+    for metric in METRICS:
+        summary = Summary()
+        summary.add(results[metric])
+        parts[metric] = summary.part()
+    return task, parts
+
+
+# n samples of the car under the distributions (specs or parsed tuples).
+# Returns {metric: Summary}.
+def monte_carlo(car, distributions=DEFAULT_DISTRIBUTIONS, n=10000, seed=None, workers=None, chunk_size=4096):
+    base = fleet.strip_car(carsim.as_car(car))
+    distributions = [parse_distribution(d) if isinstance(d, str) else d for d in distributions]
+    workers = workers or os.cpu_count()
+
+    tasks = [(k, min(chunk_size, n - start)) for k, start in enumerate(range(0, n, chunk_size))]
+    seeds = np.random.SeedSequence(seed).spawn(len(tasks))
+    summaries = {metric: Summary() for metric in METRICS}
+
+    # Merged in task order so the floating point sums are the same on every run
+    waiting = {}
+    merged = 0
+
+    def collect(task, parts):
+        nonlocal merged
+        waiting[task] = parts
+        while merged in waiting:
+            for metric, part in waiting.pop(merged).items():
+                summaries[metric].merge(part)
+            merged += 1
+
+    if workers == 1:
+        for task, size in tasks:
+            collect(*run_samples(task, base, distributions, size, seeds[task]))
+        return summaries
+
+    with fleet.make_executor(workers) as executor:
+        pending = set()
+        for task, size in tasks:
+            pending.add(executor.submit(run_samples, task, base, distributions, size, seeds[task]))
+            if len(pending) >= 2 * workers:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    collect(*future.result())
+        for future in concurrent.futures.as_completed(pending):
+            collect(*future.result())
+
+    return summaries
+
+
+def print_summaries(summaries):
+    print(f"{'':<16}{'mean':>9}{'std':>9}{'min':>9}" + "".join(f"{'p' + str(p):>9}" for p in PERCENTILES) + f"{'max':>9}")
+    for metric, summary in summaries.items():
+        cells = [summary.mean, summary.std(), summary.min] + [summary.percentile(p) for p in PERCENTILES] + [summary.max]
+        print(f"{metric:<16}" + "".join(f"{value:9.3f}" for value in cells))
+
+    summary = next(iter(summaries.values()))
+    print(f"{summary.n} runs" + (f", {summary.invalid} samples invalid or didn't finish" if summary.invalid else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quarter mile distributions under uncertain inputs")
+    parser.add_argument("car", help="name of the car")
+    parser.add_argument("--cars", default="cars.json", help="cars.json file or catalog directory")
+    parser.add_argument("-n", "--samples", type=int, default=10000)
+    parser.add_argument("--dist", action="append", default=[],
+                        help="field=kind:a:b or field*=kind:a:b (a factor on the car's value), kind one of "
+                             f"{', '.join(DISTRIBUTIONS)}. Default: {' '.join(DEFAULT_DISTRIBUTIONS)}")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=4096)
+    args = parser.parse_args()
+
+    car = catalog.load_car(args.cars, args.car)
+    if car is None:
+        parser.error(f"no car named {args.car!r} in {args.cars}")
+
+    try:
+        distributions = [parse_distribution(spec) for spec in args.dist or DEFAULT_DISTRIBUTIONS]
+    except ValueError as error:
+        parser.error(str(error))
+
+    summaries = monte_carlo(car, distributions, args.samples, args.seed, args.workers, args.chunk_size)
+    print_summaries(summaries)
+
+
+if __name__ == "__main__":
+    main()
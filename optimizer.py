@@ -0,0 +1,157 @@
+# carsim optimizer
+# Finds the shift points, final drive and (optionally) gear ratios that give a
+# car its best quarter mile. Coordinate search: for each parameter in turn a
+# spread of candidate values is simulated in one fleet call (lockstep batch or
+# compiled kernel, or across processes with workers > 1), the best is kept, and
+# the spread narrows whenever a full round doesn't improve anything. Every
+# evaluated variant is remembered, so revisited points cost nothing.
+#
+#   python optimizer.py "Ford Mustang" --gear-ratios --workers 4
+
+import argparse
+import time
+
+import numpy as np
+
+import carsim
+import catalog
+import fleet
+import sweep
+
+
+class Optimizer:
+    def __init__(self, car, shift_points=True, final_drive=True, gear_ratios=False,
+                 candidates=9, min_step=0.002, workers=1, chunk_size=64):
+        self.base = carsim.as_car(car)
+        self.candidates = candidates
+        self.min_step = min_step
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.executor = None
+        self.seen = {}
+        self.evaluations = 0
+        self.lookups = 0
+
+        # Parameters as (path, low, high), searched in that order
+        curve = self.base.torque_curve
+        top_rpm = min(self.base.redline, curve.rpm_max)
+        self.bounds = []
+        if shift_points:
+            for gear in range(self.base.n_gears - 1):
+                self.bounds.append((f"shift_rpm[{gear}]", max(carsim.LAUNCH_RPM + 1, 0.5 * top_rpm), top_rpm))
+        if final_drive:
+            self.bounds.append(("final_drive", 0.7 * self.base.final_drive, 1.3 * self.base.final_drive))
+        if gear_ratios:
+            for gear, ratio in enumerate(self.base.gear_ratios):
+                self.bounds.append((f"gear_ratios[{gear}]", 0.7 * ratio, 1.3 * ratio))
+
+    # The base car with a full shift_rpm list so single entries can be swept
+    def start(self):
+        data = dict(self.base.data)
+        data["shift_rpm"] = list(self.base.shift_rpm[:-1])
+        return data, [sweep.get_field(data, path) for path, _, _ in self.bounds]
+
+    def variant(self, data, x):
+        return sweep.make_variant(data, {path: value for (path, _, _), value in zip(self.bounds, x)})
+
+    # Quarter time of each point, ties (the Euler engine reports 0.01 s steps)
+    # broken by trap speed. Invalid variants score inf.
+    def evaluate(self, data, points):
+        self.lookups += len(points)
+        keys = [tuple(round(value, 9) for value in x) for x in points]
+        new = list(dict.fromkeys(key for key in keys if key not in self.seen))
+
+        if new:
+            results = fleet.simulate_fleet([self.variant(data, key) for key in new], self.workers,
+                                           self.chunk_size, self.executor)
+            for key, row in zip(new, results):
+                score = row["quarter_time"] - 1e-6 * row["quarter_speed"]
+                self.seen[key] = float(score) if np.isfinite(score) else np.inf
+            self.evaluations += len(new)
+
+        return [self.seen[key] for key in keys]
+
+    # With workers > 1 one process pool serves every round
+    def run(self):
+        if self.workers == 1:
+            return self.search()
+        with fleet.make_executor(self.workers) as self.executor:
+            return self.search()
+
+    def search(self):
+        started = time.perf_counter()
+        data, x = self.start()
+        best = self.evaluate(data, [x])[0]
+        steps = [(high - low) / 4 for _, low, high in self.bounds]
+        rounds = 0
+
+        while max(step / (high - low) for step, (_, low, high) in zip(steps, self.bounds)) > self.min_step:
+            rounds += 1
+            improved = False
+
+            for i, (path, low, high) in enumerate(self.bounds):
+                offsets = np.linspace(-steps[i], steps[i], self.candidates)
+                points = []
+                for offset in offsets:
+                    point = list(x)
+                    point[i] = float(np.clip(x[i] + offset, low, high))
+                    points.append(point)
+
+                scores = self.evaluate(data, points)
+                k = int(np.argmin(scores))
+                if scores[k] < best:
+                    best, x, improved = scores[k], points[k], True
+
+            if not improved:
+                steps = [step / 2 for step in steps]
+
+        car = carsim.Car(self.variant(data, x))
+        result = carsim.simulate_quarter_mile(car, record=False)
+        initial = carsim.simulate_quarter_mile(self.base, record=False)
+
+        report = {
+            "car": car,
+            "values": {path: value for (path, _, _), value in zip(self.bounds, x)},
+            "quarter_time": result["quarter_time"],
+            "quarter_speed": result["quarter_speed"],
+            "initial_time": initial["quarter_time"],
+            "evaluations": self.evaluations,
+            "cache_hits": self.lookups - self.evaluations,
+            "rounds": rounds,
+            "seconds": time.perf_counter() - started,
+        }
+
+        return report
+
+
+def optimize(car, **options):
+    return Optimizer(car, **options).run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Optimize shift points, final drive and gear ratios for the quarter mile")
+    parser.add_argument("car", help="name of the car in cars.json")
+    parser.add_argument("--cars", default="cars.json", help="cars.json file or catalog directory")
+    parser.add_argument("--no-shift-points", action="store_true")
+    parser.add_argument("--no-final-drive", action="store_true")
+    parser.add_argument("--gear-ratios", action="store_true", help="also optimize each gear ratio")
+    parser.add_argument("--candidates", type=int, default=9, help="values tried per parameter per round")
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    car = catalog.load_car(args.cars, args.car)
+    if car is None:
+        parser.error(f"no car named {args.car!r} in {args.cars}")
+
+    report = optimize(car, shift_points=not args.no_shift_points, final_drive=not args.no_final_drive,
+                      gear_ratios=args.gear_ratios, candidates=args.candidates, workers=args.workers)
+
+    for path, value in report["values"].items():
+        print(f"{path:<20}{value:10.3f}")
+    print(f"Time:\t\t\t{report['initial_time']:.2f} -> {report['quarter_time']:.2f} seconds")
+    print(f"Evaluations:\t\t{report['evaluations']} simulated, {report['cache_hits']} cached, {report['rounds']} rounds")
+    print(f"Took:\t\t\t{report['seconds']:.2f} seconds")
+
+
+if __name__ == "__main__":
+    main()
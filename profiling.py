@@ -0,0 +1,218 @@
+# carsim profiling
+# Where does a run's time go? Inside a Profiler block, simulate_quarter_mile's
+# loop times each phase of a step (rpm and shift logic, torque lookup, force
+# model and integration, recording) and counts steps, shifts and torque curve
+# calls, and the fleet runner times each chunk in its worker. Outside one the
+# timers are skipped with a flag test per phase. They cost about as much as
+# the step, so compare phases with each other rather than with unprofiled runs.
+#
+#   with profiling.Profiler() as profiler:
+#       fleet.simulate_fleet(cars, workers=4)
+#   profiler.print_summary()
+#   profiler.write_chrome_trace("trace.json")         # chrome://tracing, ui.perfetto.dev
+#   profiler.write_speedscope("run.speedscope.json")  # speedscope.app
+#
+#   python profiling.py "Honda Accord" --trace trace.json
+
+import argparse
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+import carsim
+import catalog
+from telemetry import Telemetry
+
+
+# Phases of a simulation step, in loop order
+PHASES = ("shift", "torque", "forces", "record")
+
+
+class Profiler:
+    # callback(name, phases, counters) is called after each profiled run with
+    # that run's phase times in ns and its counters
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.phases = Counter()
+        self.counters = Counter()
+        self.events = []
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter_ns()
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = carsim.PROFILER
+        carsim.PROFILER = self
+        return self
+
+    def __exit__(self, *exc):
+        carsim.PROFILER = self.previous
+        return False
+
+    # A finished span for the trace, times from perf_counter_ns (the same clock
+    # in every process on Linux, so worker spans line up with the parent's)
+    def span(self, name, start, end, pid=None, tid=None, phases=None, **args):
+        with self.lock:
+            self.events.append({"name": name, "start": start, "end": end, "pid": pid or os.getpid(),
+                                "tid": tid or threading.get_ident(), "phases": phases, "args": args})
+
+    def add(self, name, phases, counters, start, end):
+        with self.lock:
+            self.phases.update(phases)
+            self.counters.update(counters)
+        self.span(name, start, end, phases=phases, **counters)
+        if self.callback is not None:
+            self.callback(name, phases, counters)
+
+    # Stand in for simulate_quarter_mile while profiling
+    def simulate(self, car, record=True, integrator="euler"):
+        car = carsim.as_car(car)
+        if integrator == "euler":
+            return simulate_profiled(self, car, record)
+
+        import integrators
+        start = time.perf_counter_ns()
+        data = integrators.INTEGRATORS[integrator](car, record=record)
+        end = time.perf_counter_ns()
+        counters = {"runs": 1, "steps": data.get("steps", 0), "torque calls": data.get("evaluations", 0)}
+        self.add(f"{integrator} {car.name}", {integrator: end - start}, counters, start, end)
+        return data
+
+    def summary(self):
+        total = sum(self.phases.values())
+        steps = self.counters["steps"] or 1
+        rows = [(phase, ns / 1e6, 100 * ns / total if total else 0, ns / steps)
+                for phase, ns in self.phases.items()]
+        return rows, dict(self.counters)
+
+    def print_summary(self):
+        rows, counters = self.summary()
+        print(f"{'phase':<12}{'total ms':>12}{'share':>9}{'ns/step':>10}")
+        for phase, ms, share, per_step in rows:
+            print(f"{phase:<12}{ms:12.2f}{share:8.1f}%{per_step:10.0f}")
+
+        chunks = [event for event in self.events if event["name"] == "chunk"]
+        if chunks:
+            busy = sum(event["end"] - event["start"] for event in chunks) / 1e6
+            print(f"{'chunks':<12}{busy:12.2f}{'':>9}{len(chunks):>10} chunks")
+        for name, value in counters.items():
+            print(f"{name:<20}{value:>14}")
+
+    # Chrome trace events. A run's phases are summed over its steps, so they
+    # are drawn as back to back child spans of the run in loop order.
+    def chrome_trace(self):
+        events = []
+        for event in self.events:
+            start = (event["start"] - self.origin) / 1e3
+            common = {"ph": "X", "pid": event["pid"], "tid": event["tid"]}
+            events.append(dict(common, name=event["name"], ts=start,
+                               dur=(event["end"] - event["start"]) / 1e3, args=event["args"]))
+            for phase, ns in (event["phases"] or {}).items():
+                events.append(dict(common, name=phase, ts=start, dur=ns / 1e3))
+                start += ns / 1e3
+
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path):
+        with open(path, "w") as file:
+            json.dump(self.chrome_trace(), file)
+
+    # speedscope sampled profile, one weighted sample per (run, phase)
+    def speedscope(self, name="carsim"):
+        frames = []
+        index = {}
+
+        def frame(label):
+            if label not in index:
+                index[label] = len(frames)
+                frames.append({"name": label})
+            return index[label]
+
+        samples = []
+        weights = []
+        for event in self.events:
+            if event["phases"]:
+                for phase, ns in event["phases"].items():
+                    samples.append([frame(event["name"]), frame(phase)])
+                    weights.append(ns)
+            else:
+                samples.append([frame(event["name"])])
+                weights.append(event["end"] - event["start"])
+
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{"type": "sampled", "name": name, "unit": "nanoseconds",
+                          "startValue": 0, "endValue": sum(weights), "samples": samples, "weights": weights}],
+        }
+
+    def write_speedscope(self, path):
+        with open(path, "w") as file:
+            json.dump(self.speedscope(), file)
+
+
+# simulate_quarter_mile with its loop timing each phase of the steps
+def simulate_profiled(profiler, car, record=True):
+    started = time.perf_counter_ns()
+    car = carsim.as_car(car)
+    telemetry = Telemetry(1.25 * carsim.estimate_quarter_time(car) / carsim.DELTA_T) if record else None
+
+    phases = {}
+    data = carsim.run_steps(carsim.quarter_mile_steps(car, 0, telemetry, phases))
+
+    if record:
+        data.update(telemetry.data())
+
+    steps = data["steps"]
+    counters = {"runs": 1, "steps": steps, "shifts": len(data["shift_times"]), "torque calls": steps}
+    profiler.add(car.name, phases, counters, started, time.perf_counter_ns())
+
+    return data
+
+
+# Runs in the worker instead of fleet.run_chunk when profiling, returns the
+# chunk's span along with its results
+def run_chunk_timed(start, cars):
+    import fleet
+
+    began = time.perf_counter_ns()
+    start, results = fleet.run_chunk(start, cars)
+    return start, results, (began, time.perf_counter_ns(), os.getpid(), threading.get_ident(), len(cars))
+
+
+def record_chunk(profiler, span):
+    began, end, pid, tid, cars = span
+    with profiler.lock:
+        profiler.counters.update({"chunks": 1, "fleet cars": cars})
+    profiler.span("chunk", began, end, pid, tid, cars=cars)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile runs of the cars in cars.json")
+    parser.add_argument("cars", nargs="*", help="names of cars to run (default: all)")
+    parser.add_argument("--path", default="cars.json", help="cars.json file or catalog directory")
+    parser.add_argument("--integrator", default="euler")
+    parser.add_argument("--no-record", action="store_true", help="summary only runs")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--trace", help="write a Chrome trace to this file")
+    parser.add_argument("--speedscope", help="write a speedscope profile to this file")
+    args = parser.parse_args()
+
+    cars = [car for car in catalog.load_all(args.path) if not args.cars or car.get("Name") in args.cars]
+
+    with Profiler() as profiler:
+        for _ in range(args.repeat):
+            for car in cars:
+                carsim.simulate_quarter_mile(car, record=not args.no_record, integrator=args.integrator)
+
+    profiler.print_summary()
+    if args.trace:
+        profiler.write_chrome_trace(args.trace)
+    if args.speedscope:
+        profiler.write_speedscope(args.speedscope)
+
+
+if __name__ == "__main__":
+    main()
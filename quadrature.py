@@ -0,0 +1,276 @@
+# carsim quadrature solver
+# Summary results without time stepping. Acceleration is a function of speed
+# and gear alone, a = F(v) / W, so the time and distance to reach a speed are
+#   t(v) = ∫ 1/a dv    d(v) = ∫ v/a dv
+# taken over speed, gear by gear, with the shift speeds as breakpoints. Each
+# gear is split further at the torque curve's spline knots, the launch control
+# speed and 60 mph, and every piece is integrated with adaptive 15 point
+# Gauss-Kronrod (pieces are halved until both integrals agree with their
+# embedded 7 point Gauss estimate). The finish line is found inside the piece
+# that crosses it by a safeguarded Newton iteration on d(v) = 402.336 m.
+#
+# These are the exact answers of the model the Euler loop steps through, with
+# no ±delta_t quantization, so they differ from simulate_quarter_mile by its
+# step error (see the README for every car). Compiled with numba on the same
+# parameter record as kernel.py, a car takes tens of microseconds.
+#
+#   carsim.simulate_quarter_mile(car, record=False, integrator="quadrature")
+#   quadrature.simulate_fleet_quadrature(cars)
+
+import numpy as np
+
+import carsim
+import kernel
+from kernel import njit, prange
+
+
+TOLERANCE = 1e-10   # absolute error allowed per piece, in s for t and m for d
+MAX_DEPTH = 60      # halvings of a piece before it's taken as it is
+NEWTON_STEPS = 50    # iterations allowed to find the finish line
+
+# 15 point Kronrod nodes on [-1, 1] (the positive half, the last is 0) and
+# weights, and the weights of the 7 point Gauss rule on every other node
+XGK = np.array([0.991455371120812639206854697526329, 0.949107912342758524526189684047851,
+                0.864864423359769072789712788640926, 0.741531185599394439863864773280788,
+                0.586087235467691130294144845693013, 0.405845151377397166906606412076961,
+                0.207784955007898467600689403773245, 0.0])
+WGK = np.array([0.022935322010529224963732008058970, 0.063092092629978553290700663189204,
+                0.104790010322250183839876322541518, 0.140653259715525918745189590510238,
+                0.169004726639267902826583426598550, 0.190350578064785409913256402421014,
+                0.204432940075298892414161999234649, 0.209482141084727828012999174891714])
+WG = np.array([0.129484966168869693270611432679082, 0.279705391489276667901467771423780,
+               0.381830050505118944950369775488975, 0.417959183673469387755102040816327])
+
+
+# The simulator's force model at speed v in gear (0 based) as an acceleration,
+# NaN off the torque curve
+@njit(cache=True)
+def acceleration(params, gear, v, loss, launch_rpm):
+    n_gears = int(params[kernel.N_GEARS])
+    n_intervals = int(params[kernel.N_INTERVALS])
+    breaks = kernel.HEADER + 2 * n_gears
+    coeffs = breaks + n_intervals + 1
+
+    rpm = v * params[kernel.HEADER + gear]
+    if rpm < launch_rpm and gear == 0:
+        rpm = launch_rpm
+    if rpm < params[breaks] or rpm > params[breaks + n_intervals]:
+        return np.nan
+
+    i = 0
+    while i < n_intervals - 1 and params[breaks + i + 1] <= rpm:
+        i += 1
+    c = coeffs + 4 * i
+    dx = rpm - params[breaks + i]
+    torque = ((params[c] * dx + params[c + 1]) * dx + params[c + 2]) * dx + params[c + 3]
+
+    P_wheel = torque * rpm * 2 * np.pi / 60 * (1 - loss)
+    Fe = P_wheel / v if v > 0.01 else P_wheel / 0.01
+    Fn = Fe - params[kernel.DRAG] * v * v - params[kernel.FR]
+    if Fn > params[kernel.FT]:
+        Fn = params[kernel.FT]
+    return Fn / params[kernel.W]
+
+
+# Kronrod estimates of ∫ 1/a and ∫ v/a over [lo, hi], their errors against
+# the Gauss estimates, and the smallest acceleration seen. Stops at the first
+# node where the car can't accelerate (a <= 0 or NaN) and returns that as the
+# smallest.
+@njit(cache=True)
+def gauss_kronrod(params, gear, lo, hi, loss, launch_rpm):
+    center = (lo + hi) / 2
+    half = (hi - lo) / 2
+
+    a = acceleration(params, gear, center, loss, launch_rpm)
+    if not a > 0:
+        return 0.0, 0.0, 0.0, 0.0, a
+    lowest = a
+    kt = WGK[7] / a
+    kd = WGK[7] * center / a
+    gt = WG[3] / a
+    gd = WG[3] * center / a
+
+    for node in range(7):
+        for side in (-1.0, 1.0):
+            v = center + side * half * XGK[node]
+            a = acceleration(params, gear, v, loss, launch_rpm)
+            if not a > 0:
+                return 0.0, 0.0, 0.0, 0.0, a
+            lowest = min(lowest, a)
+            kt += WGK[node] / a
+            kd += WGK[node] * v / a
+            if node % 2 == 1:
+                gt += WG[node // 2] / a
+                gd += WG[node // 2] * v / a
+
+    return kt * half, kd * half, abs(kt - gt) * half, abs(kd - gd) * half, lowest
+
+
+# Speed where d(v) reaches `target` inside the piece [lo, hi] (gear fixed),
+# given d_lo = d(lo) and d_hi = d(hi). Returns the speed, ∫ 1/a from lo to it
+# and the number of force evaluations, the speed and time NaN if the iteration
+# doesn't meet the tolerance (or stall on adjacent floats) in NEWTON_STEPS.
+@njit(cache=True)
+def crossing(params, gear, lo, hi, d_lo, d_hi, target, loss, launch_rpm):
+    bracket_lo = lo
+    bracket_hi = hi
+    v = lo + (hi - lo) * (target - d_lo) / (d_hi - d_lo)
+    evaluations = 0
+
+    for _ in range(NEWTON_STEPS):
+        dt, dd, _, _, _ = gauss_kronrod(params, gear, lo, v, loss, launch_rpm)
+        a = acceleration(params, gear, v, loss, launch_rpm)
+        evaluations += 16
+        gap = d_lo + dd - target
+        if abs(gap) < 1e-11:
+            return v, dt, evaluations
+        if gap > 0:
+            bracket_hi = v
+        else:
+            bracket_lo = v
+
+        # Newton on d(v) - target with d'(v) = v / a, bisecting whenever it leaves the bracket
+        step = v - gap * a / v
+        if not bracket_lo < step < bracket_hi:
+            step = (bracket_lo + bracket_hi) / 2
+        if step == v:
+            return v, dt, evaluations
+        v = step
+
+    return np.nan, np.nan, evaluations
+
+
+# Returns (quarter_time, quarter_speed, 0-60 mph, evaluations), times NaN if
+# the car stops accelerating, runs out of gears or off its torque curve first
+# (or the finish line can't be pinned down)
+@njit(cache=True)
+def quadrature_kernel(params, quarter_mile, loss, launch_rpm):
+    n_gears = int(params[kernel.N_GEARS])
+    n_intervals = int(params[kernel.N_INTERVALS])
+    shift_rpm = kernel.HEADER + n_gears
+    breaks = shift_rpm + n_gears
+    sixty = 60 * 0.44704
+
+    t = 0.0
+    d = 0.0
+    zerosixty = -1.0
+    evaluations = 0
+    v_lo = 0.0
+    stack = np.empty((MAX_DEPTH + 2, 3))
+
+    for gear in range(n_gears):
+        factor = params[kernel.HEADER + gear]
+        v_hi = params[shift_rpm + gear] / factor
+
+        # A gear entered above its own shift speed is left straight away, as
+        # in the Euler loop, and adds no speed range of its own
+        if v_hi <= v_lo:
+            continue
+
+        # Breakpoints inside this gear: knots of the torque curve, launch
+        # control letting go, the Fe guard and 60 mph
+        points = np.empty(n_intervals + 6)
+        n = 0
+        points[n] = v_lo
+        n += 1
+        points[n] = v_hi
+        n += 1
+        for i in range(n_intervals + 1):
+            points[n] = params[breaks + i] / factor
+            n += 1
+        points[n] = launch_rpm / factor if gear == 0 else v_lo
+        points[n + 1] = 0.01
+        points[n + 2] = sixty
+        n += 3
+        points = np.unique(points[:n])
+
+        for p in range(len(points) - 1):
+            if points[p] < v_lo or points[p + 1] > v_hi:
+                continue
+
+            # Depth first, left half on top, so pieces are accepted in speed order
+            stack[0, 0] = points[p]
+            stack[0, 1] = points[p + 1]
+            stack[0, 2] = 0
+            top = 1
+            while top > 0:
+                top -= 1
+                lo, hi, depth = stack[top]
+
+                dt, dd, error_t, error_d, lowest = gauss_kronrod(params, gear, lo, hi, loss, launch_rpm)
+                evaluations += 15
+                if not lowest > 0:
+                    return np.nan, np.nan, np.nan, evaluations
+
+                if (error_t > TOLERANCE or error_d > TOLERANCE) and depth < MAX_DEPTH and top < len(stack) - 1:
+                    middle = (lo + hi) / 2
+                    stack[top, 0] = middle
+                    stack[top, 1] = hi
+                    stack[top, 2] = depth + 1
+                    stack[top + 1, 0] = lo
+                    stack[top + 1, 1] = middle
+                    stack[top + 1, 2] = depth + 1
+                    top += 2
+                    continue
+
+                if d + dd >= quarter_mile:
+                    v, dt, steps = crossing(params, gear, lo, hi, d, d + dd, quarter_mile, loss, launch_rpm)
+                    evaluations += steps
+                    t += dt
+                    if zerosixty < 0:
+                        zerosixty = t
+                    return t, v, zerosixty, evaluations
+
+                t += dt
+                d += dd
+                if zerosixty < 0 and hi >= sixty:
+                    zerosixty = t
+
+        v_lo = v_hi
+
+    return np.nan, np.nan, np.nan, evaluations
+
+
+@njit(cache=True, parallel=True)
+def fleet_quadrature_kernel(table, quarter_mile, loss, launch_rpm):
+    out = np.empty((table.shape[0], 3))
+    for row in prange(table.shape[0]):
+        t, v, zerosixty, _ = quadrature_kernel(table[row], quarter_mile, loss, launch_rpm)
+        out[row, 0] = t
+        out[row, 1] = v
+        out[row, 2] = zerosixty
+    return out
+
+
+def constants():
+    return carsim.QUARTER_MILE, carsim.DRIVETRAIN_POWER_LOSS, carsim.LAUNCH_RPM
+
+
+# Summary results of one car, as simulate_quarter_mile(car, record=False)
+# gives them for quarter_time, quarter_speed and 0-60 mph
+def simulate_quadrature(car, record=False):
+    if record:
+        raise ValueError("The quadrature solver gives summary results only, run it with record=False")
+
+    car = carsim.as_car(car)
+    t, v, zerosixty, evaluations = quadrature_kernel(kernel.pack_car(car), *constants())
+    if t != t:
+        raise ValueError(f"{car.name} doesn't reach the quarter mile (it stops accelerating, "
+                         f"runs out of gears or off its torque curve first)")
+
+    return {
+        "quarter_time": float(t),
+        "quarter_speed": float(v),
+        "0-60 mph": float(zerosixty),
+        "evaluations": int(evaluations),
+    }
+
+
+# Same return as kernel.simulate_fleet_kernel, NaN for cars that don't finish
+def simulate_fleet_quadrature(cars):
+    out = fleet_quadrature_kernel(kernel.pack_fleet(cars), *constants())
+    return {
+        "quarter_time": out[:, 0],
+        "quarter_speed": out[:, 1],
+        "0-60 mph": out[:, 2]
+    }
@@ -0,0 +1,224 @@
+# carsim reports
+# Plots of runs as image files, no window needed. Traces are converted to
+# display units as whole arrays, cut down to a few hundred points that keep
+# their shape (largest triangle three buckets) and drawn on the Agg backend.
+# Each car's report is drawn in its own worker process, and an overlay puts
+# every car on the same axes.
+#
+#   python report.py cars.json -o reports --format png svg
+
+import argparse
+import concurrent.futures
+import os
+
+import numpy as np
+from matplotlib.figure import Figure
+
+import carsim
+import catalog
+
+
+# Panels of a report: (trace, label, color), in display units
+PANELS = (
+    ("acceleration", "Acceleration (g)", "tab:blue"),
+    ("power", "Power (HP)", "green"),
+    ("rpm", "RPM", "red"),
+)
+
+# Points per plotted trace, far more than a 12 inch wide figure can show apart
+POINTS = 600
+
+
+# The recorded traces of a run in display units, as float arrays
+def convert(data):
+    return {
+        "time": np.asarray(data["time_data"], dtype=float),
+        "acceleration": carsim.ms2_to_g(np.asarray(data["acceleration_data"], dtype=float)),
+        "velocity": carsim.ms_to_mph(np.asarray(data["velocity_data"], dtype=float)),
+        "distance": carsim.m_to_ft(np.asarray(data["distance_data"], dtype=float)),
+        "power": carsim.watt_to_hp(np.asarray(data["power_data"], dtype=float)),
+        "rpm": np.asarray(data["rpm_data"], dtype=float),
+    }
+
+
+# Largest triangle three buckets: indices of n points of (x, y) that keep its
+# peaks and shifts. The first and last points are always kept.
+def lttb(x, y, n):
+    size = len(x)
+    if n >= size or n < 3:
+        return np.arange(size)
+
+    edges = np.linspace(1, size - 1, n - 1).astype(int)
+    keep = np.empty(n, dtype=int)
+    keep[0] = 0
+    keep[-1] = size - 1
+
+    a = 0
+    for bucket in range(n - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        # Average of the next bucket (the last point for the last bucket)
+        following = slice(stop, edges[bucket + 2]) if bucket + 2 < n - 1 else slice(size - 1, size)
+        cx, cy = x[following].mean(), y[following].mean()
+
+        area = np.abs((x[a] - cx) * (y[start:stop] - y[a]) - (x[a] - x[start:stop]) * (cy - y[a]))
+        a = start + int(np.argmax(area))
+        keep[bucket + 1] = a
+
+    return keep
+
+
+# (time, values) of one converted trace, downsampled to `points`
+def trace(traces, name, points=POINTS):
+    keep = lttb(traces["time"], traces[name], points)
+    return traces["time"][keep], traces[name][keep]
+
+
+def car_label(car):
+    return f"{car['Year']} {car['Name']}"
+
+
+# Draws one run's panels into `figure`
+def draw_run(figure, car, data, points=POINTS):
+    traces = convert(data)
+    axes = figure.subplots(len(PANELS), 1, sharex=True)
+
+    for axis, (name, label, color) in zip(axes, PANELS):
+        axis.plot(*trace(traces, name, points), label=label, color=color)
+        axis.set_ylabel(label)
+        axis.legend()
+    axes[-1].set_xlabel("Time (s)")
+
+    figure.suptitle(f"{car_label(car)}: {data['quarter_time']:.2f} s, "
+                    f"{carsim.ms_to_mph(data['quarter_speed']):.2f} mph")
+    figure.tight_layout()
+
+
+# Draws many runs over each other, one color per car
+def draw_overlay(figure, runs, points=POINTS):
+    axes = figure.subplots(len(PANELS), 1, sharex=True)
+
+    for car, data in runs:
+        traces = convert(data)
+        for axis, (name, label, color) in zip(axes, PANELS):
+            axis.plot(*trace(traces, name, points), label=f"{car_label(car)} ({data['quarter_time']:.2f} s)")
+
+    for axis, (name, label, color) in zip(axes, PANELS):
+        axis.set_ylabel(label)
+    axes[0].legend(fontsize="small")
+    axes[-1].set_xlabel("Time (s)")
+    figure.tight_layout()
+
+
+# Dyno chart: torque and power against rpm, and tractive force per gear
+# against speed with the net force envelope
+def draw_dyno(figure, car, points=POINTS):
+    import dyno
+
+    engine = dyno.engine_curves(car, points=points)
+    forces = dyno.tractive_force(car, points=points)
+    best, gear = dyno.envelope(forces)
+    speed = carsim.ms_to_mph(forces["speed"])
+
+    left, right = figure.subplots(1, 2)
+    left.plot(engine["rpm"], engine["torque"], label="Torque (Nm)", color="tab:blue")
+    left.set_xlabel("RPM")
+    left.set_ylabel("Torque (Nm)")
+    power = left.twinx()
+    power.plot(engine["rpm"], carsim.watt_to_hp(engine["power"]), label="Power (HP)", color="green")
+    power.set_ylabel("Power (HP)")
+
+    for g, force in enumerate(forces["tractive"]):
+        right.plot(speed, force, label=f"Gear {g + 1}")
+    right.plot(speed, best, label="Net, best gear", color="black", linestyle="--")
+    right.set_xlabel("Speed (mph)")
+    right.set_ylabel("Force (N)")
+    right.legend(fontsize="small")
+
+    figure.suptitle(f"{car_label(car)} dyno")
+    figure.tight_layout()
+
+
+def render_dyno(car, path, formats=("png",), points=POINTS):
+    figure = Figure(figsize=(12, 5))
+    draw_dyno(figure, carsim.as_car(car), points)
+    return save(figure, path, formats)
+
+
+def save(figure, path, formats):
+    paths = []
+    for fmt in formats:
+        paths.append(f"{path}.{fmt}")
+        figure.savefig(paths[-1])
+    return paths
+
+
+def file_name(car):
+    return "".join(c if c.isalnum() else "_" for c in car_label(car)).strip("_")
+
+
+# Simulates a car and writes its report, returns the files written. Runs in
+# the workers: a bare Figure draws with Agg and never touches pyplot's state.
+def render_car(car, directory, formats=("png",), points=POINTS):
+    car = carsim.as_car(car)
+    figure = Figure(figsize=(12, 8))
+    draw_run(figure, car, carsim.simulate_quarter_mile(car), points)
+    return save(figure, os.path.join(directory, file_name(car)), formats)
+
+
+# One run in a window, or saved to path.<format> files if path is given
+def show_run(car, data, path=None, formats=("png",), points=POINTS):
+    if path is not None:
+        figure = Figure(figsize=(12, 8))
+        draw_run(figure, car, data, points)
+        return save(figure, path, formats)
+
+    import matplotlib.pyplot as plt
+
+    draw_run(plt.figure(figsize=(12, 8)), car, data, points)
+    plt.show()
+    return []
+
+
+def render_overlay(cars, path, formats=("png",), points=POINTS):
+    runs = [(car, carsim.simulate_quarter_mile(car)) for car in map(carsim.as_car, cars)]
+    figure = Figure(figsize=(12, 8))
+    draw_overlay(figure, runs, points)
+    return save(figure, path, formats)
+
+
+# Reports for all the cars (and the overlay) over worker processes, returns the files written
+def render_reports(cars, directory, formats=("png",), workers=None, overlay=True, points=POINTS):
+    os.makedirs(directory, exist_ok=True)
+    cars = [carsim.as_car(car) for car in cars]     # a Car pickles as just its fields
+    workers = workers or os.cpu_count()
+
+    if workers == 1:
+        paths = [path for car in cars for path in render_car(car, directory, formats, points)]
+        if overlay:
+            paths += render_overlay(cars, os.path.join(directory, "overlay"), formats, points)
+        return paths
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(render_car, car, directory, formats, points) for car in cars]
+        if overlay:
+            futures.append(executor.submit(render_overlay, cars, os.path.join(directory, "overlay"), formats, points))
+        return [path for future in futures for path in future.result()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a plot of every car's run, plus an overlay of all of them")
+    parser.add_argument("path", nargs="?", default="cars.json", help="cars.json file or catalog directory")
+    parser.add_argument("-o", "--output", default="reports", help="directory for the images")
+    parser.add_argument("--format", nargs="+", default=["png"], help="png, svg, pdf...")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--points", type=int, default=POINTS, help="points per plotted trace")
+    parser.add_argument("--no-overlay", action="store_true")
+    args = parser.parse_args()
+
+    cars = catalog.load_all(args.path)
+    paths = render_reports(cars, args.output, args.format, args.workers, not args.no_overlay, args.points)
+    print(f"{len(paths)} files written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+# carsim results store
+# Keeps fleet and sweep results on disk instead of dropping them. A store is a
+# directory holding:
+#   summary.bin   fixed size summary records (run id, fleet.RESULT_DTYPE and any
+#                 parameter columns), row after row and uncompressed, read back
+#                 as a numpy structured memmap so analysis works on the file
+#                 without copying it (a column is a strided view)
+#   traces.bin    the traces of chosen runs, one compressed blob per run
+#   traces.idx    run id, offset and size of each blob
+# Writing goes through a background thread with a bounded queue. The runner
+# only hands over arrays. Compression (zlib releases the GIL) and disk writes
+# happen alongside the simulation. With pyarrow installed the summary can be
+# exported to Parquet.
+#
+#   store = ResultStore("sweep.results", fields=("W", "final_drive"))
+#   with store.writer() as writer:
+#       writer.append(rows)                   # structured array or dict of columns
+#       writer.append_trace(run_id, data)     # a simulate_quarter_mile(record=True) result
+#   store.summary()["quarter_time"].mean()
+
+import json
+import os
+import queue
+import threading
+import time
+import zlib
+
+import numpy as np
+
+import telemetry
+
+
+STORE_VERSION = 1
+
+INDEX_DTYPE = np.dtype([("run", "i8"), ("offset", "i8"), ("length", "i8"), ("n", "i8")])
+
+# The same columns fleet.RESULT_DTYPE has, not imported so reading a store needs no engine
+SUMMARY_FIELDS = ("quarter_time", "quarter_speed", "0-60 mph")
+
+
+def summary_dtype(fields=()):
+    return np.dtype([("run", "i8")] + [(name, "f8") for name in SUMMARY_FIELDS + tuple(fields)])
+
+
+# Trace columns as one blob: the float64 values byte shuffled (all first bytes,
+# then all second bytes...), which lets zlib find the runs in slowly changing
+# floats, then compressed
+def pack_trace(data, level=1):
+    values = np.ascontiguousarray(np.vstack([np.asarray(data[column], dtype="f8") for column in telemetry.COLUMNS]))
+    shuffled = values.view(np.uint8).reshape(-1, 8).T.copy()
+    return zlib.compress(shuffled, level), values.shape[1]
+
+
+def unpack_trace(blob, n):
+    shuffled = np.frombuffer(zlib.decompress(blob), dtype=np.uint8).reshape(8, -1)
+    values = shuffled.T.copy().view("f8").reshape(len(telemetry.COLUMNS), n)
+    return dict(zip(telemetry.COLUMNS, values))
+
+
+class ResultStore:
+    # Opens the store in `path`, creating it with the given parameter `fields`
+    # if it isn't there yet
+    def __init__(self, path, fields=()):
+        self.path = path
+        meta_path = os.path.join(path, "meta.json")
+
+        if os.path.exists(meta_path):
+            with open(meta_path) as file:
+                meta = json.load(file)
+            if meta["version"] != STORE_VERSION:
+                raise ValueError(f"{path} is a version {meta['version']} store, expected {STORE_VERSION}")
+            if fields and tuple(fields) != tuple(meta["fields"]):
+                raise ValueError(f"{path} has fields {meta['fields']}, not {list(fields)}")
+            self.fields = tuple(meta["fields"])
+        else:
+            os.makedirs(path, exist_ok=True)
+            self.fields = tuple(fields)
+            with open(meta_path, "w") as file:
+                json.dump({"version": STORE_VERSION, "fields": list(self.fields)}, file)
+
+        self.dtype = summary_dtype(self.fields)
+        self.index = None
+
+    def file(self, name):
+        return os.path.join(self.path, name)
+
+    def writer(self, batch_size=65536, queue_size=64, level=1):
+        return StoreWriter(self, batch_size, queue_size, level)
+
+    # Every summary row written so far, as a read only memmap of the file (a
+    # partly written last record is left out)
+    def summary(self):
+        path = self.file("summary.bin")
+        rows = os.path.getsize(path) // self.dtype.itemsize if os.path.exists(path) else 0
+        if rows == 0:
+            return np.empty(0, dtype=self.dtype)
+        return np.memmap(path, dtype=self.dtype, mode="r", shape=(rows,))
+
+    # Rows on disk: an open writer's queued rows count once it has written them
+    # (StoreWriter.rows counts those too)
+    def __len__(self):
+        return len(self.summary())
+
+    # run id -> index record, the last one written wins
+    def trace_index(self):
+        path = self.file("traces.idx")
+        if not os.path.exists(path):
+            return {}
+        records = np.fromfile(path, dtype=INDEX_DTYPE)
+        return {int(record["run"]): record for record in records}
+
+    def trace_runs(self):
+        return sorted(self.trace_index())
+
+    # The traces of a run as {"time_data": array, ...}, KeyError if it has none
+    def trace(self, run):
+        if self.index is None or run not in self.index:
+            self.index = self.trace_index()
+        record = self.index[run]
+        with open(self.file("traces.bin"), "rb") as file:
+            file.seek(int(record["offset"]))
+            blob = file.read(int(record["length"]))
+        return unpack_trace(blob, int(record["n"]))
+
+    # The summary as a Parquet file, needs pyarrow
+    def to_parquet(self, path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("to_parquet needs pyarrow (pip install pyarrow)")
+
+        summary = self.summary()
+        table = pyarrow.table({name: np.asarray(summary[name]) for name in self.dtype.names})
+        pyarrow.parquet.write_table(table, path)
+
+
+class StoreWriter:
+    def __init__(self, store, batch_size=65536, queue_size=64, level=1):
+        self.store = store
+        self.batch_size = batch_size
+        self.level = level
+        self.items = queue.Queue(queue_size)
+        self.error = None
+        self.rows = len(store)     # run ids carry on from what's already there, queued rows included
+        self.traces = 0
+        self.waited = 0.0          # seconds append spent waiting for room in the queue
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    # Summary rows: a structured array with the store's columns (run ids given
+    # or not) or a dict of columns. Rows without run ids are numbered from
+    # `start`, or on from the rows already in the store. Returns the run ids.
+    def append(self, rows, start=None):
+        if self.error is not None:
+            raise self.error
+
+        columns = rows if isinstance(rows, dict) else {name: rows[name] for name in rows.dtype.names}
+        n = len(next(iter(columns.values())))
+        batch = np.empty(n, dtype=self.store.dtype)
+        for name in self.store.dtype.names:
+            if name in columns:
+                batch[name] = columns[name]
+            elif name == "run":
+                batch[name] = np.arange(n) + (self.rows if start is None else start)
+            else:
+                batch[name] = np.nan
+
+        self.rows += n
+        self.put(("summary", batch))
+        return batch["run"]
+
+    def append_trace(self, run, data):
+        if self.error is not None:
+            raise self.error
+        self.traces += 1
+        self.put(("trace", int(run), {column: np.asarray(data[column]) for column in telemetry.COLUMNS}))
+
+    def put(self, item):
+        start = time.perf_counter()
+        self.items.put(item)
+        self.waited += time.perf_counter() - start
+
+    # Runs on the writer thread: writes summaries as they come (flushing every
+    # batch_size rows), compresses and writes traces
+    def run(self):
+        store = self.store
+        pending_rows = 0
+        item = ()
+
+        try:
+            with open(store.file("summary.bin"), "ab") as summary, \
+                    open(store.file("traces.bin"), "ab") as traces, \
+                    open(store.file("traces.idx"), "ab") as index:
+                while True:
+                    item = self.items.get()
+
+                    if item is None or item[0] == "summary":
+                        if item is not None:
+                            summary.write(item[1].data)
+                            pending_rows += len(item[1])
+                        if pending_rows and (item is None or pending_rows >= self.batch_size):
+                            summary.flush()
+                            pending_rows = 0
+                        if item is None:
+                            return
+                    else:
+                        _, run, data = item
+                        blob, n = pack_trace(data, self.level)
+                        record = np.array([(run, traces.tell(), len(blob), n)], dtype=INDEX_DTYPE)
+                        traces.write(blob)
+                        traces.flush()
+                        index.write(record.tobytes())
+                        index.flush()
+        except BaseException as error:
+            self.error = error
+            while item is not None:     # keep taking items so append never blocks on a dead writer
+                item = self.items.get()
+
+    # Writes whatever is queued and stops the thread
+    def close(self):
+        if self.thread.is_alive():
+            self.items.put(None)
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
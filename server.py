@@ -0,0 +1,420 @@
+# carsim server
+# A long running local simulation service, so callers don't pay for starting
+# Python, importing numpy/scipy/numba and compiling torque curves on every
+# query. Cars from the catalog are loaded once and kept with their compiled
+# curves, and the numba kernels are compiled (or loaded from numba's cache)
+# at startup. Requests that arrive together are gathered into micro-batches:
+# the first request of a batch waits up to max_wait for others, then the whole
+# batch goes through the fleet kernel (across worker processes when it's big
+# and there are workers) off the event loop. Results are cached under
+# simcache keys, and identical requests in flight share one run. /metrics
+# reports latency percentiles, throughput, batch sizes and cache hits.
+#
+# HTTP/1.1 with JSON bodies, on localhost or a Unix socket, no dependencies
+# beyond the engine:
+#   POST /simulate  {"car": "Honda Accord"}
+#                   {"car": "Honda Accord", "set": {"W": 1500, "gear_ratios[5]": 0.7}}
+#                   {"car": {...cars.json fields...}, "engine": "quadrature"}
+#                   {"cars": [...any of the above...]}
+#   GET  /cars, /metrics, /health
+#
+#   python server.py --port 8765
+#   python server.py --unix /tmp/carsim.sock --workers 4
+#   python client.py "Honda Accord" --set W=1500
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import math
+import os
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+
+import carsim
+import catalog
+import fleet
+import simcache
+import sweep
+
+
+# Engines requests can ask for, each a function of a list of Cars returning
+# {metric: array}, and the simcache kind its results are cached under
+ENGINES = {
+    "euler": "batch",           # the fleet kernel, same results as simulate_quarter_mile
+    "quadrature": "quadrature",
+}
+
+METRICS = fleet.RESULT_DTYPE.names
+MAX_BODY = 16 * 1024 * 1024
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+           500: "Internal Server Error"}
+
+
+# Runs a batch in this process, off the event loop
+def run_batch(engine, cars):
+    if engine == "quadrature":
+        import quadrature
+        return quadrature.simulate_fleet_quadrature(cars)
+    results = fleet.run_chunk(0, cars)[1]
+    return {metric: results[metric] for metric in METRICS}
+
+
+# NaN (a car that doesn't finish) isn't JSON, it goes out as null
+def plain(value):
+    value = float(value)
+    return None if math.isnan(value) else value
+
+
+class Metrics:
+    def __init__(self, window=10000):
+        self.started = time.perf_counter()
+        self.counts = dict.fromkeys(("requests", "cars", "errors", "batches", "batched cars", "cache hits",
+                                     "coalesced", "process pool batches"), 0)
+        self.latencies = deque(maxlen=window)      # seconds, per car
+        self.finished = deque(maxlen=window)       # perf_counter when each car was answered
+        self.largest_batch = 0
+
+    def count(self, name, n=1):
+        self.counts[name] += n
+
+    def answered(self, started):
+        now = time.perf_counter()
+        self.latencies.append(now - started)
+        self.finished.append(now)
+
+    def batch(self, size):
+        self.counts["batches"] += 1
+        self.counts["batched cars"] += size
+        self.largest_batch = max(self.largest_batch, size)
+
+    def snapshot(self):
+        now = time.perf_counter()
+        latencies = np.array(self.latencies) * 1e3
+        recent = [t for t in self.finished if now - t <= 10]
+
+        snapshot = dict(self.counts)
+        snapshot.update({
+            "uptime s": now - self.started,
+            "cars/s": self.counts["cars"] / (now - self.started),
+            "cars/s last 10 s": len(recent) / min(10, now - self.started),
+            "mean batch": self.counts["batched cars"] / self.counts["batches"] if self.counts["batches"] else 0,
+            "largest batch": self.largest_batch,
+        })
+        for p in (50, 95, 99):
+            snapshot[f"latency p{p} ms"] = float(np.percentile(latencies, p)) if len(latencies) else None
+        return snapshot
+
+
+class Server:
+    # cars: cars.json file or catalog directory. Batches of pool_batch cars or
+    # more go to `workers` processes when workers > 1.
+    def __init__(self, cars="cars.json", workers=1, max_batch=1024, max_wait=0.002, pool_batch=256,
+                 cache_size=100000, cache_path=None, resolved_size=100000):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.pool_batch = pool_batch
+        self.workers = workers
+        self.metrics = Metrics()
+        self.cache = simcache.ResultCache(cache_size, cache_path)
+
+        # Request (car, "set", engine) as JSON -> (Car, simcache key). Building and
+        # validating a Car and hashing it takes far longer than answering from
+        # the cache, so a request seen before goes straight to the cache.
+        self.resolved = OrderedDict()
+        self.resolved_size = resolved_size
+
+        # Warm catalog: every car of a cars.json, or catalog rows as they're asked for
+        self.catalog = catalog.Catalog(cars) if os.path.isdir(cars) else None
+        self.cars = {} if self.catalog is not None else {car["Name"]: car for car in carsim.load_cars(cars)}
+
+        self.threads = concurrent.futures.ThreadPoolExecutor(1)
+        self.pool = fleet.make_executor(workers) if workers > 1 else None
+        self.queues = {}
+        self.batchers = []
+        self.in_flight = {}
+
+    def names(self):
+        if self.catalog is not None:
+            return sorted(set(str(name) for name in self.catalog.column(catalog.file_name("Name"))))
+        return sorted(self.cars)
+
+    # Compiles (or loads) the kernels so the first request doesn't pay for it
+    def warm(self):
+        names = self.names()
+        car = self.car({"car": names[0]}) if names else None
+        if car is not None:
+            for engine in ENGINES:
+                run_batch(engine, [car])
+
+    def close(self):
+        self.threads.shutdown()
+        if self.pool is not None:
+            self.pool.shutdown()
+        self.cache.close()
+
+    # The Car a request asks for: a name from the catalog or a full spec,
+    # with "set" changes on top. ValueError if there's no such car or it isn't valid.
+    def car(self, request):
+        spec = request.get("car")
+        if isinstance(spec, str):
+            car = self.cars.get(spec)
+            if car is None and self.catalog is not None:
+                car = self.catalog.get(spec)
+                if car is not None:
+                    self.cars[spec] = car
+            if car is None:
+                raise ValueError(f"No car named {spec!r}")
+        elif isinstance(spec, dict):
+            car = spec
+        else:
+            raise ValueError("Expected \"car\" to be a name or a dict of cars.json fields")
+
+        changes = request.get("set")
+        if changes is not None and not isinstance(changes, dict):
+            raise ValueError("Expected \"set\" to be a dict of {field: value}")
+        if changes:
+            try:
+                car = sweep.make_variant(car, changes)
+            except (KeyError, IndexError, TypeError) as error:
+                raise ValueError(f"Can't apply \"set\" {changes}: no such field or index ({error!r})")
+        return carsim.as_car(car)
+
+    # (Car, simcache key) of a request, remembered for the next time it's asked
+    def resolve(self, request, engine):
+        spec = json.dumps([request.get("car"), request.get("set"), engine], sort_keys=True, separators=(",", ":"))
+        resolved = self.resolved.get(spec)
+        if resolved is not None:
+            self.resolved.move_to_end(spec)
+            return resolved
+
+        car = self.car(request)
+        resolved = self.resolved[spec] = (car, simcache.result_key(car, ENGINES[engine]))
+        while len(self.resolved) > self.resolved_size:
+            self.resolved.popitem(last=False)
+        return resolved
+
+    # Results of one car request, from the cache, a run in flight or a batch
+    async def simulate(self, request):
+        started = time.perf_counter()
+        engine = request.get("engine", "euler")
+        if not isinstance(engine, str) or engine not in ENGINES:
+            raise ValueError(f"Unknown engine {engine!r}, known: {', '.join(ENGINES)}")
+        car, key = self.resolve(request, engine)
+        self.metrics.count("cars")
+
+        data = self.cache.get(key)
+        if data is not None:
+            self.metrics.count("cache hits")
+        else:
+            future = self.in_flight.get(key)
+            if future is not None:
+                self.metrics.count("coalesced")
+            else:
+                future = asyncio.get_running_loop().create_future()
+                self.in_flight[key] = future
+                await self.queue(engine).put((key, car, future))
+            data = await asyncio.shield(future)
+
+        self.metrics.answered(started)
+        return dict(data, name=car.name)
+
+    def queue(self, engine):
+        queue = self.queues.get(engine)
+        if queue is None:
+            queue = self.queues[engine] = asyncio.Queue()
+            self.batchers.append(asyncio.get_running_loop().create_task(self.batcher(engine, queue)))
+        return queue
+
+    # Takes requests off an engine's queue in batches: whatever arrives within
+    # max_wait of the first one, up to max_batch
+    async def batcher(self, engine, queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0 and queue.empty():
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), max(timeout, 0)) if timeout > 0
+                                 else queue.get_nowait())
+                except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                    break
+
+            await self.run(engine, batch)
+
+    async def run(self, engine, batch):
+        loop = asyncio.get_running_loop()
+        keys, cars, futures = zip(*batch)
+        self.metrics.batch(len(batch))
+
+        try:
+            if self.pool is not None and engine == "euler" and len(cars) >= self.pool_batch:
+                self.metrics.count("process pool batches")
+                chunk_size = math.ceil(len(cars) / self.workers)
+                results = await loop.run_in_executor(
+                    self.threads, lambda: fleet.simulate_fleet(cars, self.workers, chunk_size, self.pool))
+            else:
+                results = await loop.run_in_executor(self.threads, run_batch, engine, list(cars))
+
+            items = [(key, {metric: plain(results[metric][row]) for metric in METRICS})
+                     for row, key in enumerate(keys)]
+            self.cache.put_many(items)
+            for future, (_, data) in zip(futures, items):
+                future.set_result(data)
+        except Exception as error:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(error)
+        finally:
+            for key in keys:
+                self.in_flight.pop(key, None)
+
+    # Routes one parsed HTTP request, returns (status, body)
+    async def route(self, method, path, body):
+        if path == "/simulate":
+            if method != "POST":
+                return 405, {"error": "POST a JSON car request"}
+            request = json.loads(body or b"{}")
+            if not isinstance(request, dict):
+                raise ValueError("Expected a JSON object, {\"car\": ...} or {\"cars\": [...]}")
+            if "cars" in request:
+                if not isinstance(request["cars"], list):
+                    raise ValueError("Expected \"cars\" to be a list of car requests")
+                self.metrics.count("requests")
+                results = await asyncio.gather(*(self.simulate(item if isinstance(item, dict) else {"car": item})
+                                                 for item in request["cars"]), return_exceptions=True)
+                # A bad car is the client's error, anything else is the server's
+                for result in results:
+                    if isinstance(result, Exception) and not isinstance(result, ValueError):
+                        raise result
+                errors = [str(result) for result in results if isinstance(result, ValueError)]
+                if errors:
+                    self.metrics.count("errors")
+                    return 400, {"error": errors[0], "errors": len(errors)}
+                return 200, {"results": results}
+            self.metrics.count("requests")
+            return 200, await self.simulate(request)
+
+        if method != "GET":
+            return 405, {"error": f"{path} only takes GET"}
+        if path == "/metrics":
+            return 200, dict(self.metrics.snapshot(), cache=self.cache.stats())
+        if path == "/cars":
+            return 200, {"cars": self.names()}
+        if path == "/health":
+            return 200, {"ok": True}
+        return 404, {"error": f"No {path}, try /simulate, /cars, /metrics or /health"}
+
+    # One connection, any number of keep-alive requests on it
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    method, path, version = line.decode("latin-1").split()
+                except ValueError:
+                    await self.respond(writer, 400, {"error": "Malformed request line"}, False)
+                    break
+
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = header.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                try:
+                    length = int(headers.get("content-length", 0))
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self.respond(writer, 400, {"error": "Content-Length has to be a byte count"}, False)
+                    break
+                if length > MAX_BODY:
+                    await self.respond(writer, 413, {"error": f"Bodies are limited to {MAX_BODY} bytes"}, False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                try:
+                    status, data = await self.route(method, path.split("?")[0], body)
+                except ValueError as error:     # bad JSON or car specs, validation raises ValueError
+                    self.metrics.count("errors")
+                    status, data = 400, {"error": str(error)}
+                except Exception as error:
+                    self.metrics.count("errors")
+                    status, data = 500, {"error": f"{type(error).__name__}: {error}"}
+
+                await self.respond(writer, status, data, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, data, keep_alive):
+        body = json.dumps(data).encode()
+        head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode() + body)
+        await writer.drain()
+
+    async def start(self, host="127.0.0.1", port=8765, unix=None):
+        if unix is not None:
+            if os.path.exists(unix):
+                os.unlink(unix)
+            return await asyncio.start_unix_server(self.handle, path=unix)
+        return await asyncio.start_server(self.handle, host, port)
+
+    # Stops the batchers, for servers run on a loop that keeps going
+    async def stop(self):
+        for task in self.batchers:
+            task.cancel()
+        await asyncio.gather(*self.batchers, return_exceptions=True)
+        self.batchers.clear()
+        self.queues.clear()
+
+
+async def serve(server, host="127.0.0.1", port=8765, unix=None):
+    listener = await server.start(host, port, unix)
+    print(f"carsim server on {unix or f'http://{host}:{port}'}, {len(server.names())} cars", flush=True)
+    async with listener:
+        await listener.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local simulation server with micro-batching and a result cache")
+    parser.add_argument("--cars", default="cars.json", help="cars.json file or catalog directory")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="listen on this Unix socket instead of TCP")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes for big batches")
+    parser.add_argument("--max-batch", type=int, default=1024)
+    parser.add_argument("--max-wait", type=float, default=2.0, help="ms a batch waits for more requests")
+    parser.add_argument("--cache-size", type=int, default=100000)
+    parser.add_argument("--cache", help="sqlite file to keep results in across restarts")
+    args = parser.parse_args()
+
+    server = Server(args.cars, args.workers, args.max_batch, args.max_wait / 1e3,
+                    cache_size=args.cache_size, cache_path=args.cache)
+    server.warm()
+    try:
+        asyncio.run(serve(server, args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
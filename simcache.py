@@ -0,0 +1,187 @@
+# carsim result cache
+# simulate_quarter_mile is deterministic in the car and the sim constants, so
+# summary results are cached under a hash of exactly those. An in-memory LRU
+# sits in front of an optional sqlite file that survives restarts. Editing a car
+# in cars.json changes only that car's key; cosmetic fields (Name, Year, Engine...)
+# aren't part of it. The file keeps the disk_maxsize most recently written results.
+#
+#   cache = ResultCache(path="results.sqlite")
+#   cache.simulate(car)
+
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import carsim
+
+
+# Bump when a change to the engines changes their results, old entries are then never hit
+MODEL_VERSION = 1
+
+# Optional car fields that affect results, on top of carsim.REQUIRED_FIELDS
+EXTRA_FIELDS = ("shift_rpm", "rho")
+
+
+def sim_constants():
+    return {
+        "model": MODEL_VERSION,
+        "rho": carsim.RHO,
+        "g": carsim.G,
+        "quarter_mile": carsim.QUARTER_MILE,
+        "dt": carsim.DELTA_T,
+        "drivetrain_power_loss": carsim.DRIVETRAIN_POWER_LOSS,
+        "launch_rpm": carsim.LAUNCH_RPM,
+        "shift_margin": carsim.SHIFT_MARGIN,
+    }
+
+
+# Canonical hash of everything that decides a result. kind tells apart results
+# from engines that return different keys ("euler", "rk4", "batch", ...).
+def result_key(car, kind="euler"):
+    car = carsim.as_car(car)
+    fields = {field: canonical(car.data[field])
+              for field in carsim.REQUIRED_FIELDS + EXTRA_FIELDS if field in car.data}
+    payload = json.dumps({"car": fields, "sim": sim_constants(), "kind": kind},
+                         sort_keys=True, separators=(",", ":"), default=float)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+# Numbers as floats, so W: 1611 and W: 1611.0 (the same car) hash the same
+def canonical(value):
+    if isinstance(value, (list, tuple)):
+        return [canonical(item) for item in value]
+    if carsim.is_number(value):
+        return float(value)
+    return value
+
+
+# numpy scalars to plain floats so results are JSON safe and look the same from either tier
+def plain(data):
+    return {key: value.tolist() if isinstance(value, (np.generic, np.ndarray)) else copy_value(value)
+            for key, value in data.items()}
+
+
+# Lists (shift_times) are copied going in and out, so callers editing a result
+# can't change what later hits get
+def copy_value(value):
+    return list(value) if isinstance(value, list) else value
+
+
+def copy_result(data):
+    return {key: copy_value(value) for key, value in data.items()}
+
+
+class ResultCache:
+    def __init__(self, maxsize=4096, path=None, disk_maxsize=1000000):
+        self.maxsize = maxsize
+        self.disk_maxsize = disk_maxsize
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        # The connection may be used from other threads than the one opening it
+        # (server.py opens it before its event loop runs), the lock keeps one
+        # at a time on it and on the LRU
+        self.lock = threading.Lock()
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, data TEXT)")
+            self.db.commit()
+
+    def __len__(self):
+        return len(self.memory)
+
+    def get(self, key):
+        with self.lock:
+            data = self.memory.get(key)
+            if data is not None:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return data
+
+            if self.db is not None:
+                row = self.db.execute("SELECT data FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    data = json.loads(row[0])
+                    self.remember(key, data)
+                    self.disk_hits += 1
+                    return data
+
+            self.misses += 1
+            return None
+
+    def remember(self, key, data):
+        self.memory[key] = data
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.maxsize:
+            self.memory.popitem(last=False)
+
+    def put(self, key, data):
+        self.put_many([(key, data)])
+
+    def put_many(self, items):
+        items = [(key, plain(data)) for key, data in items]
+        with self.lock:
+            for key, data in items:
+                self.remember(key, data)
+
+            if self.db is not None:
+                self.db.executemany("INSERT OR REPLACE INTO results (key, data) VALUES (?, ?)",
+                                    [(key, json.dumps(data)) for key, data in items])
+                # Rows are numbered in write order, so dropping everything more than
+                # disk_maxsize behind the newest keeps at most that many
+                self.db.execute("DELETE FROM results WHERE rowid <= (SELECT MAX(rowid) FROM results) - ?",
+                                (self.disk_maxsize,))
+                self.db.commit()
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            if self.db is not None:
+                self.db.execute("DELETE FROM results")
+                self.db.commit()
+
+    def close(self):
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+    def stats(self):
+        return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses, "size": len(self.memory)}
+
+    # Summary of simulate_quarter_mile(car, record=False), from the cache when possible
+    def simulate(self, car, integrator="euler"):
+        car = carsim.as_car(car)
+        key = result_key(car, integrator)
+
+        data = self.get(key)
+        if data is None:
+            data = plain(carsim.simulate_quarter_mile(car, record=False, integrator=integrator))
+            self.put(key, data)
+
+        return copy_result(data)
+
+    # Summaries for many cars, in order. Misses all go through one
+    # simulate_quarter_mile_batch call, so only its keys are returned.
+    def simulate_many(self, cars):
+        cars = [carsim.as_car(car) for car in cars]
+        keys = [result_key(car, "batch") for car in cars]
+        results = [self.get(key) for key in keys]
+
+        missing = [i for i, data in enumerate(results) if data is None]
+        if missing:
+            batch = carsim.simulate_quarter_mile_batch([cars[i] for i in missing])
+            new = []
+            for row, i in enumerate(missing):
+                results[i] = {name: float(values[row]) for name, values in batch.items()}
+                new.append((keys[i], results[i]))
+            self.put_many(new)
+
+        return [copy_result(data) for data in results]
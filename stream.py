@@ -0,0 +1,256 @@
+# carsim streaming
+# Live runs. carsim.quarter_mile_steps hands out samples while the simulation
+# goes and consumers take them on the other end: a terminal readout, CSV or
+# Parquet writers and a live matplotlib plot. Nothing keeps the whole trace, so
+# a run's memory doesn't grow with its length (bar the plot, which needs its
+# points). The simulation only steps when the consumers are ready for more:
+# directly, or through a bounded buffer so it can run ahead a little.
+#
+#   python stream.py "Honda Accord" --realtime
+#   python stream.py "Ford Mustang" --every 1 --csv run.csv --plot
+
+import argparse
+import csv
+import queue
+import sys
+import threading
+import time
+
+import carsim
+import catalog
+
+
+# Samples every `interval` seconds of simulated time, as a step count
+def every_for(interval):
+    return max(1, round(interval / carsim.DELTA_T))
+
+
+# A QuarterMileRun sampled every `every` steps, or every `interval` seconds if given
+def stream(car, interval=None, every=1):
+    if interval is not None:
+        every = every_for(interval)
+    if every < 1:
+        raise ValueError(f"Can't sample every {every} steps")
+    return carsim.QuarterMileRun(car, every)
+
+
+# Runs `samples` in a thread that can get at most maxsize samples ahead of
+# the consumer, it then blocks until the consumer catches up. Errors in the
+# producer are raised here, and stopping early stops the producer too.
+def buffered(samples, maxsize=256):
+    items = queue.Queue(maxsize)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for sample in samples:
+                if not put(sample):
+                    return
+            put(done)
+        except BaseException as error:
+            put(error)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+# Consumers take samples with send() and get the run's summary with close(),
+# None if the run failed.
+
+class TerminalView:
+    # realtime=True paces the output to the simulated clock
+    def __init__(self, file=sys.stdout, realtime=False):
+        self.file = file
+        self.realtime = realtime
+        self.started = None
+
+    def send(self, sample):
+        t, v, d, a, gear, rpm, power = sample
+
+        if self.realtime:
+            if self.started is None:
+                self.started = time.perf_counter()
+            ahead = t - (time.perf_counter() - self.started)
+            if ahead > 0:
+                time.sleep(ahead)
+
+        print(f"{t:6.2f} s  {carsim.ms_to_mph(v):6.2f} mph  {d:7.2f} m  "
+              f"gear {gear}  {rpm:5.0f} rpm  {carsim.watt_to_hp(power):4.0f} hp",
+              end="\r", file=self.file, flush=True)
+
+    def close(self, result):
+        print(file=self.file)
+        if result is not None:
+            carsim.print_simulation_info(result)
+
+
+class CSVWriter:
+    # file is a path or an open text file, paths are closed at the end
+    def __init__(self, file):
+        self.owned = isinstance(file, str)
+        self.file = open(file, "w", newline="") if self.owned else file
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(carsim.SAMPLE_FIELDS)
+
+    def send(self, sample):
+        self.writer.writerow(sample)
+
+    def close(self, result):
+        if self.owned:
+            self.file.close()
+        else:
+            self.file.flush()
+
+
+class ParquetWriter:
+    # Samples are written as a row group every batch_size samples
+    def __init__(self, path, batch_size=8192):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("ParquetWriter needs pyarrow (pip install pyarrow), CSVWriter doesn't")
+
+        self.pa = pyarrow
+        self.schema = pyarrow.schema([(field, pyarrow.int64() if field == "gear" else pyarrow.float64())
+                                      for field in carsim.SAMPLE_FIELDS])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+        self.batch_size = batch_size
+        self.rows = []
+
+    def send(self, sample):
+        self.rows.append(sample)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            columns = [list(column) for column in zip(*self.rows)]
+            self.writer.write_table(self.pa.Table.from_arrays(columns, schema=self.schema))
+            self.rows = []
+
+    def close(self, result):
+        self.flush()
+        self.writer.close()
+
+
+class LiveAnimation:
+    # Redraws at most fps times a second, block=True leaves the window open at the end
+    def __init__(self, title="", fps=20, block=True):
+        import matplotlib.pyplot as plt
+
+        self.plt = plt
+        self.fps = fps
+        self.block = block
+        self.drawn = 0
+        self.t, self.speed, self.rpm, self.distance = [], [], [], []
+
+        plt.ion()
+        self.figure, axes = plt.subplots(3, 1, sharex=True, figsize=(8, 8))
+        self.figure.suptitle(title)
+        self.axes = axes
+        self.lines = [axis.plot([], [])[0] for axis in axes]
+        for axis, label in zip(axes, ("Velocity (mph)", "RPM", "Distance (m)")):
+            axis.set_ylabel(label)
+            axis.grid(True)
+        axes[-1].set_xlabel("Time (s)")
+
+    def send(self, sample):
+        t, v, d, a, gear, rpm, power = sample
+        self.t.append(t)
+        self.speed.append(carsim.ms_to_mph(v))
+        self.rpm.append(rpm)
+        self.distance.append(d)
+
+        now = time.perf_counter()
+        if now - self.drawn >= 1 / self.fps:
+            self.draw()
+            self.drawn = now
+
+    def draw(self):
+        for line, axis, values in zip(self.lines, self.axes, (self.speed, self.rpm, self.distance)):
+            line.set_data(self.t, values)
+            axis.relim()
+            axis.autoscale_view()
+        self.plt.pause(0.001)
+
+    def close(self, result):
+        self.draw()
+        self.plt.ioff()
+        if self.block:
+            self.plt.show()
+
+
+# Runs a car through the consumers and returns its summary. buffer > 0 lets
+# the simulation run up to that many samples ahead of the slowest consumer.
+def run_stream(car, consumers, interval=None, every=1, buffer=0):
+    run = stream(car, interval, every)
+    samples = buffered(run, buffer) if buffer else run
+
+    try:
+        for sample in samples:
+            for consumer in consumers:
+                consumer.send(sample)
+    finally:
+        for consumer in consumers:
+            consumer.close(run.result)
+
+    return run.result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a car with live output")
+    parser.add_argument("car", help="name of the car in cars.json")
+    parser.add_argument("--cars", default="cars.json", help="cars.json file or catalog directory")
+    parser.add_argument("--interval", type=float, default=0.1, help="seconds of simulated time between samples")
+    parser.add_argument("--every", type=int, default=None, help="steps between samples, instead of --interval")
+    parser.add_argument("--realtime", action="store_true", help="pace the terminal view to the simulated clock")
+    parser.add_argument("--quiet", action="store_true", help="no terminal view")
+    parser.add_argument("--csv", help="write the samples to this CSV file")
+    parser.add_argument("--parquet", help="write the samples to this Parquet file (needs pyarrow)")
+    parser.add_argument("--plot", action="store_true", help="live matplotlib plot")
+    parser.add_argument("--buffer", type=int, default=0, help="samples the simulation may run ahead")
+    args = parser.parse_args()
+
+    car = catalog.load_car(args.cars, args.car)
+    if car is None:
+        parser.error(f"no car named {args.car!r} in {args.cars}")
+
+    consumers = []
+    if not args.quiet:
+        consumers.append(TerminalView(realtime=args.realtime))
+    if args.csv:
+        consumers.append(CSVWriter(args.csv))
+    if args.parquet:
+        consumers.append(ParquetWriter(args.parquet))
+    if args.plot:
+        consumers.append(LiveAnimation(car["Name"]))
+
+    interval = None if args.every is not None else args.interval
+    run_stream(car, consumers, interval, args.every or 1, args.buffer)
+
+
+if __name__ == "__main__":
+    main()
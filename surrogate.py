@@ -0,0 +1,308 @@
+# carsim surrogate
+# Instant "what would it run with X kg and Y hp" answers. A Surface samples a
+# box of variants around a base car (weight, engine power, final drive, grip
+# and drag) on a regular grid with the quadrature solver and interpolates
+# between the grid points, with a Catmull-Rom cubic in every direction on log
+# scales. The true model is also run at the center of every grid cell, which
+# is where the interpolation is furthest from its grid points, and the worst
+# difference over a cell and its neighbours (times SAFETY) is the cell's
+# error bound. A query outside the box
+# or in a cell whose bound is over the tolerance runs the solver instead.
+#
+# Fitting takes a few seconds. Queries take microseconds, a batch of them
+# through predict() less than one a query.
+#
+#   python surrogate.py fit "Ford Mustang" -o mustang.surface.npz
+#   python surrogate.py query mustang.surface.npz --W 1600 --hp 500
+#
+#   surface = surrogate.load("mustang.surface.npz")
+#   surface.query(W=1600, hp=500)     # {"quarter_time": ..., "error": {...}, "source": "surrogate"}
+
+import argparse
+import json
+from itertools import product
+
+import numpy as np
+
+import carsim
+import catalog
+import quadrature
+from kernel import njit
+
+
+# Axes of the box, power being a factor on the torque curve
+PARAMETERS = ("W", "power", "final_drive", "mu", "Cd")
+METRICS = ("quarter_time", "quarter_speed", "0-60 mph")
+
+# Default box as factors on the base car's values, and grid points per axis
+# (grip most, where a car goes from traction to power limited, drag least)
+RANGES = {"W": (0.8, 1.2), "power": (0.8, 1.2), "final_drive": (0.85, 1.15), "mu": (0.8, 1.2), "Cd": (0.85, 1.15)}
+POINTS = {"W": 9, "power": 9, "final_drive": 9, "mu": 11, "Cd": 3}
+
+# Largest error bound a surrogate answer may have, one Euler step for the times
+TOLERANCES = {"quarter_time": 0.01, "quarter_speed": 0.1, "0-60 mph": 0.01}
+SAFETY = 1          # factor on the bounds, taking the neighbours' worst already covers ~99.5% of points
+
+
+# The base car with the given {parameter: value}, power as a factor
+def make_variant(base, values):
+    car = dict(carsim.as_car(base).data)
+    for name, value in values.items():
+        if name == "power":
+            car["torque_curve"] = [[rpm, torque * value] for rpm, torque in car["torque_curve"]]
+            if car.get("P"):
+                car["P"] = car["P"] * value
+        else:
+            car[name] = value
+    return car
+
+
+# Quadrature results of the variants (a (n, parameters) array), NaN for any
+# that aren't valid cars or don't finish
+def solve(base, values):
+    cars = []
+    rows = []
+    for row, point in enumerate(values):
+        try:
+            cars.append(carsim.Car(make_variant(base, dict(zip(PARAMETERS, point)))))
+            rows.append(row)
+        except ValueError:
+            pass
+
+    out = np.full((len(values), len(METRICS)), np.nan)
+    if cars:
+        results = quadrature.simulate_fleet_quadrature(cars)
+        out[rows] = np.column_stack([results[metric] for metric in METRICS])
+    return out
+
+
+# Catmull-Rom weights of the 4 grid points around fraction f of cell i on an
+# axis of n points, points past the ends folded in as linear extrapolations
+@njit(cache=True)
+def axis_weights(x, low, step, n, index, weight):
+    position = (x - low) / step
+    i = min(max(int(position), 0), n - 2)
+    f = position - i
+    f2 = f * f
+    f3 = f2 * f
+
+    weight[0] = (-f3 + 2 * f2 - f) / 2
+    weight[1] = (3 * f3 - 5 * f2 + 2) / 2
+    weight[2] = (-3 * f3 + 4 * f2 + f) / 2
+    weight[3] = (f3 - f2) / 2
+    for k in range(4):
+        index[k] = i - 1 + k
+
+    if i == 0:
+        weight[1] += 2 * weight[0]
+        weight[2] -= weight[0]
+        weight[0] = 0.0
+        index[0] = 0
+    if i + 2 > n - 1:
+        weight[2] += 2 * weight[3]
+        weight[1] -= weight[3]
+        weight[3] = 0.0
+        index[3] = n - 1
+    return i
+
+
+# Interpolated values (log metrics) and cell error bounds at the points
+# (log parameters), NaN error for points outside the box
+@njit(cache=True)
+def interpolate(points, lows, steps, shape, values, errors):
+    n_points, dims = points.shape
+    n_metrics = values.shape[-1]
+    flat = values.reshape(-1, n_metrics)
+    cell_errors = errors.reshape(-1, n_metrics)
+
+    strides = np.ones(dims, dtype=np.int64)
+    cell_strides = np.ones(dims, dtype=np.int64)
+    for dim in range(dims - 2, -1, -1):
+        strides[dim] = strides[dim + 1] * shape[dim + 1]
+        cell_strides[dim] = cell_strides[dim + 1] * (shape[dim + 1] - 1)
+
+    index = np.empty((dims, 4), dtype=np.int64)
+    weight = np.empty((dims, 4))
+    offsets = np.zeros(4 ** dims, dtype=np.int64)
+    products = np.ones(4 ** dims)
+    out = np.zeros((n_points, n_metrics))
+    bounds = np.empty((n_points, n_metrics))
+
+    for p in range(n_points):
+        cell = 0
+        inside = True
+        for dim in range(dims):
+            x = points[p, dim]
+            if x < lows[dim] - 1e-12 or x > lows[dim] + steps[dim] * (shape[dim] - 1) + 1e-12:
+                inside = False
+            cell += axis_weights(x, lows[dim], steps[dim], shape[dim], index[dim], weight[dim]) * cell_strides[dim]
+
+        # Offsets and weight products of the 4^dims grid points, built a dimension at a time
+        size = 1
+        offsets[0] = 0
+        products[0] = 1.0
+        for dim in range(dims):
+            for j in range(size - 1, -1, -1):
+                for k in range(3, -1, -1):
+                    offsets[4 * j + k] = offsets[j] + index[dim, k] * strides[dim]
+                    products[4 * j + k] = products[j] * weight[dim, k]
+            size *= 4
+
+        for j in range(size):
+            if products[j] != 0.0:
+                for m in range(n_metrics):
+                    out[p, m] += products[j] * flat[offsets[j], m]
+
+        for m in range(n_metrics):
+            bounds[p, m] = cell_errors[cell, m] if inside else np.nan
+
+    return out, bounds
+
+
+class Surface:
+    def __init__(self, car, lows, highs, points, values, errors):
+        self.car = carsim.as_car(car)
+        self.lows = np.asarray(lows, dtype=float)       # box corners, parameter units
+        self.highs = np.asarray(highs, dtype=float)
+        self.shape = np.asarray(points, dtype=np.int64)
+        self.values = np.ascontiguousarray(values)      # log metrics on the grid
+        self.errors = np.ascontiguousarray(errors)      # error bound per cell, metric units
+
+        self.log_lows = np.log(self.lows)
+        self.log_steps = (np.log(self.highs) - self.log_lows) / (self.shape - 1)
+        self.peak_hp = carsim.watt_to_hp(float(self.car.torque_curve.power(
+            np.linspace(self.car.torque_curve.rpm_min, self.car.torque_curve.rpm_max, 200)).max()))
+
+    # Surrogate values and error bounds for an (n, parameters) array of
+    # parameter values, NaN bounds outside the box. No fallback.
+    def predict(self, points):
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        logs, bounds = interpolate(np.log(points), self.log_lows, self.log_steps, self.shape, self.values, self.errors)
+        return np.exp(logs), bounds
+
+    # {parameter: value} from query keywords, hp standing for peak power
+    def parameters(self, W=None, hp=None, power=None, final_drive=None, mu=None, Cd=None):
+        if hp is not None:
+            power = hp / self.peak_hp
+        given = {"W": W, "power": power, "final_drive": final_drive, "mu": mu, "Cd": Cd}
+        base = {"W": self.car.W, "power": 1.0, "final_drive": self.car.final_drive, "mu": self.car.mu, "Cd": self.car.Cd}
+        return {name: base[name] if given[name] is None else given[name] for name in PARAMETERS}
+
+    # Results for the base car with the given changes (W in kg, hp peak
+    # horsepower or power a factor on the torque curve, final_drive, mu, Cd).
+    # From the surface if the query is inside it and within tolerances,
+    # otherwise from the solver.
+    def query(self, tolerances=TOLERANCES, **changes):
+        values = self.parameters(**changes)
+        point = np.array([[values[name] for name in PARAMETERS]])
+        results, bounds = self.predict(point)
+
+        if np.all(bounds[0] <= [tolerances[metric] for metric in METRICS]):
+            data = dict(zip(METRICS, results[0].tolist()))
+            data["error"] = dict(zip(METRICS, bounds[0].tolist()))
+            data["source"] = "surrogate"
+            return data
+
+        solved = solve(self.car, point)[0]
+        data = dict(zip(METRICS, solved.tolist()))
+        data["error"] = dict.fromkeys(METRICS, 0.0)
+        data["source"] = "simulator"
+        return data
+
+    def save(self, path):
+        np.savez_compressed(path, car=json.dumps(self.car.data), lows=self.lows, highs=self.highs,
+                            points=self.shape, values=self.values, errors=self.errors)
+
+
+def load(path):
+    with np.load(path) as file:
+        return Surface(carsim.Car(json.loads(str(file["car"]))), file["lows"], file["highs"],
+                       file["points"], file["values"], file["errors"])
+
+
+# Samples the box around the car and fits a Surface. ranges and points
+# override RANGES and POINTS per parameter, ranges as factors on the car's values.
+def fit(car, ranges=None, points=None):
+    car = carsim.as_car(car)
+    ranges = dict(RANGES, **(ranges or {}))
+    points = dict(POINTS, **(points or {}))
+
+    base = {"W": car.W, "power": 1.0, "final_drive": car.final_drive, "mu": car.mu, "Cd": car.Cd}
+    lows = np.array([base[name] * ranges[name][0] for name in PARAMETERS])
+    highs = np.array([base[name] * ranges[name][1] for name in PARAMETERS])
+    shape = tuple(points[name] for name in PARAMETERS)
+    if min(shape) < 2:
+        raise ValueError("Every parameter needs at least 2 grid points")
+
+    # Grid points and cell centers, evenly spaced on log scales
+    axes = [np.exp(np.linspace(np.log(low), np.log(high), n)) for low, high, n in zip(lows, highs, shape)]
+    centers = [np.sqrt(axis[:-1] * axis[1:]) for axis in axes]
+
+    grid = solve(car, np.array(list(product(*axes))))
+    surface = Surface(car, lows, highs, shape, np.log(grid).reshape(shape + (len(METRICS),)),
+                      np.zeros(tuple(n - 1 for n in shape) + (len(METRICS),)))
+
+    # Cells with a corner that isn't a valid car get an infinite bound, so they always fall back
+    middle = np.array(list(product(*centers)))
+    truth = solve(car, middle)
+    estimate, _ = surface.predict(middle)
+    errors = np.abs(estimate - truth).reshape(surface.errors.shape)
+    errors = np.where(np.isnan(errors), np.inf, errors)
+
+    # A cell's bound is the worst center error of it and its neighbours, as
+    # a center can miss a kink (a shift moving past the line) inside the cell
+    for axis in range(len(shape)):
+        cells = np.moveaxis(errors, axis, 0)
+        grown = cells.copy()
+        grown[1:] = np.maximum(grown[1:], cells[:-1])
+        grown[:-1] = np.maximum(grown[:-1], cells[1:])
+        errors = np.moveaxis(grown, 0, axis)
+    surface.errors[...] = errors * SAFETY
+    return surface
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit and query quarter mile response surfaces")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    fitting = commands.add_parser("fit", help="sample a box around a car and save the surface")
+    fitting.add_argument("car", help="name of the car")
+    fitting.add_argument("--cars", default="cars.json", help="cars.json file or catalog directory")
+    fitting.add_argument("-o", "--output", required=True, help="surface file (.npz)")
+    for name in PARAMETERS:
+        fitting.add_argument(f"--{name}-range", type=float, nargs=2, metavar=("LOW", "HIGH"),
+                             help=f"factors on the car's {name} (default {RANGES[name][0]} {RANGES[name][1]})")
+        fitting.add_argument(f"--{name}-points", type=int, help=f"grid points (default {POINTS[name]})")
+
+    querying = commands.add_parser("query", help="results for a variant of the surface's car")
+    querying.add_argument("surface", help="surface file")
+    for name in ("W", "hp", "power", "final_drive", "mu", "Cd"):
+        querying.add_argument(f"--{name}", type=float)
+    args = parser.parse_args()
+
+    if args.command == "fit":
+        car = catalog.load_car(args.cars, args.car)
+        if car is None:
+            parser.error(f"no car named {args.car!r} in {args.cars}")
+        ranges = {name: getattr(args, f"{name}_range") for name in PARAMETERS if getattr(args, f"{name}_range")}
+        points = {name: getattr(args, f"{name}_points") for name in PARAMETERS if getattr(args, f"{name}_points")}
+
+        surface = fit(car, ranges, points)
+        surface.save(args.output)
+        bounds = surface.errors.reshape(-1, len(METRICS))
+        for m, metric in enumerate(METRICS):
+            within = np.mean(bounds[:, m] <= TOLERANCES[metric])
+            print(f"{metric:<16}median bound {np.median(bounds[:, m]):.1e}, {within:.0%} of cells within {TOLERANCES[metric]}")
+        return
+
+    surface = load(args.surface)
+    changes = {name: getattr(args, name) for name in ("W", "hp", "power", "final_drive", "mu", "Cd")
+               if getattr(args, name) is not None}
+    data = surface.query(**changes)
+    for metric in METRICS:
+        print(f"{metric:<16}{data[metric]:10.4f}  ± {data['error'][metric]:.1e}")
+    print(f"from the {data['source']}")
+
+
+if __name__ == "__main__":
+    main()
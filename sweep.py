@@ -0,0 +1,205 @@
+# carsim parameter sweeps
+# "What if" runs over a base car: grids or Latin hypercube samples over any
+# numeric field, including single entries of a list field like gear_ratios[3].
+# Variants are generated lazily and go through the fleet runner a chunk at a
+# time, so a sweep of 100k+ variants never holds more than the chunks in
+# flight. Results are written out as a CSV table as they arrive.
+#
+#   python sweep.py "Honda Accord" --grid "final_drive*=0.85:1.1:11" --grid "W+=-50:0:2" -o sweep.csv
+#   python sweep.py "Ford Mustang" --lhs mu=0.6:1.0 --lhs "gear_ratios[0]=3:4" --samples 100000
+
+import argparse
+import csv
+import re
+import sys
+from itertools import product
+
+import numpy as np
+
+import carsim
+import catalog
+import fleet
+
+
+FIELD_PATTERN = re.compile(r"^(?P<name>[^\[\]]+)(\[(?P<index>-?\d+)\])?$")
+
+
+# "gear_ratios[3]" -> ("gear_ratios", 3), "W" -> ("W", None)
+def parse_field(path):
+    match = FIELD_PATTERN.match(path)
+    if match is None:
+        raise ValueError(f"Can't parse field {path!r}, expected name or name[index]")
+    index = match.group("index")
+    return match.group("name"), None if index is None else int(index)
+
+
+def get_field(car, path):
+    name, index = parse_field(path)
+    return car[name] if index is None else car[name][index]
+
+
+# Copy of the base car's fields with the given {path: value} applied.
+# List fields are copied before being changed so variants never share them.
+def make_variant(base, values):
+    car = dict(base.data) if isinstance(base, carsim.Car) else \
+        {key: value for key, value in base.items() if not key.startswith("_")}
+
+    for path, value in values.items():
+        name, index = parse_field(path)
+        if index is None:
+            car[name] = value
+        else:
+            car[name] = list(car[name])
+            car[name][index] = value
+
+    return car
+
+
+# Every combination of the axes ({path: values}), as (values, car) pairs
+def grid(base, axes):
+    paths = list(axes)
+    for combination in product(*(axes[path] for path in paths)):
+        values = dict(zip(paths, combination))
+        yield values, make_variant(base, values)
+
+
+# n Latin hypercube samples over {path: (low, high)}, as (values, car) pairs.
+# The sample matrix is n x fields floats, the cars themselves are made lazily.
+def latin_hypercube(base, bounds, n, seed=None):
+    rng = np.random.default_rng(seed)
+    paths = list(bounds)
+
+    samples = np.empty((n, len(paths)))
+    for column, path in enumerate(paths):
+        low, high = bounds[path]
+        strata = (rng.permutation(n) + rng.random(n)) / n
+        samples[:, column] = low + strata * (high - low)
+
+    for row in samples:
+        values = dict(zip(paths, row.tolist()))
+        yield values, make_variant(base, values)
+
+
+# Runs (values, car) pairs through the fleet runner. Yields (variant number,
+# values, result row) in completion order; only the values of the chunks in
+# flight are kept around.
+def run_sweep(variants, workers=None, chunk_size=1024):
+    in_flight = {}
+
+    def cars():
+        for i, (values, car) in enumerate(variants):
+            in_flight[i] = values
+            yield car
+
+    for start, results in fleet.run_fleet(cars(), workers, chunk_size):
+        for i, row in enumerate(results, start):
+            yield i, in_flight.pop(i), row
+
+
+# Writes the sweep as CSV, one row per variant (in completion order, the
+# variant column gives the generation order). Returns the number of rows.
+def write_sweep(variants, paths, file, workers=None, chunk_size=1024):
+    writer = csv.writer(file)
+    writer.writerow(["variant"] + list(paths) + list(fleet.RESULT_DTYPE.names))
+
+    rows = 0
+    for i, values, row in run_sweep(variants, workers, chunk_size):
+        writer.writerow([i] + [values[path] for path in paths] + [float(row[name]) for name in fleet.RESULT_DTYPE.names])
+        rows += 1
+
+    return rows
+
+
+# Runs the sweep into a resultstore.ResultStore, one summary row per variant
+# with a column per swept field. Run ids carry on from the rows already in the
+# store, variant i getting len(store) + i. Rows go over a chunk at a time, the
+# store writes them on its own thread.
+def store_sweep(variants, paths, store, workers=None, chunk_size=1024):
+    in_flight = {}
+    first = len(store)
+
+    def cars():
+        for i, (values, car) in enumerate(variants):
+            in_flight[i] = values
+            yield car
+
+    rows = 0
+    with store.writer() as writer:
+        for start, results in fleet.run_fleet(cars(), workers, chunk_size):
+            columns = {name: results[name] for name in results.dtype.names}
+            values = [in_flight.pop(i) for i in range(start, start + len(results))]
+            for path in paths:
+                columns[path] = [value[path] for value in values]
+            writer.append(columns, first + start)
+            rows += len(results)
+
+    return rows
+
+
+# CLI axis specs. "field=a:b:n" is n values from a to b, "field=a,b,c" a list.
+# "field*=" scales the base value and "field+=" offsets it instead.
+def parse_axis(spec, base):
+    match = re.match(r"^(?P<path>[^=*+]+)(?P<op>[*+]?)=(?P<values>.+)$", spec)
+    if match is None:
+        raise ValueError(f"Can't parse {spec!r}, expected field=a:b:n or field=a,b,c")
+
+    path, op, text = match.group("path"), match.group("op"), match.group("values")
+    if ":" in text:
+        parts = text.split(":")
+        values = np.linspace(float(parts[0]), float(parts[1]), int(parts[2]) if len(parts) > 2 else 2).tolist()
+    else:
+        values = [float(x) for x in text.split(",")]
+
+    value = get_field(base, path)
+    if op == "*":
+        values = [value * x for x in values]
+    elif op == "+":
+        values = [value + x for x in values]
+
+    return path, values
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep a car's parameters and write a results table")
+    parser.add_argument("car", help="name of the base car in cars.json")
+    parser.add_argument("--cars", default="cars.json", help="cars.json file or catalog directory")
+    parser.add_argument("--grid", action="append", default=[], help="field=a:b:n, field=a,b,c, field*=... or field+=...")
+    parser.add_argument("--lhs", action="append", default=[], help="field=low:high, sampled by Latin hypercube")
+    parser.add_argument("--samples", type=int, default=1000, help="Latin hypercube samples")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=1024)
+    parser.add_argument("-o", "--output", default="-", help="CSV file (default: stdout)")
+    parser.add_argument("--store", help="write to this resultstore directory instead of CSV")
+    args = parser.parse_args()
+
+    base = catalog.load_car(args.cars, args.car)
+    if base is None:
+        parser.error(f"no car named {args.car!r} in {args.cars}")
+    if bool(args.grid) == bool(args.lhs):
+        parser.error("give either --grid or --lhs axes")
+
+    if args.grid:
+        axes = dict(parse_axis(spec, base) for spec in args.grid)
+        variants = grid(base, axes)
+        paths = list(axes)
+    else:
+        bounds = dict(parse_axis(spec, base) for spec in args.lhs)
+        bounds = {path: (min(values), max(values)) for path, values in bounds.items()}
+        variants = latin_hypercube(base, bounds, args.samples, args.seed)
+        paths = list(bounds)
+
+    if args.store:
+        import resultstore
+        rows = store_sweep(variants, paths, resultstore.ResultStore(args.store, paths), args.workers, args.chunk_size)
+        print(f"{rows} variants written to {args.store}")
+    elif args.output == "-":
+        write_sweep(variants, paths, sys.stdout, args.workers, args.chunk_size)
+    else:
+        with open(args.output, "w", newline="") as file:
+            rows = write_sweep(variants, paths, file, args.workers, args.chunk_size)
+        print(f"{rows} variants written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
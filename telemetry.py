@@ -0,0 +1,69 @@
+# carsim telemetry
+# Per step recording for simulate_quarter_mile. Each column is a flat
+# array('d') preallocated for the expected run length and doubled (by at
+# least a chunk) when a run outgrows it, so a step costs 8 bytes per column instead of a list slot and a
+# Python float object.
+
+from array import array
+
+import numpy as np
+
+
+# Column names, same keys simulate_quarter_mile has always returned
+COLUMNS = ("time_data", "acceleration_data", "velocity_data", "distance_data", "power_data", "rpm_data")
+
+
+class Telemetry:
+    # typecode "f" halves the memory again if float32 precision is enough
+    def __init__(self, capacity=1024, chunk=256, typecode="d"):
+        self.typecode = typecode
+        self.chunk = chunk
+        self.capacity = max(int(capacity), 1)
+        self.n = 0
+        self.columns = [array(typecode, bytes(self.capacity * array(typecode).itemsize)) for _ in COLUMNS]
+
+    def __len__(self):
+        return self.n
+
+    def append(self, t, a, v, d, power, rpm):
+        n = self.n
+        if n == self.capacity:
+            self.grow()
+
+        time_data, acceleration_data, velocity_data, distance_data, power_data, rpm_data = self.columns
+        time_data[n] = t
+        acceleration_data[n] = a
+        velocity_data[n] = v
+        distance_data[n] = d
+        power_data[n] = power
+        rpm_data[n] = rpm
+        self.n = n + 1
+
+    # New arrays rather than extend() so views handed out earlier stay valid.
+    # Doubling keeps the copying linear in the run length however far off the
+    # first estimate was.
+    def grow(self):
+        extra = max(self.chunk, self.capacity)
+        padding = array(self.typecode, bytes(extra * array(self.typecode).itemsize))
+        self.columns = [column + padding for column in self.columns]
+        self.capacity += extra
+
+    def clear(self):
+        self.n = 0
+
+    # A new Telemetry holding the first n steps of this one, to carry on recording from there
+    def head(self, n, capacity=None):
+        copy = Telemetry(max(n, capacity or 0), self.chunk, self.typecode)
+        copy.columns = [column[:n] + copy_column[n:] for column, copy_column in zip(self.columns, copy.columns)]
+        copy.n = n
+        return copy
+
+    # Bytes actually held, including the unused tail
+    @property
+    def nbytes(self):
+        return sum(column.buffer_info()[1] * column.itemsize for column in self.columns)
+
+    # Zero copy numpy views of the recorded steps, keyed like COLUMNS
+    def data(self):
+        return {name: np.frombuffer(column, dtype=column.typecode, count=self.n)
+                for name, column in zip(COLUMNS, self.columns)}